@@ -0,0 +1,681 @@
+# CompactTree.py
+
+"""
+a tree stored as parallel arrays, with TreeNode views into it
+"""
+
+import pickle, pytest
+from array import array
+
+from myutils import cleanup_testcode, rmPrefix
+from TreeNode import TreeNode, LazyValue, checkLabel, lGeneration
+
+# ---------------------------------------------------------------------------
+
+class CompactTree():
+	# --- Node i of the tree is row i of these columns, where -1 means
+	#     no node:
+	#        lParent, lFirstChild, lNextSibling, lLastChild - node indexes
+	#        lNumChildren - number of children
+	#        lLevel       - 0 for nodes with no parent, else 1 more
+	#                       than the parent's level
+	#        lLabels      - the labels
+	#        hExtra       - {index: {key: value}} for keys other than
+	#                       'label', e.g. 'lHereDoc'
+	#        hClassified  - {index: classifyChildren() result}, since
+	#                       it can't be kept on a CompactNode view
+	#        generation   - the generation (see TreeNode.lGeneration)
+	#                       of every node in the tree
+	#
+	#     A node costs 24 bytes of arrays plus a list entry, instead of
+	#     a TreeNode object with a dict, and a tree pickles as a few
+	#     arrays, so it's cheap to send to another process.
+	#
+	#     CompactNode objects are views of single nodes, created as
+	#     needed. Pass newNode as the constructor to build one with
+	#     the parser, e.g.
+	#
+	#        tree = CompactTree()
+	#        (root, hSubTrees) = parsePLL(text, tree.newNode)
+
+	def __init__(self):
+
+		self.lParent = array('i')
+		self.lFirstChild = array('i')
+		self.lNextSibling = array('i')
+		self.lLastChild = array('i')
+		self.lNumChildren = array('i')
+		self.lLevel = array('i')
+		self.lLabels = []
+		self.hExtra = {}
+		self.hClassified = {}
+		self.generation = 0
+
+	# ------------------------------------------------------------------------
+
+	def newNode(self, label):
+		# --- Adds a node with no parent, children or siblings
+
+		checkLabel(label)
+		index = len(self.lLabels)
+		self.lLabels.append(label)
+		for lColumn in (self.lParent, self.lFirstChild, self.lNextSibling,
+		                self.lLastChild):
+			lColumn.append(-1)
+		self.lNumChildren.append(0)
+		self.lLevel.append(0)
+		return CompactNode(self, index)
+
+	# ------------------------------------------------------------------------
+
+	def node(self, index):
+
+		if not (0 <= index < len(self.lLabels)):
+			raise IndexError(f"CompactTree: no node {index}")
+		return CompactNode(self, index)
+
+	# ------------------------------------------------------------------------
+
+	def extend(self, other):
+		# --- Adds all of the nodes of other, another CompactTree, with
+		#     the same links between them, but none to this tree's
+		#     nodes. Node i of other becomes node offset + i, where
+		#     offset, the number of nodes before, is returned.
+		#     Works on whole columns, so it's much faster than
+		#     adding the nodes one at a time
+
+		offset = len(self.lLabels)
+		for name in ('lParent', 'lFirstChild', 'lNextSibling', 'lLastChild'):
+			lColumn = getattr(other, name)
+			if offset != 0:
+				lColumn = array('i', [-1 if (i == -1) else i + offset
+				                      for i in lColumn])
+			getattr(self, name).extend(lColumn)
+		self.lNumChildren.extend(other.lNumChildren)
+		self.lLevel.extend(other.lLevel)
+		self.lLabels.extend(other.lLabels)
+		for (index, hExtra) in other.hExtra.items():
+			self.hExtra[index + offset] = dict(hExtra)
+		self.generation = lGeneration[0]
+		return offset
+
+	# ------------------------------------------------------------------------
+
+	def copyNodes(self, index, constructor=TreeNode):
+		# --- Copies node index, its following siblings and all of
+		#     their descendents, making each node with constructor
+		#     Returns a list with the copy of node i at position i,
+		#     or None for nodes that weren't copied
+
+		lLabels = self.lLabels
+		hExtra = self.hExtra
+		lFirstChild = self.lFirstChild
+		lNextSibling = self.lNextSibling
+
+		lNodes = [None] * len(lLabels)
+		prevTop = None
+		lStack = [(index, None)]    # (first node to copy, its parent)
+		while lStack:
+			(i, parent) = lStack.pop()
+			while i != -1:
+				node = lNodes[i] = constructor(lLabels[i])
+				hData = hExtra.get(i)
+				if hData:
+					for (key, value) in hData.items():
+						node[key] = value
+				if parent != None:
+					parent.addChildren(node)
+				else:
+					if prevTop != None:
+						prevTop.appendNode(node)
+					prevTop = node
+				if lFirstChild[i] != -1:
+					lStack.append((lNextSibling[i], parent))
+					(i, parent) = (lFirstChild[i], node)
+				else:
+					i = lNextSibling[i]
+		return lNodes
+
+	# ------------------------------------------------------------------------
+
+	def __len__(self):
+		# --- number of nodes, including any that were detached
+
+		return len(self.lLabels)
+
+	# ------------------------------------------------------------------------
+
+	def setLevel(self, index, level):
+		# --- Sets the level of node index, and of its descendents
+
+		lLevel = self.lLevel
+		delta = level - lLevel[index]
+		if delta == 0:
+			return
+		lLevel[index] = level
+		lFirstChild = self.lFirstChild
+		lNextSibling = self.lNextSibling
+		lStack = [lFirstChild[index]]
+		while lStack:
+			i = lStack.pop()
+			while i != -1:
+				lLevel[i] += delta
+				lStack.append(lFirstChild[i])
+				i = lNextSibling[i]
+
+# ---------------------------------------------------------------------------
+
+def linkProperty(name):
+	# --- An attribute of CompactNode that's stored in column name
+	#     as a node index
+
+	def getLink(self):
+		index = getattr(self.tree, name)[self.index]
+		if index == -1:
+			return None
+		return CompactNode(self.tree, index)
+
+	def setLink(self, node):
+		getattr(self.tree, name)[self.index] = \
+			-1 if (node == None) else node.index
+
+	return property(getLink, setLink)
+
+# ---------------------------------------------------------------------------
+
+class CompactNode(TreeNode):
+	# --- A view of node index in a CompactTree. Works anywhere a
+	#     TreeNode does, since parent, firstChild, etc. read and
+	#     write the tree's columns, but a new view is created each
+	#     time one is read, so compare them with ==, not 'is'
+
+	__slots__ = ('tree', 'index')
+
+	def __init__(self, tree, index):
+
+		self.tree = tree
+		self.index = index
+
+	firstChild = linkProperty('lFirstChild')
+	nextSibling = linkProperty('lNextSibling')
+	lastChild = linkProperty('lLastChild')
+
+	@property
+	def parent(self):
+		index = self.tree.lParent[self.index]
+		if index == -1:
+			return None
+		return CompactNode(self.tree, index)
+
+	@parent.setter
+	def parent(self, node):
+		tree = self.tree
+		if node == None:
+			tree.lParent[self.index] = -1
+			tree.setLevel(self.index, 0)
+		else:
+			tree.lParent[self.index] = node.index
+			tree.setLevel(self.index, tree.lLevel[node.index] + 1)
+
+	@property
+	def nChildren(self):
+		return self.tree.lNumChildren[self.index]
+
+	@nChildren.setter
+	def nChildren(self, n):
+		self.tree.lNumChildren[self.index] = n
+
+	@property
+	def level(self):
+		return self.tree.lLevel[self.index]
+
+	@property
+	def generation(self):
+		return self.tree.generation
+
+	@generation.setter
+	def generation(self, gen):
+		self.tree.generation = gen
+
+	@property
+	def classified(self):
+		return self.tree.hClassified.get(self.index)
+
+	@classified.setter
+	def classified(self, value):
+		if value == None:
+			self.tree.hClassified.pop(self.index, None)
+		else:
+			self.tree.hClassified[self.index] = value
+
+	# ------------------------------------------------------------------------
+
+	def __eq__(self, other):
+		if not isinstance(other, CompactNode):
+			return NotImplemented
+		return (self.tree is other.tree) and (self.index == other.index)
+
+	def __hash__(self):
+		return hash((id(self.tree), self.index))
+
+	def __bool__(self):
+		return True
+
+	def __reduce__(self):
+		# --- Only the tree and index - TreeNode's slots aren't used
+		return (CompactNode, (self.tree, self.index))
+
+	def __repr__(self):
+		return f"CompactNode({self.index}, {self.asDebugString()})"
+
+	# ------------------------------------------------------------------------
+
+	def addChildren(self, newNode):
+		# --- Same as TreeNode.addChildren(), but on the columns
+		assert newNode.tree is self.tree
+
+		tree = self.tree
+		tree.generation = lGeneration[0]
+		lParent = tree.lParent
+		lNextSibling = tree.lNextSibling
+		index = self.index
+		if tree.hClassified:
+			tree.hClassified.pop(index, None)
+		level = tree.lLevel[index] + 1
+
+		n = 1
+		last = newNode.index
+		lParent[last] = index
+		tree.setLevel(last, level)
+		while lNextSibling[last] != -1:
+			last = lNextSibling[last]
+			lParent[last] = index
+			tree.setLevel(last, level)
+			n += 1
+
+		prev = tree.lLastChild[index]
+		if prev != -1:
+			lNextSibling[prev] = newNode.index
+		else:
+			tree.lFirstChild[index] = newNode.index
+		tree.lLastChild[index] = last
+		tree.lNumChildren[index] += n
+
+	def appendNode(self, newNode):
+		assert newNode.tree is self.tree
+
+		tree = self.tree
+		parent = tree.lParent[self.index]
+		if parent != -1:
+			CompactNode(tree, parent).addChildren(newNode)
+		else:
+			lNextSibling = tree.lNextSibling
+			i = self.index
+			while lNextSibling[i] != -1:
+				i = lNextSibling[i]
+			lNextSibling[i] = newNode.index
+		return self    # allow chaining
+
+	def replaceWith(self, newNode, prevSibling=None):
+		# --- TreeNode.replaceWith() compares nodes with 'is'
+		assert isinstance(newNode, CompactNode)
+		assert newNode.tree is self.tree
+
+		tree = self.tree
+		tree.generation = lGeneration[0]
+		index = self.index
+		parent = tree.lParent[index]
+		if tree.hClassified:
+			tree.hClassified.pop(parent, None)
+		if (prevSibling is None) and (parent != -1) \
+				and (tree.lFirstChild[parent] != index):
+			prev = tree.lFirstChild[parent]
+			while tree.lNextSibling[prev] != index:
+				prev = tree.lNextSibling[prev]
+		else:
+			prev = -1 if (prevSibling is None) else prevSibling.index
+
+		newNode.parent = self.parent
+		tree.lNextSibling[newNode.index] = tree.lNextSibling[index]
+		if prev != -1:
+			assert tree.lNextSibling[prev] == index
+			tree.lNextSibling[prev] = newNode.index
+		elif parent != -1:
+			tree.lFirstChild[parent] = newNode.index
+		if (parent != -1) and (tree.lLastChild[parent] == index):
+			tree.lLastChild[parent] = newNode.index
+
+		self.parent = None
+		tree.lNextSibling[index] = -1
+		return newNode    # allow chaining
+
+	def detach(self):
+		# --- TreeNode.detach() compares nodes with 'is'
+
+		tree = self.tree
+		index = self.index
+		parent = tree.lParent[index]
+		if parent == -1:
+			return self
+		tree.generation = lGeneration[0]
+		if tree.hClassified:
+			tree.hClassified.pop(parent, None)
+		lNextSibling = tree.lNextSibling
+		if tree.lFirstChild[parent] == index:
+			prev = -1
+			tree.lFirstChild[parent] = lNextSibling[index]
+		else:
+			prev = tree.lFirstChild[parent]
+			while lNextSibling[prev] != index:
+				prev = lNextSibling[prev]
+			lNextSibling[prev] = lNextSibling[index]
+		if tree.lLastChild[parent] == index:
+			tree.lLastChild[parent] = prev
+		tree.lNumChildren[parent] -= 1
+
+		self.parent = None
+		lNextSibling[index] = -1
+		return self    # allow chaining
+
+	def insertBefore(self, newNode):
+		# --- TreeNode.insertBefore() compares nodes with 'is'
+		assert isinstance(newNode, CompactNode)
+		assert newNode.tree is self.tree
+
+		tree = self.tree
+		index = self.index
+		new = newNode.index
+		assert (tree.lParent[new] == -1) and (tree.lNextSibling[new] == -1)
+		parent = tree.lParent[index]
+		assert parent != -1
+		tree.generation = lGeneration[0]
+		if tree.hClassified:
+			tree.hClassified.pop(parent, None)
+		lNextSibling = tree.lNextSibling
+		if tree.lFirstChild[parent] == index:
+			tree.lFirstChild[parent] = new
+		else:
+			prev = tree.lFirstChild[parent]
+			while lNextSibling[prev] != index:
+				prev = lNextSibling[prev]
+			lNextSibling[prev] = new
+		lNextSibling[new] = index
+		newNode.parent = CompactNode(tree, parent)
+		tree.lNumChildren[parent] += 1
+		return newNode    # allow chaining
+
+	def newNode(self, label):
+		return self.tree.newNode(label)
+
+	def append(self, label):
+		self.appendNode(self.tree.newNode(label))
+		return self    # allow chaining
+
+	def appendChild(self, label):
+		self.appendChildNode(self.tree.newNode(label))
+		return self    # allow chaining
+
+	@classmethod
+	def load(cls, fh, key=None, tree=None):
+		# --- Same as TreeNode.load(), but the nodes are added to tree,
+		#     or to a new CompactTree, since a CompactNode can't be
+		#     created from just a label
+
+		if tree == None:
+			tree = CompactTree()
+		from TreeFile import readTreeFile
+		return readTreeFile(fh, tree.newNode, key)
+
+	# ------------------------------------------------------------------------
+	# --- These methods allow us to treat a CompactNode object as a dict
+
+	def __getitem__(self, key):
+		if key == 'label':
+			return self.tree.lLabels[self.index]
+		hExtra = self.tree.hExtra.get(self.index)
+		if hExtra == None:
+			raise KeyError(key)
+		value = hExtra[key]
+		if isinstance(value, LazyValue):
+			value = hExtra[key] = value.get()
+		return value
+
+	def __setitem__(self, key, value):
+		if key == 'label':
+			self.labelChanged()
+			self.tree.lLabels[self.index] = value
+		else:
+			self.tree.hExtra.setdefault(self.index, {})[key] = value
+
+	def __delitem__(self, key):
+		if key == 'label':
+			raise KeyError("CompactNode: the label cannot be deleted")
+		hExtra = self.tree.hExtra.get(self.index)
+		if hExtra == None:
+			raise KeyError(key)
+		del hExtra[key]
+
+	def __contains__(self, key):
+		if key == 'label':
+			return True
+		hExtra = self.tree.hExtra.get(self.index)
+		return (hExtra != None) and (key in hExtra)
+
+	def __len__(self):
+		hExtra = self.tree.hExtra.get(self.index)
+		if hExtra == None:
+			return 1
+		return 1 + len(hExtra)
+
+	def __iter__(self):
+		yield 'label'
+		hExtra = self.tree.hExtra.get(self.index)
+		if hExtra != None:
+			yield from hExtra
+
+	# ------------------------------------------------------------------------
+	# --- These work on the columns directly, rather than
+	#     through the properties
+
+	def children(self):
+
+		tree = self.tree
+		lNextSibling = tree.lNextSibling
+		i = tree.lFirstChild[self.index]
+		while i != -1:
+			yield CompactNode(tree, i)
+			i = lNextSibling[i]
+
+	def descendents(self, level=0):
+
+		tree = self.tree
+		for (lvl, i) in self.descendentIndexes(level):
+			yield (lvl, CompactNode(tree, i))
+
+	def descendentIndexes(self, level=0):
+		# --- Like descendents(), but yields (level, index)
+
+		tree = self.tree
+		lFirstChild = tree.lFirstChild
+		lNextSibling = tree.lNextSibling
+
+		yield (level, self.index)
+		lStack = [lFirstChild[self.index]]
+		while lStack:
+			i = lStack[-1]
+			if i == -1:
+				lStack.pop()
+				if lStack:
+					lStack[-1] = lNextSibling[lStack[-1]]
+				continue
+			yield (level + len(lStack), i)
+			lStack.append(lFirstChild[i])
+
+	def asString(self, level=0, indent='\t', *, pll=False):
+
+		if pll:
+			return super().asString(level, indent, pll=True)
+		lLabels = self.tree.lLabels
+		lNextSibling = self.tree.lNextSibling
+		lLines = []
+		cur = self
+		while cur != None:
+			for (level, i) in cur.descendentIndexes():
+				lLines.append((indent * level) + lLabels[i] + '\n')
+			i = lNextSibling[cur.index]
+			cur = None if (i == -1) else CompactNode(self.tree, i)
+		return ''.join(lLines)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+s = '''
+	App
+		* menubar
+			align = left
+			file <<<
+				some text
+
+		row
+			EditField
+				width = 100
+			Button
+	'''
+
+def test_1():
+	tree = CompactTree()
+	root = tree.newNode('top')
+	peach = tree.newNode('peach').makeChildOf(root)
+	tree.newNode('fuzzy navel').makeChildOf(peach)
+	peach.appendChild('pink')
+	root.appendChild('apple')
+	root.lastChild.appendChild('red')
+
+	assert isinstance(root, TreeNode)
+	assert len(tree) == 6
+	assert root.asString() == rmPrefix('''
+		top
+			peach
+				fuzzy navel
+				pink
+			apple
+				red
+		''')
+	assert [n['label'] for n in root.children()] == ['peach', 'apple']
+	assert root.numChildren() == 2
+	assert root.lastChild.firstChild.level == 2
+	assert root.lastChild.firstChild.parent.parent == root
+	assert root.numNodes() == 6
+
+def test_2():
+	from PLLParser import parsePLL
+
+	(tree1, h1) = parsePLL(s)
+	tree = CompactTree()
+	(tree2, h2) = parsePLL(s, tree.newNode)
+	assert isinstance(tree2, CompactNode)
+	assert tree2.asString() == tree1.asString()
+	assert [(lvl, n['label']) for (lvl, n) in tree2.descendents()] \
+	       == [(lvl, n['label']) for (lvl, n) in tree1.descendents()]
+	assert h2['menubar'].getOptions() == {'align': 'left'}
+	assert h2['menubar'].lastChild['lHereDoc'] == ['some text\n']
+	assert tree2.lastChild.firstChild.getOptions() == {'width': '100'}
+	assert list(tree.lLevel) == [0, 1, 2, 2, 1, 2, 3, 2]
+
+	# --- the split is kept in the tree, not in the views
+	row = tree2.lastChild
+	assert row.classifyChildren() is tree2.lastChild.classifyChildren()
+	assert [n['label'] for n in row.trueChildren()] == ['EditField', 'Button']
+	row.firstChild['label'] = 'x = 1'
+	assert row.getOptions() == {'x': '1'}
+	row.lastChild.replaceWith(tree.newNode('y = 2'))
+	assert row.getOptions() == {'x': '1', 'y': '2'}
+	assert row.hasTrueChildren() == False
+	row.appendChild('Label')
+	assert [n['label'] for n in row.trueChildren()] == ['Label']
+
+def test_3():
+	from PLLParser import parsePLL
+
+	tree = CompactTree()
+	(root, hSubTrees) = parsePLL(s, tree.newNode)
+	(root2, h2) = pickle.loads(pickle.dumps((root, hSubTrees)))
+	assert root2.asString() == root.asString()
+	assert h2['menubar'].parent == root2
+	assert h2['menubar'].lastChild['lHereDoc'] == ['some text\n']
+
+def test_4():
+	tree = CompactTree()
+	root = tree.newNode('root').appendChild('a').appendChild('b')
+	new = root.lastChild.replaceWith(tree.newNode('c'))
+	assert root.lastChild == new
+	assert root.firstChild.nextSibling == new
+	assert [n['label'] for n in root.children()] == ['a', 'c']
+
+	# --- moving a subtree updates the levels in it
+	sub = tree.newNode('x').appendChild('y')
+	sub.makeChildOf(new)
+	assert sub.firstChild.level == 3
+
+	node = tree.node(1)
+	node['width'] = 100
+	assert dict(node.items()) == {'label': 'a', 'width': 100}
+	del node['width']
+	assert len(node) == 1
+	with pytest.raises(KeyError):
+		node['width']
+	with pytest.raises(IndexError):
+		tree.node(len(tree))
+
+def test_5():
+	import io
+	from PLLParser import parsePLL
+
+	(root, hSubTrees) = parsePLL(s)
+	fh = io.BytesIO()
+	root.dump(fh, hSubTrees)
+
+	fh.seek(0)
+	(root2, h2) = CompactNode.load(fh)
+	assert isinstance(root2, CompactNode)
+	assert root2.asString() == root.asString()
+	assert h2['menubar'].lastChild['lHereDoc'] == ['some text\n']
+
+	# --- one marked subtree, added to an existing tree
+	tree = CompactTree()
+	tree.newNode('other')
+	fh.seek(0)
+	(menubar, h3) = CompactNode.load(fh, 'menubar', tree)
+	assert menubar.tree is tree
+	assert menubar.index == 1
+	assert menubar.getOptions() == {'align': 'left'}
+
+def test_6():
+	from PLLParser import parsePLL
+	from SlotTreeNode import SlotTreeNode
+
+	# --- extend() and copyNodes() keep the whole structure
+	(tree1, h1) = parsePLL(s + s)
+	tree = CompactTree()
+	tree.newNode('first')
+	other = CompactTree()
+	(root, h) = parsePLL(s + s, other.newNode)
+	offset = tree.extend(other)
+	assert (offset, len(tree)) == (1, 1 + len(other))
+	copy = tree.node(offset + root.index)
+	assert copy.asString() == tree1.asString()
+	assert copy.nextSibling.lastChild.parent == copy.nextSibling
+	assert copy.firstChild.lastChild['lHereDoc'] == ['some text\n']
+	assert tree.node(offset + h['menubar'].index).level == 1
+
+	lNodes = other.copyNodes(root.index, SlotTreeNode)
+	copy = lNodes[root.index]
+	assert isinstance(copy, SlotTreeNode)
+	assert copy.asString(pll=True) == tree1.asString(pll=True)
+	assert lNodes[h['menubar'].index].parent is copy.nextSibling
+	assert copy.nextSibling.lastChild.numChildren() == 2
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
@@ -21,6 +21,8 @@ class GUIApplication(ABC):
 		# --- Parse the app description into an appNode, and a hash
 		#     holding any tagged subtrees
 		(appNode, hSubTrees) = parsePLL(appDesc)
+		self.appNode = appNode
+		self.appIndex = None     # built by the first findNodes()
 
 		root = self.getMainWindow(appNode, hSubTrees)
 		self.mainWindow = root
@@ -112,6 +114,16 @@ class GUIApplication(ABC):
 
 	# ------------------------------------------------------------------------
 
+	def findNodes(self, query):
+		# --- Returns the nodes of the app description matching query,
+		#     e.g. app.findNodes('layout//button[emit=exit]')
+
+		if not self.appIndex:
+			self.appIndex = self.appNode.buildIndex()
+		return self.appNode.select(query, index=self.appIndex)
+
+	# ------------------------------------------------------------------------
+
 	def findWidgetByName(self, name):
 
 		if name in self.hWidgets:
@@ -0,0 +1,208 @@
+# HereDoc.py
+
+"""
+HEREDOC strings stored as views into the source text,
+dedented only when they're first read
+"""
+
+import io, pytest
+from itertools import repeat
+
+from myutils import cleanup_testcode, reLeadWS
+from TreeNode import TreeNode, LazyValue
+
+# ---------------------------------------------------------------------------
+
+class HereDoc():
+	# --- A view of buf[start:end], which holds complete lines, all
+	#     starting with the same prefixLen chars of indentation.
+	#     buf may be a string, a bytes, bytearray or mmap buffer
+	#     (decoded using encoding) or a list of lines, in which case
+	#     start and end are indexes into the list.
+	#
+	#     Nothing is copied until text() is called, so buf must
+	#     not be changed (or an mmap closed) before then, and every
+	#     view keeps the whole of buf alive. Call resolveHereDocs()
+	#     on a tree to copy the text of all of its HEREDOCs, e.g.
+	#     before closing an mmap that was parsed
+
+	__slots__ = ('buf', 'start', 'end', 'prefixLen', 'encoding')
+
+	def __init__(self, buf, start, end, prefixLen, encoding='utf-8'):
+
+		self.buf = buf
+		self.start = start
+		self.end = end
+		self.prefixLen = prefixLen
+		self.encoding = encoding
+
+	# ------------------------------------------------------------------------
+
+	def text(self):
+		# --- Returns the lines, with the prefix removed from each one
+		#     Since every line starts with the same prefix, that's just
+		#     the first one, plus each one following a '\n'
+
+		buf = self.buf
+		if isinstance(buf, list):
+			s = ''.join(buf[self.start:self.end])
+		else:
+			s = buf[self.start:self.end]
+			if not isinstance(s, str):
+				s = s.decode(self.encoding)
+
+		n = self.prefixLen
+		if (n == 0) or not s:
+			return s
+		return s[n:].replace('\n' + s[:n], '\n')
+
+	# ------------------------------------------------------------------------
+
+	def __str__(self):
+
+		return self.text()
+
+# ---------------------------------------------------------------------------
+
+class HereDocList(LazyValue):
+	# --- The value stored in a node's 'lHereDoc' key by the parser
+	#     Reading node['lHereDoc'] replaces it with a list of strings
+
+	__slots__ = ('lHereDocs',)
+
+	def __init__(self, lHereDocs):
+
+		self.lHereDocs = lHereDocs
+
+	def get(self):
+
+		return [hereDoc.text() for hereDoc in self.lHereDocs]
+
+	def __len__(self):
+
+		return len(self.lHereDocs)
+
+	def __eq__(self, other):
+
+		if isinstance(other, HereDocList):
+			other = other.get()
+		return self.get() == other
+
+	__hash__ = None
+
+	def __reduce__(self):
+		# --- Pickle the strings, not the whole source buffer
+
+		return (list, (self.get(),))
+
+# ---------------------------------------------------------------------------
+
+def resolveHereDocs(rootNode):
+	# --- Replaces every HereDocList in rootNode, its following
+	#     siblings and their descendents with the list of strings,
+	#     so that the tree no longer refers to the source buffer
+
+	for (level, node) in rootNode.followingNodes():
+		# --- reading the value replaces it - see LazyValue
+		if (len(node) > 1) and ('lHereDoc' in node):
+			node['lHereDoc']
+
+# ---------------------------------------------------------------------------
+
+def makeHereDoc(lLines, lineNum, source=None, start=0):
+	# --- lLines are the (non-blank) lines of one HEREDOC, the first
+	#     one being source line lineNum. They must all start with
+	#     the leading whitespace of the first line, which is removed.
+	#
+	#     If source is None, the HereDoc is a view into lLines. Otherwise,
+	#     lLines were read, unchanged, from source, which is either
+	#     a LineIndex, or a string where the first line is at start
+
+	if not lLines:
+		return HereDoc(lLines, 0, 0, 0)
+
+	result = reLeadWS.match(lLines[0])
+	prefix = result.group(1) if result else ''
+	n = len(lLines)
+	if prefix and (sum(map(str.startswith, lLines, repeat(prefix))) != n):
+		for (i, line) in enumerate(lLines):
+			if not line.startswith(prefix):
+				raise SyntaxError("Bad indentation in HEREDOC string",
+				                  (None, lineNum + i, None, line))
+
+	if source == None:
+		return HereDoc(lLines, 0, n, len(prefix))
+	elif isinstance(source, str):
+		return HereDoc(source, start, start + sum(map(len, lLines)),
+		               len(prefix))
+	else:
+		lOffsets = source.lOffsets
+		return HereDoc(source.buf, lOffsets[lineNum-1], lOffsets[lineNum-1+n],
+		               len(prefix), source.encoding)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def test_1():
+	s = 'header <<<\n\t\tline one\n\t\t\tline two\n\nnext\n'
+	assert HereDoc(s, 11, 34, 2).text() == 'line one\n\tline two\n'
+	assert str(HereDoc(s.encode('utf-8'), 11, 34, 2)) \
+	       == 'line one\n\tline two\n'
+	assert HereDoc(['\tx\n', '\ty\n'], 0, 2, 1).text() == 'x\ny\n'
+	assert HereDoc(['x\n'], 0, 1, 0).text() == 'x\n'
+
+def test_2():
+	from LineIndex import LineIndex
+
+	s = 'header <<<\n\t\tline one\n\t\t\tline two\n\nnext\n'
+	lLines = ['\t\tline one\n', '\t\t\tline two\n']
+	for hereDoc in [makeHereDoc(lLines, 2),
+	                makeHereDoc(lLines, 2, s, 11),
+	                makeHereDoc(lLines, 2, LineIndex(s)),
+	                makeHereDoc(lLines, 2, LineIndex(s.encode('utf-8')))]:
+		assert hereDoc.text() == 'line one\n\tline two\n'
+
+	with pytest.raises(SyntaxError) as info:
+		makeHereDoc(['\t\tone\n', '\ttwo\n'], 5)
+	assert info.value.lineno == 6
+	assert info.value.text == '\ttwo\n'
+
+def test_3():
+	import pickle
+
+	lHereDoc = HereDocList([HereDoc(['\tx\n'], 0, 1, 1)])
+	assert lHereDoc == ['x\n']
+	assert pickle.loads(pickle.dumps(lHereDoc)) == ['x\n']
+
+	# --- the value is replaced when first read
+	node = TreeNode('top')
+	node['lHereDoc'] = lHereDoc
+	assert node['lHereDoc'] == ['x\n']
+	assert type(node.hData['lHereDoc']) == list
+
+def test_4(tmp_path):
+	import mmap
+	from PLLParser import parsePLL
+
+	path = tmp_path / 'test.pll'
+	path.write_text('top\n\tscript <<<\n\t\tprint(1)\n\n\tnext <<<\n\t\tx\n\n')
+	for resolve in [False, True]:
+		with open(path, 'rb') as fh:
+			buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+			(tree, hSubTrees) = parsePLL(buf, hOptions={'fastLexer': True})
+			if resolve:
+				resolveHereDocs(tree)
+			buf.close()
+		script = tree.firstChild
+		if resolve:
+			assert script['lHereDoc'] == ['print(1)\n']
+			assert script.nextSibling['lHereDoc'] == ['x\n']
+		else:
+			# --- views into a closed mmap can't be read
+			with pytest.raises(ValueError):
+				script['lHereDoc']
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
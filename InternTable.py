@@ -0,0 +1,116 @@
+# InternTable.py
+
+"""
+share one string object between equal labels
+"""
+
+import sys, pytest
+
+from myutils import cleanup_testcode
+
+# ---------------------------------------------------------------------------
+
+class InternTable():
+	# --- Like sys.intern(), but the strings are only kept alive by
+	#     the table (and the trees using them), and statistics are
+	#     available - see getStats()
+	#
+	#     Pass one to PLLParser(intern=...) to share it between parses,
+	#     e.g. globalInternTable, or use intern=True for a new table
+	#     for each parser. The parser looks strings up in hStrings
+	#     directly, since a method call per label would cost more
+	#     than the lookup itself, then adds to numLookups, numHits
+	#     and savedBytes
+
+	def __init__(self):
+
+		self.hStrings = {}
+		self.numLookups = 0
+		self.numHits = 0
+		self.savedBytes = 0
+
+	# ------------------------------------------------------------------------
+
+	def intern(self, s):
+
+		self.numLookups += 1
+		result = self.hStrings.setdefault(s, s)
+		if result is not s:
+			self.numHits += 1
+			self.savedBytes += sys.getsizeof(s)
+		return result
+
+	# ------------------------------------------------------------------------
+
+	def __len__(self):
+		# --- number of distinct strings
+
+		return len(self.hStrings)
+
+	# ------------------------------------------------------------------------
+
+	def getStats(self):
+		# --- Returns a dict with keys:
+		#        lookups    - number of strings looked up
+		#        hits       - lookups that found an equal, but
+		#                     separate, string, which was replaced
+		#        savedBytes - total size of the strings that were
+		#                     replaced, i.e. the memory saved while
+		#                     the trees using the table are alive
+
+		return {
+			'lookups':    self.numLookups,
+			'hits':       self.numHits,
+			'savedBytes': self.savedBytes,
+			}
+
+	# ------------------------------------------------------------------------
+
+	def clear(self):
+
+		self.hStrings.clear()
+		self.numLookups = 0
+		self.numHits = 0
+		self.savedBytes = 0
+
+# ---------------------------------------------------------------------------
+
+globalInternTable = InternTable()
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def test_1():
+	table = InternTable()
+	s1 = table.intern(''.join(['move', ' 50']))
+	s2 = table.intern(''.join(['move', ' 50']))
+	assert s1 is s2
+	assert len(table) == 1
+
+	# --- the second copy was dropped
+	assert table.getStats() == {
+		'lookups':    2,
+		'hits':       1,
+		'savedBytes': sys.getsizeof(s1),
+		}
+
+	# --- looking up the shared string itself saves nothing
+	assert table.intern(s1) is s1
+	assert table.getStats()['hits'] == 1
+	assert table.getStats()['savedBytes'] == sys.getsizeof(s1)
+
+def test_2():
+	table = InternTable()
+	table.intern('row')
+	table.clear()
+	assert len(table) == 0
+	assert table.getStats() == {
+		'lookups':    0,
+		'hits':       0,
+		'savedBytes': 0,
+		}
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
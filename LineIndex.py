@@ -0,0 +1,174 @@
+# LineIndex.py
+
+"""
+random access to the lines in a bytes, bytearray or mmap buffer,
+or in a string
+"""
+
+import io, mmap, pytest
+from array import array
+from bisect import bisect_right
+from itertools import accumulate, islice, repeat
+from operator import add
+
+from myutils import cleanup_testcode
+
+lBufferTypes = (bytes, bytearray, mmap.mmap)
+
+# ---------------------------------------------------------------------------
+
+def isBuffer(obj):
+
+	return isinstance(obj, lBufferTypes)
+
+# ---------------------------------------------------------------------------
+
+class LineIndex():
+	# --- The offset of the start of every line is found once,
+	#     by splitting the buffer in large blocks, so the scan runs
+	#     in C. Lines are only sliced out of the buffer and decoded
+	#     when they're asked for.
+	#
+	#     Can be used in place of a file handle, i.e. it supports
+	#     iteration and readline(). Lines include the trailing '\n'
+	#
+	#     A string may also be indexed - offsets are then
+	#     character offsets, and nothing needs decoding
+
+	def __init__(self, buf, encoding='utf-8', *, blockSize=1 << 20):
+
+		self.buf = buf
+		self.encoding = encoding
+		self.isText = isinstance(buf, str)
+		self.blockSize = blockSize
+		self.pos = 0         # next line for readline(), 0-based
+
+		# --- lOffsets[i] is the start of line i (0-based),
+		#     the last entry is the end of the buffer.
+		#     A new line starts after every '\n', so blocks may be
+		#     split anywhere - even in the middle of a line
+		size = len(buf)
+		lOffsets = array('q', [0])
+		sep = '\n' if self.isText else b'\n'
+		start = 0
+		while start < size:
+			block = buf[start:start + blockSize]
+			lParts = block.split(sep)
+			lParts.pop()      # text after the last '\n' in the block
+			lOffsets.extend(islice(accumulate(map(add, map(len, lParts),
+			                                          repeat(1)),
+			                                  initial=start),
+			                       1, None))
+			start += len(block)
+		if lOffsets[-1] != size:
+			lOffsets.append(size)
+		self.lOffsets = lOffsets
+
+	# ------------------------------------------------------------------------
+
+	def __len__(self):
+		# --- number of lines
+
+		return len(self.lOffsets) - 1
+
+	# ------------------------------------------------------------------------
+
+	def line(self, lineNum):
+		# --- lineNum is 1-based, as in error messages
+
+		if not (1 <= lineNum <= len(self)):
+			raise IndexError(f"line(): No line {lineNum}")
+		return self.text(lineNum, lineNum + 1)
+
+	# ------------------------------------------------------------------------
+
+	def text(self, startLine, endLine):
+		# --- Returns lines startLine up to, but not including,
+		#     endLine (1-based) as a single string
+
+		lOffsets = self.lOffsets
+		s = self.buf[lOffsets[startLine-1]:lOffsets[endLine-1]]
+		if self.isText:
+			return s
+		return s.decode(self.encoding)
+
+	# ------------------------------------------------------------------------
+
+	def __iter__(self):
+		# --- Whole blocks of lines are decoded at once,
+		#     then split into lines by a StringIO
+
+		lOffsets = self.lOffsets
+		numLines = len(self)
+		while self.pos < numLines:
+			i = self.pos
+			j = bisect_right(lOffsets, lOffsets[i] + self.blockSize, i + 1,
+			                 numLines)
+			for line in io.StringIO(self.text(i + 1, j + 1)):
+				self.pos += 1
+				yield line
+
+	# ------------------------------------------------------------------------
+
+	def readline(self):
+		# --- returns '' at end of buffer, like a file handle
+
+		if self.pos >= len(self):
+			return ''
+		self.pos += 1
+		return self.line(self.pos)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def test_1():
+	index = LineIndex(b'abc\n\ndef\nghi')
+	assert len(index) == 4
+	assert index.line(1) == 'abc\n'
+	assert index.line(2) == '\n'
+	assert index.line(4) == 'ghi'
+	assert list(index) == ['abc\n', '\n', 'def\n', 'ghi']
+	with pytest.raises(IndexError):
+		index.line(5)
+
+def test_2():
+	assert len(LineIndex(b'')) == 0
+	assert list(LineIndex(b'abc\n')) == ['abc\n']
+	assert list(LineIndex(bytearray(b'\n\n'))) == ['\n', '\n']
+
+def test_3():
+	# --- lines that span blocks, or are longer than a block
+	text = 'first\n' + 'x' * 25 + '\n' + 'short\n' * 10 + 'y' * 7
+	index = LineIndex(text.encode('utf-8'))
+	for blockSize in [1, 2, 3, 7, 16, 100]:
+		index2 = LineIndex(text.encode('utf-8'), blockSize=blockSize)
+		assert list(index2) == io.StringIO(text).readlines()
+		assert index2.lOffsets == index.lOffsets
+
+def test_6():
+	text = 'abc\n\ndef\nghi'
+	index = LineIndex(text, blockSize=3)
+	assert list(index) == io.StringIO(text).readlines()
+	assert index.line(3) == 'def\n'
+	assert index.text(2, 4) == '\ndef\n'
+	assert LineIndex(text.encode('utf-8')).text(2, 4) == '\ndef\n'
+
+def test_4():
+	index = LineIndex('a\nb\n'.encode('utf-8'))
+	assert index.readline() == 'a\n'
+	assert index.readline() == 'b\n'
+	assert index.readline() == ''
+
+def test_5(tmp_path):
+	path = tmp_path / 'test.txt'
+	path.write_bytes('héllo\nwörld\n'.encode('utf-8'))
+	with open(path, 'rb') as fh:
+		with mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+			index = LineIndex(buf)
+			assert index.line(2) == 'wörld\n'
+			assert list(index) == ['héllo\n', 'wörld\n']
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
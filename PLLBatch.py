@@ -0,0 +1,620 @@
+# PLLBatch.py
+
+"""
+parse many PLL files, spread across a pool of processes
+"""
+
+import os, io, pickle, multiprocessing, pytest
+from collections import namedtuple
+from bisect import bisect_right
+from math import ceil
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                as_completed)
+from concurrent.futures.process import BrokenProcessPool
+
+from myutils import cleanup_testcode, reLeadWS
+from TreeNode import TreeNode
+from PLLParser import PLLParser, LineLexer
+from PLLCache import dumpTree, loadTree
+from LineIndex import LineIndex, isBuffer
+from CompactTree import CompactTree
+
+# --- One of these is returned for each path
+#        index  - position of the path in the list passed in
+#        result - (rootNode, hSubTrees), or the output of dumpTree()
+#                 if serialized=True, or None if there was an error
+#        error  - the exception raised while parsing, or None
+
+PLLResult = namedtuple('PLLResult', ['index', 'path', 'result', 'error'])
+
+# ---------------------------------------------------------------------------
+
+def parsePLLMany(lPaths, *, jobs=None,
+                            constructor=TreeNode,
+                            hOptions={},
+                            chunkSize=None,
+                            serialized=False,
+                            asCompleted=False):
+	# --- Returns a list of PLLResult, in the same order as lPaths
+	#     An error in one file does not stop the others being parsed,
+	#     even one that kills its worker process
+	#
+	#     jobs is the number of worker processes (default: all CPUs),
+	#        jobs=1 parses everything in this process
+	#     lPaths is split into consecutive chunks of chunkSize paths,
+	#        the default being enough for about 4 chunks per worker.
+	#        The chunks only depend on len(lPaths), jobs and chunkSize
+	#     asCompleted=True returns a generator instead, which yields
+	#        the results of each chunk as soon as it's finished
+	#
+	#     Trees are passed back from the workers in the flat form
+	#     created by dumpTree(), since pickling the TreeNodes directly
+	#     recurses, and fails on deep or wide trees
+
+	lPaths = list(lPaths)
+	if not jobs:
+		jobs = os.cpu_count() or 1
+	lChunks = getChunks(lPaths, jobs, chunkSize)
+
+	if asCompleted:
+		gen = _iterResults(lChunks, jobs, constructor, hOptions, serialized)
+	else:
+		lResults = [None] * len(lPaths)
+		for result in _iterResults(lChunks, jobs, constructor,
+		                           hOptions, serialized):
+			lResults[result.index] = result
+		return lResults
+	return gen
+
+# ---------------------------------------------------------------------------
+
+def getChunks(lPaths, jobs, chunkSize=None):
+	# --- Returns a list of [(index, path), ...] chunks
+
+	n = len(lPaths)
+	if not chunkSize:
+		chunkSize = max(1, -(-n // (jobs * 4)))    # i.e. ceil()
+	lItems = list(enumerate(lPaths))
+	return [lItems[i:i + chunkSize] for i in range(0, n, chunkSize)]
+
+# ---------------------------------------------------------------------------
+
+def _iterResults(lChunks, jobs, constructor, hOptions, serialized):
+
+	if jobs == 1:
+		for lChunk in lChunks:
+			yield from _makeResults(_parseChunk(lChunk, constructor, hOptions),
+			                        constructor, serialized)
+		return
+
+	# --- If a worker dies, e.g. on a file that crashes the parser,
+	#     the pool breaks and every unfinished chunk fails with
+	#     BrokenProcessPool. Each worker marks a chunk in lStarted
+	#     when it starts it, so the chunks that were never started
+	#     are just parsed again, in a new pool. The ones that were
+	#     running when the pool broke (at most one per worker) have
+	#     each of their files parsed alone, so only a file that
+	#     crashes its worker gets the error
+	lPending = lChunks
+	while lPending:
+		lStarted = multiprocessing.Array('b', len(lPending), lock=False)
+		lSuspects = []
+		lNotStarted = []
+		with ProcessPoolExecutor(max_workers=jobs,
+		                         initializer=_initWorker,
+		                         initargs=(lStarted,)) as executor:
+			hChunks = {executor.submit(_parseChunk, lChunk, constructor,
+			                           hOptions, n): n
+			           for (n, lChunk) in enumerate(lPending)}
+			for future in as_completed(hChunks):
+				n = hChunks[future]
+				try:
+					lResults = future.result()
+				except BrokenProcessPool:
+					if lStarted[n]:
+						lSuspects.extend(lPending[n])
+					else:
+						lNotStarted.append(lPending[n])
+					continue
+				except Exception as ex:
+					lResults = [(index, path, None, ex)
+					            for (index, path) in lPending[n]]
+				yield from _makeResults(lResults, constructor, serialized)
+
+		if lSuspects:
+			with ThreadPoolExecutor(max_workers=jobs) as threads:
+				lFutures = [threads.submit(_parseAlone, item, constructor,
+				                           hOptions)
+				            for item in lSuspects]
+				for future in as_completed(lFutures):
+					yield from _makeResults(future.result(), constructor,
+					                        serialized)
+		lPending = lNotStarted
+
+# ---------------------------------------------------------------------------
+
+lWorkerStarted = None     # in a worker process, set by _initWorker()
+
+def _initWorker(lStarted):
+
+	global lWorkerStarted
+	lWorkerStarted = lStarted
+
+# ---------------------------------------------------------------------------
+
+def _parseAlone(item, constructor, hOptions):
+	# --- Parses one file in its own worker process, so that if
+	#     the worker dies, only that file fails
+
+	with ProcessPoolExecutor(max_workers=1) as executor:
+		try:
+			return executor.submit(_parseChunk, [item], constructor,
+			                       hOptions).result()
+		except BrokenProcessPool as ex:
+			(index, path) = item
+			return [(index, path, None, ex)]
+
+# ---------------------------------------------------------------------------
+
+def _parseChunk(lChunk, constructor, hOptions, n=None):
+	# --- Runs in a worker process, n being the chunk's position
+	#     in lWorkerStarted, if it's set
+	#     Returns [(index, path, data, error), ...]
+
+	if n != None:
+		lWorkerStarted[n] = 1
+	lResults = []
+	for (index, path) in lChunk:
+		try:
+			with open(path, 'rb') as fh:
+				buf = fh.read()
+			(rootNode, hSubTrees) = PLLParser(constructor, hOptions).parse(buf)
+			lResults.append((index, path, _dumpTree(rootNode, hSubTrees),
+			                 None))
+		except Exception as ex:
+			lResults.append((index, path, None, picklableError(ex)))
+	return lResults
+
+# ---------------------------------------------------------------------------
+
+def picklableError(ex):
+	# --- Returns ex, or, if it can't be pickled to send it back from
+	#     a worker process, a RuntimeError with the same message
+
+	try:
+		pickle.loads(pickle.dumps(ex))
+		return ex
+	except Exception:
+		return RuntimeError(f"{type(ex).__name__}: {ex}")
+
+# ---------------------------------------------------------------------------
+
+def _dumpTree(rootNode, hSubTrees):
+	# --- dumpTree(), but an error if the tree can't be sent back
+
+	data = dumpTree(rootNode, hSubTrees)
+	if data == None:
+		raise TypeError("Tree has values that can't be sent back"
+		                " from a worker process")
+	return data
+
+# ---------------------------------------------------------------------------
+
+def _makeResults(lResults, constructor, serialized):
+
+	for (index, path, data, error) in lResults:
+		if (data != None) and not serialized:
+			data = loadTree(data, constructor)
+		yield PLLResult(index, path, data, error)
+
+# ---------------------------------------------------------------------------
+
+def parsePLLParallel(fh, *, jobs=None,
+                            constructor=TreeNode,
+                            hOptions={},
+                            minChunkLines=10000,
+                            duplicates='last'):
+	# --- Parse a single large document in worker processes
+	#     Returns (rootNode, hSubTrees), just like parsePLL()
+	#
+	#     The text is split, at top level nodes only, into at most
+	#     jobs chunks of at least minChunkLines lines. Each chunk is
+	#     parsed as a fragment, then the top level nodes of all chunks
+	#     are linked together and the hSubTrees dicts are merged.
+	#     If a key is marked more than once, the last one wins, as
+	#     with parsePLL(), unless duplicates='error', in which case
+	#     a SyntaxError is raised
+	#
+	#     Each worker parses into a CompactTree, which is sent back
+	#     as a few arrays and a list of labels. If constructor is
+	#     a CompactTree's newNode, the chunks are just added to that
+	#     tree, so there's very little left to do here. Otherwise,
+	#     the nodes are copied with constructor - see copyNodes()
+
+	if not (isinstance(fh, str) or isBuffer(fh)):
+		fh = fh.read()
+	lineIndex = LineIndex(fh)
+	if not jobs:
+		jobs = os.cpu_count() or 1
+	numChunks = max(1, min(jobs, len(lineIndex) // minChunkLines))
+
+	parser = PLLParser(constructor, hOptions)
+	lStarts = findSplitPoints(lineIndex, parser, numChunks)
+	if len(lStarts) == 1:
+		(rootNode, hSubTrees) = parser.parse(fh)
+		checkDuplicates(parser.lDupMarks, duplicates)
+		return (rootNode, hSubTrees)
+
+	lStarts.append(len(lineIndex) + 1)
+	lChunks = [(lineIndex.text(lStarts[i], lStarts[i+1]), lStarts[i])
+	           for i in range(len(lStarts) - 1)]
+	with ProcessPoolExecutor(max_workers=len(lChunks)) as executor:
+		lParsed = list(executor.map(_parseText,
+		                            *zip(*lChunks),
+		                            [hOptions] * len(lChunks)))
+
+	# --- Link the top level nodes, and merge hSubTrees
+	tree = getattr(constructor, '__self__', None)
+	if not isinstance(tree, CompactTree):
+		tree = None
+	rootNode = tail = None
+	hSubTrees = {}
+	lDupMarks = []
+	for (chunkTree, rootIndex, hMarks, lChunkDups) in lParsed:
+		if tree == None:
+			lNodes = chunkTree.copyNodes(rootIndex, constructor)
+			node = lNodes[rootIndex]
+			hChunkSubTrees = {key: lNodes[i] for (key, i) in hMarks.items()}
+		else:
+			offset = tree.extend(chunkTree)
+			node = tree.node(offset + rootIndex)
+			hChunkSubTrees = {key: tree.node(offset + i)
+			                  for (key, i) in hMarks.items()}
+		if rootNode == None:
+			rootNode = node
+		else:
+			node.makeSiblingOf(tail)
+		tail = node
+		while tail.nextSibling:
+			tail = tail.nextSibling
+
+		lDupMarks.extend(lChunkDups)
+		for (key, node) in hChunkSubTrees.items():
+			if key in hSubTrees:
+				lDupMarks.append(key)
+			hSubTrees[key] = node
+
+	checkDuplicates(lDupMarks, duplicates)
+	return (rootNode, hSubTrees)
+
+# ---------------------------------------------------------------------------
+
+def checkDuplicates(lDupMarks, duplicates):
+
+	if lDupMarks and (duplicates == 'error'):
+		raise SyntaxError(f"Duplicate marked subtrees: {', '.join(lDupMarks)}")
+
+# ---------------------------------------------------------------------------
+
+def findSplitPoints(lineIndex, parser, numChunks):
+	# --- Returns a list of the (1-based) line numbers of at most
+	#     numChunks top level nodes, where the text can be split.
+	#     The first one is always line 1.
+	#
+	#     Only lines that contain the HEREDOC string, or that might be
+	#     a split point, need to be lexed. The lines in between are
+	#     passed over in one step - the next line containing the
+	#     HEREDOC string is found by searching the buffer, which runs
+	#     in C. Lines inside a HEREDOC are never split points
+
+	lStarts = [1]
+	numLines = len(lineIndex)
+	if numChunks <= 1:
+		return lStarts
+	chunkLines = numLines / numChunks
+	nextSplit = chunkLines
+
+	hereDocStr = parser.hereDocStr
+	lexer = LineLexer(parser)
+	feed = lexer.feed
+	lOffsets = lineIndex.lOffsets
+	nextHere = 0       # next line containing hereDocStr, once found
+	leadWS = None
+	leadLen = 0
+	while lexer.lineNum < numLines:
+		lineNum = lexer.lineNum + 1
+		known = (leadWS != None)
+		if known and not lexer.numHereDoc and (lineNum < nextSplit):
+			if nextHere < lineNum:
+				nextHere = findLine(lineIndex, hereDocStr, lineNum)
+			target = min(ceil(nextSplit), nextHere)
+			if target > lineNum:
+				lexer.skipLines(target - lineNum,
+				                lOffsets[target-1] - lOffsets[lineNum-1])
+				continue
+
+		line = lineIndex.line(lineNum)
+		token = None
+		try:
+			if (not known) or lexer.numHereDoc:
+				token = feed(line)
+				if (not known) and (lexer.leadWS != None):
+					leadWS = lexer.leadWS
+					leadLen = len(leadWS)
+					# --- never split before the first node
+					nextSplit = max(nextSplit, lexer.lineNum + 1)
+			elif (lineNum >= nextSplit) and line.startswith(leadWS) \
+					and line[leadLen:leadLen+1].strip():
+				token = feed(line)
+			elif hereDocStr and (line.find(hereDocStr) != -1):
+				token = feed(line)
+			else:
+				lexer.skip(line)
+		except SyntaxError:
+			# --- the error will be reported when the chunk is parsed
+			pass
+
+		# --- a top level node with HEREDOCs is returned after them,
+		#     but the split is still at its own line
+		if (token != None) and (token[1] == 0) and (token[0] >= nextSplit):
+			lStarts.append(token[0])
+			if len(lStarts) == numChunks:
+				break
+			nextSplit = token[0] + chunkLines
+	return lStarts
+
+# ---------------------------------------------------------------------------
+
+def findLine(lineIndex, s, lineNum):
+	# --- Returns the number of the first line, from lineNum on, that
+	#     contains s, or one more than the number of lines if none does
+
+	numLines = len(lineIndex)
+	if not s:
+		return numLines + 1
+	if not lineIndex.isText:
+		s = s.encode(lineIndex.encoding)
+	pos = lineIndex.buf.find(s, lineIndex.lOffsets[lineNum-1])
+	if pos == -1:
+		return numLines + 1
+	return bisect_right(lineIndex.lOffsets, pos)
+	chunkLines = numLines / numChunks
+	nextSplit = chunkLines
+
+	hereDocStr = parser.hereDocStr
+	lexer = LineLexer(parser)
+	feed = lexer.feed
+	leadWS = None
+	leadLen = 0
+	for line in lineIndex:
+		token = None
+		known = (leadWS != None)
+		try:
+			if (not known) or lexer.numHereDoc:
+				token = feed(line)
+				if (not known) and (lexer.leadWS != None):
+					leadWS = lexer.leadWS
+					leadLen = len(leadWS)
+					# --- never split before the first node
+					nextSplit = max(nextSplit, lexer.lineNum + 1)
+			elif (lexer.lineNum + 1 >= nextSplit) and line.startswith(leadWS) \
+					and line[leadLen:leadLen+1].strip():
+				token = feed(line)
+			elif hereDocStr and (line.find(hereDocStr) != -1):
+				token = feed(line)
+			else:
+				lexer.skip(line)
+		except SyntaxError:
+			# --- the error will be reported when the chunk is parsed
+			pass
+
+		# --- a top level node with HEREDOCs is returned after them,
+		#     but the split is still at its own line
+		if (token != None) and (token[1] == 0) and (token[0] >= nextSplit):
+			lStarts.append(token[0])
+			if len(lStarts) == numChunks:
+				break
+			nextSplit = token[0] + chunkLines
+	return lStarts
+
+# ---------------------------------------------------------------------------
+
+def _parseText(text, startLine, hOptions):
+	# --- Runs in a worker process - text starts at line startLine
+	#     Returns (a CompactTree, the index of its root node,
+	#              {key: index} of its marked nodes, duplicated marks)
+
+	tree = CompactTree()
+	parser = PLLParser(tree.newNode, hOptions)
+	try:
+		(rootNode, hSubTrees) = parser.parse(text)
+	except SyntaxError as ex:
+		# --- Exception attributes don't survive pickling,
+		#     so create a new one, with the correct line number
+		lineno = ex.lineno and (ex.lineno + startLine - 1)
+		raise SyntaxError(ex.msg, (None, lineno, None, ex.text)) from None
+	hMarks = {key: node.index for (key, node) in hSubTrees.items()}
+	return (tree, rootNode.index, hMarks, parser.lDupMarks)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def init_files(tmp_path):
+
+	lPaths = []
+	for i in range(10):
+		path = tmp_path / f"file{i}.pll"
+		path.write_text(f"top{i}\n\t*sub{i}\n\t\tleaf\n")
+		lPaths.append(str(path))
+	(tmp_path / 'bad.pll').write_text("top\n   bad indent\n")
+	lPaths.insert(3, str(tmp_path / 'bad.pll'))
+	lPaths.insert(7, str(tmp_path / 'missing.pll'))
+	return lPaths
+
+def test_1(tmp_path):
+	lPaths = init_files(tmp_path)
+	for jobs in [1, 2]:
+		lResults = parsePLLMany(lPaths, jobs=jobs)
+		assert [result.path for result in lResults] == lPaths
+		assert isinstance(lResults[3].error, SyntaxError)
+		assert isinstance(lResults[7].error, FileNotFoundError)
+		(tree, hSubTrees) = lResults[0].result
+		assert tree['label'] == 'top0'
+		assert hSubTrees['sub0'].firstChild['label'] == 'leaf'
+		(tree, hSubTrees) = lResults[-1].result
+		assert tree['label'] == 'top9'
+
+def test_2(tmp_path):
+	lPaths = init_files(tmp_path)
+	lResults = list(parsePLLMany(lPaths, jobs=2, chunkSize=3,
+	                             serialized=True, asCompleted=True))
+	assert sorted(result.index for result in lResults) \
+	       == list(range(len(lPaths)))
+	for result in lResults:
+		if not result.error:
+			assert isinstance(result.result, bytes)
+			(tree, hSubTrees) = loadTree(result.result)
+			assert tree['label'] == f"top{result.path[-5]}"
+
+class UnpicklableError(Exception):
+
+	def __init__(self, msg, fh):
+		super().__init__(msg)
+		self.fh = fh
+
+class BadNode(TreeNode):
+
+	def __init__(self, label):
+		super().__init__(label)
+		if label == 'top5':
+			raise UnpicklableError('bad label', io.StringIO())
+		if label == 'top8':
+			os._exit(1)
+
+def test_7(tmp_path):
+	# --- an error that can't be pickled only affects its own file
+	lPaths = init_files(tmp_path)[:9]
+	lResults = parsePLLMany(lPaths, jobs=2, chunkSize=2,
+	                        constructor=BadNode)
+	lErrors = [result.path for result in lResults if result.error]
+	assert len(lErrors) == 3
+	result = lResults[6]
+	assert result.path.endswith('file5.pll')
+	assert isinstance(result.error, RuntimeError)
+	assert 'UnpicklableError: bad label' in str(result.error)
+	assert lResults[5].result[0]['label'] == 'top4'
+
+	# --- a worker that dies only fails the file it was parsing
+	lPaths = init_files(tmp_path)
+	lResults = parsePLLMany(lPaths, jobs=2, chunkSize=2,
+	                        constructor=BadNode)
+	assert [result.path for result in lResults] == lPaths
+	assert [result.index for result in lResults if result.error] \
+	       == [3, 6, 7, 10]
+	assert isinstance(lResults[10].error, BrokenProcessPool)
+	assert lResults[11].result[0]['label'] == 'top9'
+
+def test_8(tmp_path):
+	# --- one worker dying in a larger batch, with several chunks
+	#     still to start, and others running
+	lPaths = []
+	for i in range(40):
+		path = tmp_path / f"file{i}.pll"
+		path.write_text(f"top{i}\n\tleaf\n")
+		lPaths.append(str(path))
+	for jobs in [2, 3]:
+		lResults = parsePLLMany(lPaths, jobs=jobs, constructor=BadNode)
+		lErrors = [result for result in lResults if result.error]
+		assert len(lErrors) == 2
+		assert isinstance(lErrors[0].error, RuntimeError)
+		assert isinstance(lErrors[1].error, BrokenProcessPool)
+		assert lErrors[1].path.endswith('file8.pll')
+		assert lResults[39].result[0]['label'] == 'top39'
+
+def test_3():
+	# --- chunking is deterministic
+	lChunks = getChunks(list('abcdefghij'), 2)
+	assert lChunks == [
+		[(0,'a'), (1,'b')],
+		[(2,'c'), (3,'d')],
+		[(4,'e'), (5,'f')],
+		[(6,'g'), (7,'h')],
+		[(8,'i'), (9,'j')],
+		]
+	assert getChunks([], 4) == []
+	assert len(getChunks(list(range(100)), 1, 30)) == 4
+
+# --- No leading whitespace, so that HEREDOC lines
+#     can look like top level lines
+
+big_str = (
+	"*menubar\n"
+	"\tfile\n"
+	"\t\t*handler <<<\n"
+	"my $evt = $_[0];\n"
+	"return undef;\n"
+	"\n"
+	"# --- a comment\n"
+	"layout\n"
+	"\trow\n"
+	"\t\tEditField\n"
+	"\t\t\t*handler\n"
+	"script <<< <<<\n"
+	"print('hello')\n"
+	"\n"
+	"print('world')\n"
+	"\n"
+	"last\n"
+	"\t\t\tcontinued\n"
+	"\n"
+	)
+
+def test_4():
+	(tree, hSubTrees) = parsePLLParallel(big_str * 20, jobs=1)
+	for jobs in [2, 3, 7]:
+		(tree2, hSubTrees2) = parsePLLParallel(big_str * 20, jobs=jobs,
+		                                       minChunkLines=10)
+		assert tree2.asString() == tree.asString()
+		assert sorted(hSubTrees2.keys()) == sorted(hSubTrees.keys())
+		assert hSubTrees2['handler'].parent['label'] == 'EditField'
+		assert hSubTrees2['menubar'].firstChild['label'] == 'file'
+
+	# --- the chunks are added straight to a CompactTree
+	compact = CompactTree()
+	(tree3, hSubTrees3) = parsePLLParallel(big_str * 20, jobs=3,
+	                                       minChunkLines=10,
+	                                       constructor=compact.newNode)
+	assert tree3.tree is compact
+	assert tree3.asString() == tree.asString()
+	assert hSubTrees3['handler'].parent['label'] == 'EditField'
+	assert hSubTrees3['handler'].tree is compact
+	assert tree3.nextSibling.nextSibling['lHereDoc'] \
+	       == tree.nextSibling.nextSibling['lHereDoc']
+
+def test_5():
+	lineIndex = LineIndex(big_str * 20)
+	lStarts = findSplitPoints(lineIndex, PLLParser(), 5)
+	assert len(lStarts) == 5
+	for lineNum in lStarts[1:]:
+		line = lineIndex.line(lineNum)
+		assert line[0] not in '\t#'
+		assert not line.startswith('my')
+		assert not line.startswith('return')
+		assert not line.startswith('print')
+
+def test_6():
+	with pytest.raises(SyntaxError) as info:
+		parsePLLParallel(big_str * 20, jobs=2, minChunkLines=10,
+		                 duplicates='error')
+	assert 'handler' in str(info.value)
+
+	# --- errors report line numbers in the whole document
+	s = big_str * 20 + "bad\n   indent\n"
+	with pytest.raises(SyntaxError) as info:
+		parsePLLParallel(s, jobs=3, minChunkLines=10)
+	assert info.value.lineno == s.count('\n')
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
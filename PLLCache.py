@@ -0,0 +1,328 @@
+# PLLCache.py
+
+"""
+cache the results of parsePLL(), in memory and on disk
+"""
+
+import os, io, re, json, hashlib, pytest
+from collections import OrderedDict
+from more_itertools import ilen
+
+from myutils import cleanup_testcode
+from TreeNode import TreeNode
+from PLLParser import PLLParser
+from LineIndex import isBuffer
+
+# ---------------------------------------------------------------------------
+
+class PLLCache():
+	# --- Parsed trees are stored in a compact serialized form,
+	#     keyed by a hash of the source text, the constructor class
+	#     and the parser options. Every call to parse() returns
+	#     a freshly built tree, so callers may modify it freely
+	#
+	#     There are 2 tiers:
+	#        1. an in-memory LRU holding at most maxEntries items
+	#        2. one file per entry in cacheDir (like __pycache__)
+	#     Pass cacheDir=None for a memory-only cache
+	#
+	#     Entries are JSON, not pickles, so that a cache file that's
+	#     been tampered with can't run code when it's loaded. That
+	#     means only values JSON can hold are kept - a tree with any
+	#     other values (e.g. set by the constructor) isn't cached
+
+	fileExt = '.pllc'
+
+	# ------------------------------------------------------------------------
+
+	def __init__(self, cacheDir='__pllcache__', maxEntries=64):
+
+		self.cacheDir = cacheDir
+		self.maxEntries = maxEntries
+		self.hMemory = OrderedDict()
+		self.hStats = {
+			'memory': 0,    # found in the in-memory tier
+			'disk':   0,    # found in cacheDir
+			'parsed': 0,    # not found, had to be parsed
+			}
+
+	# ------------------------------------------------------------------------
+
+	def parse(self, fh, constructor=TreeNode, hOptions={}):
+		# --- Returns (rootNode, hSubTrees), just like parsePLL()
+
+		# --- We need the full text to compute the key
+		if isinstance(fh, str) or isBuffer(fh):
+			text = fh
+		else:
+			text = fh.read()
+
+		key = self.getKey(text, constructor, hOptions)
+
+		data = self.hMemory.get(key, None)
+		if data:
+			self.hMemory.move_to_end(key)
+			self.hStats['memory'] += 1
+			return loadTree(data, constructor)
+
+		data = self.readFile(key)
+		if data:
+			try:
+				result = loadTree(data, constructor)
+				self.hStats['disk'] += 1
+				self.remember(key, data)
+				return result
+			except Exception:
+				pass     # corrupt cache file - just parse again
+
+		(rootNode, hSubTrees) = PLLParser(constructor, hOptions).parse(text)
+		self.hStats['parsed'] += 1
+
+		data = dumpTree(rootNode, hSubTrees)
+		if data != None:
+			self.remember(key, data)
+			self.writeFile(key, data)
+		return (rootNode, hSubTrees)
+
+	# ------------------------------------------------------------------------
+
+	def getKey(self, text, constructor, hOptions):
+		# --- text may be a string or a buffer
+
+		h = hashlib.sha256()
+		if isinstance(text, str):
+			h.update(text.encode('utf-8'))
+		else:
+			h.update(text)
+		h.update(b'\0')
+		h.update(f"{constructor.__module__}.{constructor.__qualname__}"
+		         .encode('utf-8'))
+		for name in sorted(PLLParser.hDefOptions.keys()):
+			value = hOptions.get(name, PLLParser.hDefOptions[name])
+			if isinstance(value, re.Pattern):
+				value = (value.pattern, value.flags)
+			h.update(f"\0{name}={value!r}".encode('utf-8'))
+		return h.hexdigest()
+
+	# ------------------------------------------------------------------------
+
+	def remember(self, key, data):
+
+		self.hMemory[key] = data
+		self.hMemory.move_to_end(key)
+		while len(self.hMemory) > self.maxEntries:
+			self.hMemory.popitem(last=False)
+
+	# ------------------------------------------------------------------------
+
+	def clear(self):
+		# --- Empties the in-memory tier only
+
+		self.hMemory.clear()
+
+	# ------------------------------------------------------------------------
+
+	def readFile(self, key):
+
+		if not self.cacheDir:
+			return None
+		try:
+			with open(self.filePath(key), 'rb') as fh:
+				return fh.read()
+		except OSError:
+			return None
+
+	# ------------------------------------------------------------------------
+
+	def writeFile(self, key, data):
+		# --- Write to a temp file, then rename, so that a concurrent
+		#     reader never sees a partially written file
+
+		if not self.cacheDir:
+			return
+		try:
+			os.makedirs(self.cacheDir, exist_ok=True)
+			path = self.filePath(key)
+			tmpPath = f"{path}.{os.getpid()}.tmp"
+			with open(tmpPath, 'wb') as fh:
+				fh.write(data)
+			os.replace(tmpPath, path)
+		except OSError:
+			pass     # caching is optional - never fail the parse
+
+	# ------------------------------------------------------------------------
+
+	def filePath(self, key):
+
+		return os.path.join(self.cacheDir, key + self.fileExt)
+
+# ---------------------------------------------------------------------------
+
+def dumpTree(rootNode, hSubTrees):
+	# --- Returns bytes holding the tree (including any following
+	#     siblings) as a flat pre-order list of (level, hData) entries,
+	#     and hSubTrees as a dict of key => index into that list,
+	#     encoded as JSON. Returns None if a node has a value that
+	#     JSON can't hold
+
+	lEntries = []
+	hIndex = {}
+	cur = rootNode
+	while cur:
+		for (level, node) in cur.descendents():
+			hIndex[id(node)] = len(lEntries)
+			lEntries.append((level, dict(node.items())))
+		cur = cur.nextSibling
+
+	hMarks = {}
+	for (key, node) in hSubTrees.items():
+		hMarks[key] = hIndex[id(node)]
+
+	try:
+		return json.dumps([lEntries, hMarks]).encode('utf-8')
+	except (TypeError, ValueError):
+		return None
+
+# ---------------------------------------------------------------------------
+
+def loadTree(data, constructor=TreeNode):
+	# --- Returns (rootNode, hSubTrees) from the output of dumpTree()
+	#     Raises ValueError if data isn't in that format
+
+	(lEntries, hMarks) = json.loads(data)
+	if not (isinstance(lEntries, list) and lEntries
+			and isinstance(hMarks, dict)):
+		raise ValueError("loadTree(): bad cache data")
+
+	lNodes = []
+	lLast = []       # lLast[level] is the last node seen at that level
+	for (level, hData) in lEntries:
+		node = constructor(hData['label'])
+		for (key, value) in hData.items():
+			if key != 'label':
+				node[key] = value
+
+		if level < len(lLast):
+			# --- a later sibling of lLast[level]
+			node.makeSiblingOf(lLast[level])
+			del lLast[level+1:]
+			lLast[level] = node
+		elif level > 0:
+			node.makeChildOf(lLast[level-1])
+			lLast.append(node)
+		else:
+			lLast.append(node)
+		lNodes.append(node)
+
+	hSubTrees = {}
+	for (key, i) in hMarks.items():
+		hSubTrees[key] = lNodes[i]
+
+	return (lNodes[0], hSubTrees)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+test_str = '''
+	App
+		* menubar
+			file
+				new
+					*handler <<<
+						my $evt = $_[0];
+						return undef;
+
+				open
+			edit
+				undo
+		* layout
+			row
+				EditField
+	Footer
+		text = bye
+	'''
+
+def test_1(tmp_path):
+	cache = PLLCache(tmp_path / 'cache')
+
+	(tree1, h1) = cache.parse(test_str)
+	(tree2, h2) = cache.parse(test_str)
+	assert cache.hStats == {'memory': 1, 'disk': 0, 'parsed': 1}
+
+	# --- a fresh tree, identical to the parsed one
+	assert tree2 is not tree1
+	assert tree2.asString() == tree1.asString()
+	assert ilen(tree2.followingNodes()) == ilen(tree1.followingNodes())
+	assert sorted(h2.keys()) == ['handler', 'layout', 'menubar']
+	assert h2['menubar'].parent is tree2
+	assert h2['handler']['lHereDoc'] == ['my $evt = $_[0];\nreturn undef;\n']
+
+def test_2(tmp_path):
+	# --- a new cache object still finds the file on disk
+	PLLCache(tmp_path).parse(test_str)
+	cache = PLLCache(tmp_path)
+	(tree, h) = cache.parse(io.StringIO(test_str))
+	assert cache.hStats == {'memory': 0, 'disk': 1, 'parsed': 0}
+	assert tree.nextSibling['label'] == 'Footer'
+	assert h['layout'].firstChild.firstChild['label'] == 'EditField'
+
+def test_3(tmp_path):
+	# --- different text, constructor or options means different keys
+	cache = PLLCache(tmp_path)
+	class MyNode(TreeNode):
+		pass
+	(tree, h) = cache.parse(test_str, MyNode)
+	assert isinstance(tree, MyNode)
+	cache.parse(test_str)
+	cache.parse(test_str, hOptions={'markStr': '@'})
+	cache.parse(test_str + 'more\n')
+	assert cache.hStats['parsed'] == 4
+	assert len(os.listdir(tmp_path)) == 4
+
+def test_5(tmp_path):
+	# --- bytes get the same key as the equivalent string
+	cache = PLLCache(tmp_path)
+	cache.parse(test_str)
+	(tree, h) = cache.parse(test_str.encode('utf-8'))
+	assert cache.hStats == {'memory': 1, 'disk': 0, 'parsed': 1}
+	assert tree['label'] == 'App'
+
+def test_4():
+	# --- memory-only cache, bounded LRU
+	cache = PLLCache(None, maxEntries=2)
+	cache.parse('a')
+	cache.parse('b')
+	cache.parse('a')
+	cache.parse('c')      # evicts 'b'
+	cache.parse('a')
+	cache.parse('b')
+	assert cache.hStats == {'memory': 2, 'disk': 0, 'parsed': 4}
+
+def test_6(tmp_path):
+	# --- cache files are plain data, and a bad one is just re-parsed
+	cache = PLLCache(tmp_path)
+	cache.parse(test_str)
+	(path,) = tmp_path.iterdir()
+	assert json.loads(path.read_bytes())[0][0] == [0, {'label': 'App'}]
+
+	path.write_bytes(b'\x80\x04cos\nsystem\n.')
+	cache = PLLCache(tmp_path)
+	(tree, h) = cache.parse(test_str)
+	assert cache.hStats == {'memory': 0, 'disk': 0, 'parsed': 1}
+	assert tree['label'] == 'App'
+
+	# --- a tree with values JSON can't hold isn't cached
+	class SetNode(TreeNode):
+		def __init__(self, label):
+			super().__init__(label)
+			self['tags'] = {1, 2}
+	cache = PLLCache(None)
+	cache.parse(test_str, SetNode)
+	(tree, h) = cache.parse(test_str, SetNode)
+	assert cache.hStats == {'memory': 0, 'disk': 0, 'parsed': 2}
+	assert tree['tags'] == {1, 2}
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
@@ -4,13 +4,20 @@
 parse a 'Python-like language'
 """
 
-import sys, io, re, pytest
+import sys, io, re, asyncio, collections, pytest
+from time import perf_counter
+from bisect import bisect_right
+from collections import namedtuple
 from more_itertools import ilen
 from pprint import pprint
 
-from myutils import (rmPrefix, reLeadWS, isAllWhiteSpace,
+from myutils import (reLeadWS, isAllWhiteSpace,
                     traceStr, cleanup_testcode, firstWordOf)
 from TreeNode import TreeNode
+from LineIndex import LineIndex, isBuffer
+from HereDoc import HereDocList, makeHereDoc
+from InternTable import InternTable
+from PLLStats import PLLStats
 
 # --- Some pre-compiled regular expressions
 
@@ -25,9 +32,61 @@ hDefOptions = {
 def parsePLL(fh, constructor=TreeNode,
                  hOptions={},
                  *,
-                 debug=False):
+                 debug=False,
+                 cache=None,
+                 only=None,
+                 intern=None,
+                 stats=None):
+	# --- fh can be a file handle, a string, or a bytes, bytearray
+	#     or mmap buffer (parsed using a LineIndex)
+	#     cache, if given, should be a PLLCache object
+	#     only, if given, is a set of marked subtree keys to build now -
+	#        see PLLParser.__init__()
+	#     intern, if given, is True or an InternTable - see PLLParser.__init__()
+	#     stats, if given, is a PLLStats object - see PLLParser.__init__()
+	#     The cache is not used with only, intern or stats
+
+	if not (intern or isinstance(intern, InternTable)):
+		intern = None    # e.g. False
+	if not stats:
+		stats = None
+	if cache and (only == None) and (intern == None) and (stats == None):
+		return cache.parse(fh, constructor, hOptions)
+	parser = PLLParser(constructor, hOptions, debug, only=only, intern=intern,
+	                   stats=stats)
+	return parser.parse(fh)
 
-	return PLLParser(constructor, hOptions, debug).parse(fh)
+# ---------------------------------------------------------------------------
+
+def iterPLL(fh, hOptions={},
+                *,
+                debug=False):
+	# --- Streaming alternative to parsePLL() - no TreeNodes are built
+	#     See PLLParser.iterEvents() for the events yielded
+
+	return PLLParser(TreeNode, hOptions, debug).iterEvents(fh)
+
+# ---------------------------------------------------------------------------
+
+def validatePLL(fh, hOptions={}):
+	# --- Returns a list of SyntaxErrors - empty if fh parses OK
+	#     See PLLParser.validate()
+
+	return PLLParser(TreeNode, hOptions).validate(fh)
+
+# ---------------------------------------------------------------------------
+
+async def parsePLLAsync(reader, constructor=TreeNode,
+                                hOptions={},
+                                *,
+                                batchSize=1000):
+	# --- reader can be an asyncio.StreamReader, or any async iterable
+	#     of lines (str or bytes). Builds the same tree as parsePLL(),
+	#     but lets other tasks run after every batchSize lines
+	#     See PLLParser.parseAsync()
+
+	parser = PLLParser(constructor, hOptions)
+	return await parser.parseAsync(reader, batchSize=batchSize)
 
 # ---------------------------------------------------------------------------
 
@@ -41,17 +100,70 @@ class PLLParser():
 		'markStr':    '*',
 		'reComment':  re.compile(r'(?<!\\)#.*$'),  # ignore escaped '#' char
 		'reAttr':     re.compile(r'^(\S+)\s*\=\s*(.*)$'),
+		'fastLexer':  False,    # use lexLine() instead of splitLine()
 		}
 
 	# ------------------------------------------------------------------------
 
 	def __init__(self, constructor=TreeNode,
 	                   hOptions={},
-	                   debug=False):
-
+	                   debug=False,
+	                   *,
+	                   trackLines=False,
+	                   only=None,
+	                   intern=None,
+	                   stats=None):
+		# --- trackLines keeps the source lines and the line number
+		#     of each node, which is required by reparse()
+		#
+		#     only, if not None, is a set of marked subtree keys.
+		#     Other marked subtrees are not built - the tree holds a
+		#     placeholder node, with only their source line range, which
+		#     is filled in place the first time its contents are read,
+		#     and hSubTrees will be a LazySubTrees object. Use only=set()
+		#     to make all marked subtrees lazy. constructor must be a
+		#     TreeNode class, not a function
+		#
+		#     intern, if not None, makes equal labels share one string
+		#     object. Either True, for a new InternTable owned by this
+		#     parser, or an InternTable (e.g. globalInternTable) to
+		#     share strings with other parses.
+		#     See self.internTable.getStats()
+		#
+		#     stats, if not None, collects counters and phase timers.
+		#     Either True, for a new PLLStats object, or a PLLStats
+		#     object to accumulate over several parses. See self.stats
+
+		if trackLines and (only != None):
+			raise Exception("PLLParser(): trackLines and only"
+			                " cannot be used together")
+		if (only != None) and not (isinstance(constructor, type)
+				and issubclass(constructor, TreeNode)):
+			raise Exception("PLLParser(): only requires constructor"
+			                " to be a TreeNode class")
 		self.setOptions(hOptions)
 		self.constructor = constructor
 		self.debug = debug
+		self.trackLines = trackLines
+		self.only = only
+		if intern == True:
+			intern = InternTable()
+		elif not (intern or isinstance(intern, InternTable)):
+			intern = None    # e.g. False - an empty table is also false
+		self.internTable = intern
+
+		# --- Timing is done by replacing methods with timed versions,
+		#     so that parsing without stats isn't slowed down at all
+		if stats == True:
+			stats = PLLStats()
+		elif not stats:
+			stats = None    # e.g. False
+		self.stats = stats
+		if stats != None:
+			self.splitLine = stats.timedSplitLine(self.splitLine)
+			self.lexLine = stats.timedLexLine(self.lexLine)
+			self.nextNonBlankLine = stats.timedNextNonBlankLine(
+			                               self.nextNonBlankLine, self)
 
 	# ------------------------------------------------------------------------
 
@@ -64,46 +176,202 @@ class PLLParser():
 				value = self.hDefOptions[name]
 			setattr(self, name, value)
 
+		# --- Used by lexLine() - matches (indent, markStr, label)
+		#     With the default reComment, the label part stops at
+		#     the first comment, otherwise reComment must be applied first
+		self.lexComments = (self.reComment.pattern
+		                    != self.hDefOptions['reComment'].pattern)
+		if self.lexComments:
+			reLabel = r'(.*)'
+		else:
+			reLabel = r'([^#\n]*(?:(?<=\\)#[^#\n]*)*)'
+		if self.markStr:
+			reMark = '(' + re.escape(self.markStr) + r')?\s*'
+		else:
+			reMark = '()'
+		self.reLexLine = re.compile(r'^(\s*)' + reMark + reLabel)
+
 	# ------------------------------------------------------------------------
 
 	def parse(self, fh):
 		# --- Returns (rootNode, hSubTrees)
 
-		self.numLines = 0
+		if self.trackLines:
+			if isBuffer(fh):
+				fh = ''.join(LineIndex(fh))
+			elif not isinstance(fh, str):
+				fh = fh.read()
+			self.lSourceLines = io.StringIO(fh).readlines()
+
+		if self.only != None:
+			# --- Lazy subtrees are built later from the source lines
+			if not (isinstance(fh, str) or isBuffer(fh)):
+				fh = fh.read()
+			fh = LineIndex(fh)
+
+		stats = self.stats
+		if stats != None:
+			start = perf_counter()
+
+		builder = self._buildTree(fh)
+		next(builder)      # run up to the first 'yield'
+		send = builder.send
+		if stats == None:
+			for token in self._tokens(fh):
+				send(token)
+			return self._finishTree(builder)
+
+		hTimes = stats.hTimes
+		for token in self._tokens(fh):
+			startNode = perf_counter()
+			send(token)
+			hTimes['nodes'] += perf_counter() - startNode
+		result = self._finishTree(builder)
+		stats.addParse(self, perf_counter() - start)
+		return result
+
+	# ------------------------------------------------------------------------
+
+	async def parseAsync(self, reader, *, batchSize=1000, encoding='utf-8'):
+		# --- Same as parse(), but lines are read from an asyncio.StreamReader
+		#     or an async iterable, so reading from a pipe or socket doesn't
+		#     block the event loop. The tree is built as lines arrive, and
+		#     control is returned to the event loop after every batchSize
+		#     lines, even when the lines are already buffered.
+		#     bytes lines are decoded using encoding
+		#
+		#     trackLines and only are not supported - both need
+		#     the whole source text up front
+
+		if self.trackLines or (self.only != None):
+			raise Exception("parseAsync(): trackLines and only"
+			                " are not supported")
+
+		if self.stats != None:
+			start = perf_counter()
+
+		self.lineIndex = None
+		builder = self._buildTree()
+		next(builder)      # run up to the first 'yield'
+		send = builder.send
+		lines = self._asyncLines(reader, batchSize, encoding)
+		async for token in self._asyncTokens(lines):
+			send(token)
+		result = self._finishTree(builder)
+
+		# --- Only counters - reading is mostly waiting, so isn't timed
+		if self.stats != None:
+			self.stats.addParse(self, perf_counter() - start)
+		return result
+
+	# ------------------------------------------------------------------------
+
+	async def _asyncLines(self, reader, batchSize, encoding):
+		# --- asyncio.StreamReader supports 'async for', returning
+		#     lines as bytes. StreamReader.readline() doesn't await
+		#     anything when a line is already buffered, so we
+		#     explicitly give other tasks a chance to run
+
+		n = 0
+		async for line in reader:
+			if not isinstance(line, str):
+				line = line.decode(encoding)
+			yield line
+			n += 1
+			if n == batchSize:
+				n = 0
+				await asyncio.sleep(0)
+
+	# ------------------------------------------------------------------------
+
+	def _buildTree(self, lineIndex=None):
+		# --- A generator that is sent one token at a time, i.e.
+		#        (lineNum, level, label, marked, lHereDoc)
+		#     followed by None, after which it returns (rootNode, hSubTrees)
+		#     This allows tokens to come from either a plain or
+		#     an async generator - see parse() and parseAsync()
+		#     lineIndex is required when self.only is set
 
 		rootNode = None
 		hSubTrees = {}
+		self.lDupMarks = []    # keys marked more than once
 
 		curLevel = None
 		debug = self.debug
 
-		# --- Putting this in a separate variable
-		#     allows us to get HEREDOC lines
-		gen = self._generator(fh)
-		for line in gen:
-			if debug:
-				print(f"LINE {self.numLines}: '{traceStr(line)}'", end='')
+		trackLines = self.trackLines
+		if trackLines:
+			lNodeLines = self.lNodeLines = []   # [(lineNum, level, node, key)]
+
+		only = self.only
+		lazy = False        # the current line starts a skipped subtree
+		if only != None:
+			hSubTrees = LazySubTrees(self, lineIndex)
+			skipLevel = None    # level of the marked subtree being skipped
+
+		# --- Labels are looked up in the InternTable inline, which
+		#     is much faster than calling InternTable.intern(). Since
+		#     continuation lines add to a node's label, it's looked up
+		#     once the next node starts, or at the end - internNode is
+		#     the node waiting for that. Placeholders are interned
+		#     by LazySubTrees.addLazy(), once their label is complete
+		hStrings = None
+		internNode = None
+		if self.internTable != None:
+			hStrings = self.internTable.hStrings
+			getsizeof = sys.getsizeof
+			numLookups = numHits = savedBytes = 0
+
+		numTokens = 0
+		numContinuations = 0
+		maxDepth = 0
+
+		while True:
+			token = yield
+			if token == None:
+				break
+			(lineNum, newLevel, label, marked, lHereDoc) = token
+
+			if only != None:
+				# --- While skipping a subtree, just record nested marks
+				if skipLevel != None:
+					if newLevel > skipLevel:
+						# --- ignore continuation lines, except the
+						#     placeholder's own, which add to its label
+						if newLevel <= skipCurLevel + 1:
+							if marked:
+								lSkipKeys.append(firstWordOf(label))
+							skipCurLevel = newLevel
+						elif skipCurLevel == skipLevel:
+							hSubTrees.continueLabel(label)
+						continue
+					hSubTrees.addLazy(lSkipKeys, skipStart, lineNum)
+					skipLevel = None
+
+				# --- a placeholder node is added for the skipped
+				#     subtree below, in place of a real node
+				if (marked and (rootNode != None)
+						and (newLevel <= curLevel + 1)
+						and (firstWordOf(label) not in only)):
+					skipLevel = skipCurLevel = newLevel
+					skipStart = lineNum
+					lSkipKeys = []      # nested marks
+					lazy = True
+					lHereDoc = None     # it's read when the node is built
+				else:
+					lazy = False
 
-			(newLevel, label, marked, numHereDoc) = self.splitLine(line)
+			if (internNode != None) and (newLevel <= curLevel + 1):
+				label2 = internNode['label']
+				s = hStrings.setdefault(label2, label2)
+				if s is not label2:
+					internNode['label'] = s
+					numHits += 1
+					savedBytes += getsizeof(label2)
+				numLookups += 1
+				internNode = None
 
-			if debug:
-				print(f" [{newLevel},{numHereDoc}] '{label}'")
-
-			# --- Extract HEREDOC strings, if any
-			lHereDoc = None
-			if numHereDoc > 0:
-				lHereDoc = []
-				try:
-					text = ''
-					for i in range(numHereDoc):
-						hereLine = gen.send('any')
-						while not isAllWhiteSpace(hereLine):
-							text += hereLine
-							hereLine = gen.send('any')
-						lHereDoc.append(rmPrefix(text))
-						numHereDoc -= 1
-				except:
-					raise SyntaxError("Unexpected EOF in HEREDOC string")
+			numTokens += 1
 
 			# --- process first non-empty line
 			if rootNode == None:
@@ -113,11 +381,16 @@ class PLLParser():
 
 				# --- This wouldn't make any sense, but in case someone does it
 				if marked:
-					hSubTrees[firstWordOf(label)] = curNode
+					self.addMark(hSubTrees, label, curNode)
+				if trackLines:
+					lNodeLines.append((lineNum, newLevel, curNode,
+					                   marked and firstWordOf(label)))
 
 				curLevel = newLevel
 				if debug:
 					print(f"   - root node set to '{label}'")
+				if hStrings != None:
+					internNode = curNode
 				continue
 
 			diff = newLevel - curLevel
@@ -127,6 +400,7 @@ class PLLParser():
 				if debug:
 					print('   - continuation')
 
+				numContinuations += 1
 				curNode['label'] += ' ' + label
 
 				# --- Don't change curLevel
@@ -136,12 +410,20 @@ class PLLParser():
 					assert isinstance(curNode, TreeNode)
 					print(f"   - new child of {curNode.asDebugString()}")
 				assert not curNode.firstChild
-				curNode = self.constructor(label).makeChildOf(curNode)
+				if lazy:
+					curNode = hSubTrees.newPlaceholder(label).makeChildOf(curNode)
+				else:
+					curNode = self.constructor(label).makeChildOf(curNode)
 				if lHereDoc:
 					curNode['lHereDoc'] = lHereDoc
 				if marked:
-					hSubTrees[firstWordOf(label)] = curNode
+					self.addMark(hSubTrees, label, curNode)
+				if trackLines:
+					lNodeLines.append((lineNum, newLevel, curNode,
+					                   marked and firstWordOf(label)))
 				curLevel += 1
+				if curLevel > maxDepth:
+					maxDepth = curLevel
 
 			elif diff < 0:    # i.e. newLevel < curLevel
 				# --- Move up -diff levels, then create sibling node
@@ -153,36 +435,497 @@ class PLLParser():
 					curLevel -= 1
 					curNode = curNode.parent
 					assert curNode
-				curNode = self.constructor(label).makeSiblingOf(curNode)
+				if lazy:
+					curNode = hSubTrees.newPlaceholder(label).makeSiblingOf(curNode)
+				else:
+					curNode = self.constructor(label).makeSiblingOf(curNode)
 				if lHereDoc:
 					curNode['lHereDoc'] = lHereDoc
 				if marked:
-					hSubTrees[firstWordOf(label)] = curNode
+					self.addMark(hSubTrees, label, curNode)
+				if trackLines:
+					lNodeLines.append((lineNum, newLevel, curNode,
+					                   marked and firstWordOf(label)))
 			elif diff == 0:
 				# --- create new sibling node
 				if debug:
 					print(f"   - new sibling of {curNode.asDebugString()}")
 				assert not curNode.nextSibling
-				curNode = self.constructor(label).makeSiblingOf(curNode)
+				if lazy:
+					curNode = hSubTrees.newPlaceholder(label).makeSiblingOf(curNode)
+				else:
+					curNode = self.constructor(label).makeSiblingOf(curNode)
 				if lHereDoc:
 					curNode['lHereDoc'] = lHereDoc
 				if marked:
-					hSubTrees[firstWordOf(label)] = curNode
+					self.addMark(hSubTrees, label, curNode)
+				if trackLines:
+					lNodeLines.append((lineNum, newLevel, curNode,
+					                   marked and firstWordOf(label)))
 
 			else:
 				raise Exception("What! This cannot happen")
 
+			if (hStrings != None) and not lazy:
+				internNode = curNode
+
+		if (only != None) and (skipLevel != None):
+			hSubTrees.addLazy(lSkipKeys, skipStart, len(lineIndex) + 1)
+
+		if hStrings != None:
+			if internNode != None:
+				label = internNode['label']
+				s = hStrings.setdefault(label, label)
+				if s is not label:
+					internNode['label'] = s
+					numHits += 1
+					savedBytes += getsizeof(label)
+				numLookups += 1
+			table = self.internTable
+			table.numLookups += numLookups
+			table.numHits += numHits
+			table.savedBytes += savedBytes
+		self.numNodes = numTokens - numContinuations
+		self.maxDepth = maxDepth
+
 		if self.numLines == 0:
 			raise Exception("parsePLL(): No text to parse")
 
 		if not rootNode:
 			raise Exception("parsePLL(): rootNode is empty")
 
-		assert isinstance(rootNode, self.constructor)
+		# --- constructor may also be a function, e.g. CompactTree.newNode
+		assert isinstance(rootNode, self.constructor) \
+			if isinstance(self.constructor, type) \
+			else isinstance(rootNode, TreeNode)
+		if trackLines:
+			self.rootNode = rootNode
+			self.hSubTrees = hSubTrees
 		return (rootNode, hSubTrees)
 
 	# ------------------------------------------------------------------------
 
+	def _finishTree(self, builder):
+		# --- Tell a _buildTree() generator that there are no more tokens
+		#     Returns (rootNode, hSubTrees)
+
+		try:
+			builder.send(None)
+		except StopIteration as ex:
+			return ex.value
+		raise Exception("What! This cannot happen")
+
+	# ------------------------------------------------------------------------
+
+	def addMark(self, hSubTrees, label, node):
+		# --- If the same key is marked more than once, the last one wins
+
+		key = firstWordOf(label)
+		if key in hSubTrees:
+			self.lDupMarks.append(key)
+		hSubTrees[key] = node
+
+	# ------------------------------------------------------------------------
+
+	def reparse(self, oldTree, editStartLine, editEndLine, newText):
+		# --- Replace source lines editStartLine up to, but not including,
+		#     editEndLine (1-based) with newText, and update the tree
+		#     returned by the last parse() or reparse() call.
+		#     Use editStartLine == editEndLine to insert lines.
+		#
+		#     Only the smallest subtree enclosing the edit, whose
+		#     indentation boundaries are unchanged, is parsed again
+		#     and spliced into the tree, which is modified in place.
+		#     If there is no such subtree, the whole text is parsed again.
+		#
+		#     Returns (rootNode, hSubTrees)
+
+		if not self.trackLines:
+			raise Exception("reparse() requires trackLines=True")
+		assert oldTree is self.rootNode
+
+		lLines = self.lSourceLines
+		lNodeLines = self.lNodeLines
+		if not (1 <= editStartLine <= editEndLine <= len(lLines) + 1):
+			raise Exception(f"reparse(): Bad line range"
+			                f" {editStartLine}..{editEndLine}")
+
+		lNewLines = io.StringIO(newText).readlines()
+		if lNewLines and not lNewLines[-1].endswith('\n'):
+			lNewLines[-1] += '\n'
+
+		# --- Start with the last node at or before the edit,
+		#     then try each of its ancestors in turn. Inserted lines
+		#     most likely belong with the line before them
+		probe = editStartLine
+		if editStartLine == editEndLine:
+			probe -= 1
+		k = bisect_right(lNodeLines, probe, key=lambda e: e[0]) - 1
+		while k >= 0:
+			(startLine, level, oldNode, key) = lNodeLines[k]
+
+			# --- find the end of this node's subtree
+			j = k + 1
+			while (j < len(lNodeLines)) and (lNodeLines[j][1] > level):
+				j += 1
+			if j < len(lNodeLines):
+				endLine = lNodeLines[j][0]
+			else:
+				endLine = len(lLines) + 1
+
+			if editEndLine <= endLine:
+				result = self._reparseSubtree(k, j, editStartLine, editEndLine,
+				                              lNewLines, endLine)
+				if result:
+					return result
+
+			# --- move to the parent node
+			k -= 1
+			while (k >= 0) and (lNodeLines[k][1] >= level):
+				k -= 1
+
+		# --- No enclosing subtree could be re-parsed - parse everything
+		lLines[editStartLine-1:editEndLine-1] = lNewLines
+		return self.parse(''.join(lLines))
+
+	# ------------------------------------------------------------------------
+
+	def _reparseSubtree(self, k, j, editStartLine, editEndLine,
+	                          lNewLines, endLine):
+		# --- Try to replace the subtree of lNodeLines[k] (whose
+		#     descendents are lNodeLines[k+1:j]) after applying the edit.
+		#     Returns None if the edit changes the subtree's boundaries
+
+		lLines = self.lSourceLines
+		(startLine, level, oldNode, key) = self.lNodeLines[k]
+
+		lChunk = (lLines[startLine-1:editStartLine-1]
+		        + lNewLines
+		        + lLines[editEndLine-1:endLine-1])
+
+		hOptions = {name: getattr(self, name) for name in self.hDefOptions}
+		parser = PLLParser(self.constructor, hOptions, trackLines=True,
+		                   intern=self.internTable)
+		try:
+			(newNode, hNewSubTrees) = parser.parse(''.join(lChunk))
+		except Exception:
+			return None
+
+		# --- Must be a single subtree at the same indentation
+		if newNode.nextSibling:
+			return None
+		if parser.leadWS != self.leadWS + '\t' * level:
+			return None
+
+		# --- Splice in the new subtree - top level nodes have no parent,
+		#     so find the previous sibling here
+		prev = None
+		i = k - 1
+		while (i >= 0) and (self.lNodeLines[i][1] >= level):
+			if self.lNodeLines[i][1] == level:
+				prev = self.lNodeLines[i][2]
+				break
+			i -= 1
+		oldNode.replaceWith(newNode, prev)
+		if oldNode is self.rootNode:
+			self.rootNode = newNode
+
+		# --- Update source lines and node line numbers
+		setKeys = {key for (n, lvl, node, key) in self.lNodeLines[k:j] if key}
+		delta = len(lNewLines) - (editEndLine - editStartLine)
+		lLines[editStartLine-1:editEndLine-1] = lNewLines
+		lNodeLines = self.lNodeLines = (
+			self.lNodeLines[:k]
+			+ [(n + startLine - 1, lvl + level, node, key)
+			   for (n, lvl, node, key) in parser.lNodeLines]
+			+ [(n + delta, lvl, node, key)
+			   for (n, lvl, node, key) in self.lNodeLines[j:]]
+			)
+
+		# --- Update marked subtrees. The same key may also be used
+		#     outside the subtree, and the last one in the text wins
+		hSubTrees = self.hSubTrees
+		setKeys.update(hNewSubTrees.keys())
+		if setKeys:
+			for key in setKeys:
+				hSubTrees.pop(key, None)
+			for (n, lvl, node, key) in lNodeLines:
+				if key in setKeys:
+					hSubTrees[key] = node
+		return (self.rootNode, hSubTrees)
+
+	# ------------------------------------------------------------------------
+
+	def iterEvents(self, fh):
+		# --- Yields ('enter', level, label, marked, lHereDoc)
+		#         and ('leave', level) events, properly nested,
+		#     without creating any nodes. Memory use is bounded by
+		#     the longest line/HEREDOC, not the size of the document
+		#
+		#     An 'enter' event is held back until the next line is seen
+		#     since continuation lines modify the label
+
+		pending = None       # the 'enter' event not yet yielded
+		curLevel = None
+		debug = self.debug
+
+		for (lineNum, newLevel, label, marked, lHereDoc) in self._tokens(fh):
+			if lHereDoc:
+				lHereDoc = lHereDoc.get()
+
+			if pending == None:
+				pending = ['enter', newLevel, label, marked, lHereDoc]
+				curLevel = newLevel
+				continue
+
+			diff = newLevel - curLevel
+
+			if diff > 1:
+				# --- continuation line - append to pending node's label
+				if debug:
+					print('   - continuation')
+				pending[2] += ' ' + label
+				continue
+
+			yield tuple(pending)
+
+			if diff <= 0:
+				# --- close the current node, plus -diff ancestors
+				while curLevel >= newLevel:
+					yield ('leave', curLevel)
+					curLevel -= 1
+			curLevel = newLevel
+			pending = ['enter', newLevel, label, marked, lHereDoc]
+
+		if pending == None:
+			raise Exception("iterPLL(): No text to parse")
+
+		yield tuple(pending)
+		while curLevel >= 0:
+			yield ('leave', curLevel)
+			curLevel -= 1
+
+	# ------------------------------------------------------------------------
+
+	def validate(self, fh):
+		# --- Check the syntax of fh, without building any nodes
+		#     Returns a list of SyntaxErrors, each with lineno and text
+		#     set, or an empty list if there are no errors
+		#
+		#     Applies the same rules as parse(), but reports every
+		#     error in one pass instead of stopping at the first one:
+		#        - every line must start with the leading whitespace
+		#          of the first non-blank line
+		#        - indentation cannot contain space chars
+		#        - marked lines cannot be empty
+		#        - HEREDOC lines must share the first one's indentation
+		#        - every HEREDOC must be ended by a blank line
+
+		if isinstance(fh, str):
+			fh = io.StringIO(fh)
+		elif isBuffer(fh):
+			fh = LineIndex(fh)
+
+		lErrors = []
+		lexer = LineLexer(self)
+		feed = lexer.feed
+		for line in fh:
+			try:
+				feed(line)
+			except SyntaxError as ex:
+				lErrors.append(ex)
+		try:
+			lexer.finish()
+		except SyntaxError as ex:
+			lErrors.append(ex)
+		if lexer.leadWS == None:
+			lErrors.append(SyntaxError("No text to parse",
+			                           (None, lexer.lineNum, None, None)))
+		return lErrors
+
+	# ------------------------------------------------------------------------
+
+	def _tokens(self, fh):
+		# --- Returns a generator that yields
+		#        (lineNum, level, label, marked, lHereDoc)
+		#     for each non-blank line, with any HEREDOC lines consumed
+
+		# --- Buffers are indexed once, then lines are sliced out
+		#     as needed, which also allows sourceLine() to work
+		if isinstance(fh, LineIndex):
+			self.lineIndex = fh
+		elif isBuffer(fh):
+			fh = self.lineIndex = LineIndex(fh)
+		else:
+			self.lineIndex = None
+
+		if self.fastLexer:
+			return self._lexTokens(fh)
+		else:
+			return self._splitTokens(fh)
+
+	# ------------------------------------------------------------------------
+
+	def sourceLine(self, lineNum):
+		# --- Returns source line lineNum (1-based) of the last text
+		#     parsed, or None if the source lines are not available
+		#     (i.e. unless parsing a buffer or using trackLines)
+
+		try:
+			if self.lineIndex:
+				return self.lineIndex.line(lineNum)
+			if self.trackLines:
+				return self.lSourceLines[lineNum-1]
+		except (AttributeError, IndexError):
+			pass
+		return None
+
+	# ------------------------------------------------------------------------
+
+	def addLineInfo(self, ex, lineNum):
+		# --- Add the line number and text to a SyntaxError
+
+		if ex.lineno == None:
+			ex.lineno = lineNum
+			ex.text = self.sourceLine(lineNum)
+
+	# ------------------------------------------------------------------------
+
+	def _splitTokens(self, fh):
+
+		self.numLines = 0
+		debug = self.debug
+		stats = self.stats
+
+		try:
+			# --- Putting this in a separate variable
+			#     allows us to get HEREDOC lines
+			gen = self._generator(fh)
+			for line in gen:
+				lineNum = self.numLines
+				if debug:
+					print(f"LINE {lineNum}: '{traceStr(line)}'", end='')
+
+				(level, label, marked, numHereDoc) = self.splitLine(line)
+
+				if debug:
+					print(f" [{level},{numHereDoc}] '{label}'")
+
+				# --- Extract HEREDOC strings, if any
+				lHereDoc = None
+				if numHereDoc > 0:
+					if stats != None:
+						startHereDoc = perf_counter()
+					lHereDoc = []
+					for i in range(numHereDoc):
+						lText = []
+						try:
+							hereLine = gen.send('any')
+							while not isAllWhiteSpace(hereLine):
+								lText.append(hereLine)
+								hereLine = gen.send('any')
+						except:
+							raise SyntaxError("Unexpected EOF in HEREDOC string")
+						lHereDoc.append(makeHereDoc(lText,
+						                            self.numLines - len(lText)))
+					lHereDoc = HereDocList(lHereDoc)
+					if stats != None:
+						stats.hTimes['hereDoc'] += perf_counter() - startHereDoc
+						stats.hCounts['hereDocLines'] += (self.numLines - lineNum
+						                                  - numHereDoc)
+
+				yield (lineNum, level, label, marked, lHereDoc)
+		except SyntaxError as ex:
+			self.addLineInfo(ex, self.numLines)
+			raise
+
+	# ------------------------------------------------------------------------
+
+	def _lexTokens(self, fh):
+		# --- Same as _splitTokens(), but uses a LineLexer, which does
+		#     the work of nextNonBlankLine() and splitLine() in one pass
+		#     with lexLine(), and simply iterates over the lines instead
+		#     of using the _generator() send() protocol
+
+		# --- Allow passing in a string
+		#     HEREDOCs are views into the source string or buffer,
+		#     when there is one, else into the list of their lines
+		text = None
+		if isinstance(fh, str):
+			text = fh
+			fh = io.StringIO(fh)
+		lexer = LineLexer(self, self.lineIndex if (self.lineIndex != None)
+		                        else text)
+		feed = lexer.feed
+
+		self.numLines = 0
+		lines = iter(fh)
+		if self.stats != None:
+			lines = self.stats.timedLines(lines)
+		for line in lines:
+			token = feed(line)
+			if token != None:
+				self.leadWS = lexer.leadWS
+				self.numLines = lexer.lineNum
+				yield token
+		lexer.finish()
+		self.numLines = lexer.lineNum
+
+	# ------------------------------------------------------------------------
+
+	async def _asyncTokens(self, lines):
+		# --- Same as _lexTokens(), but lines is an async iterator
+		#     lexLine() is always used, since there is no async
+		#     version of the _generator() send() protocol
+
+		lexer = LineLexer(self)
+		feed = lexer.feed
+
+		self.numLines = 0
+		async for line in lines:
+			token = feed(line)
+			if token != None:
+				self.leadWS = lexer.leadWS
+				self.numLines = lexer.lineNum
+				yield token
+		lexer.finish()
+		self.numLines = lexer.lineNum
+
+	# ------------------------------------------------------------------------
+
+	def lexLine(self, line, leadWS=''):
+		# --- Single pass alternative to nextNonBlankLine() + splitLine()
+		#     line is a raw source line, which must start with leadWS
+		#     Returns None for blank and comment lines, else
+		#        (level, label, marked, numHereDoc)
+		#     label will have markStr removed, but hereDocStr's will remain
+
+		if self.lexComments:
+			line = re.sub(self.reComment, '', line)
+		(indent, mark, label) = self.reLexLine.match(line).groups()
+		label = label.rstrip()
+		if not label:
+			if mark:
+				raise SyntaxError("Marked lines cannot be empty")
+			return None
+
+		if leadWS:
+			if not indent.startswith(leadWS):
+				raise SyntaxError("Missing leading whitespace")
+			indent = indent[len(leadWS):]
+		if ' ' in indent:
+			raise SyntaxError(f"Indentation '{traceStr(indent)}'"
+			                   " cannot contain space chars")
+
+		numHereDoc = 0
+		if self.hereDocStr:
+			numHereDoc = label.count(self.hereDocStr)
+		if '\\' in label:
+			label = label.replace('\\#', '#')
+		return (len(indent), label, bool(mark), numHereDoc)
+
+	# ------------------------------------------------------------------------
+
 	def _generator(self, fh):
 
 		# --- Allow passing in a string
@@ -204,6 +947,7 @@ class PLLParser():
 		if result:
 			leadWS = result.group(1)
 			leadLen = len(leadWS)
+		self.leadWS = leadWS
 
 		flag = None   # might become 'any'
 
@@ -281,10 +1025,11 @@ class PLLParser():
 	# ---------------------------------------------------------------------------
 
 	def nextAnyLine(self, fh):
+		# --- numLines counts the lines read, not the EOF
 
 		line = fh.readline()
-		self.numLines += 1
 		if line:
+			self.numLines += 1
 			return line
 		else:
 			return None
@@ -292,21 +1037,384 @@ class PLLParser():
 	# ---------------------------------------------------------------------------
 
 	def nextNonBlankLine(self, fh):
+		# --- numLines counts the lines read, not the EOF
 
 		line = fh.readline()
-		self.numLines += 1
 		if not line:
 			return None
+		self.numLines += 1
 		line = re.sub(self.reComment, '', line)
 		line = line.rstrip()
 		while line == '':
 			line = fh.readline()
-			self.numLines += 1
 			if not line: return None
+			self.numLines += 1
 			line = re.sub(self.reComment, '', line)
 			line = line.rstrip()
 		return line
 
+# ---------------------------------------------------------------------------
+
+class LineLexer():
+	# --- The state machine that turns source lines into tokens,
+	#        (lineNum, level, label, marked, lHereDoc)
+	#     shared by _lexTokens(), _asyncTokens(), validate() and
+	#     PLLBatch.findSplitPoints(), so that they all handle the
+	#     leading whitespace and HEREDOCs the same way. Pass each line
+	#     to feed(), in order. It returns a token once a node's line,
+	#     and any HEREDOCs following it, are complete, else None.
+	#     Call finish() after the last line.
+	#
+	#     source, if given, is the string or LineIndex that the lines
+	#     come from, so that HEREDOCs can be views into it - otherwise
+	#     they're views into lists of their lines.
+	#     Every SyntaxError raised has lineno and text set. After feed()
+	#     raises one, the lexer is ready for the next line, so a caller
+	#     can report the error and carry on
+
+	def __init__(self, parser, source=None):
+
+		self.lexLine = parser.lexLine
+		self.stats = parser.stats
+		self.source = source
+		self.lineNum = 0
+		self.offset = 0        # of the next line, in a string source
+		self.leadWS = None     # leading whitespace of the first node
+
+		# --- While reading HEREDOCs
+		self.numHereDoc = 0    # number still to be ended
+		self.header = None     # (token, line) of the node they follow
+		self.lHereDoc = None   # HereDocs ended so far
+		self.lText = None      # lines of the current HEREDOC
+		self.hereWS = None     # and their leading whitespace
+		self.hereStart = 0     # offset of its first line
+		self.hereBad = False   # True if one had bad indentation
+
+	# ------------------------------------------------------------------------
+
+	def feed(self, line):
+
+		self.lineNum += 1
+		start = self.offset
+		self.offset = start + len(line)
+		if self.numHereDoc:
+			return self.hereDocLine(line, start)
+
+		leadWS = self.leadWS
+		if leadWS == None:
+			# --- the first non-blank line determines
+			#     the leading whitespace for ALL lines
+			result = reLeadWS.match(line)
+			leadWS = result.group(1) if result else ''
+		try:
+			token = self.lexLine(line, leadWS)
+		except SyntaxError as ex:
+			ex.lineno = self.lineNum
+			ex.text = line
+			raise
+		if token == None:
+			return None
+		self.leadWS = leadWS
+
+		(level, label, marked, numHereDoc) = token
+		if numHereDoc == 0:
+			return (self.lineNum, level, label, marked, None)
+
+		self.header = ((self.lineNum, level, label, marked), line)
+		self.numHereDoc = numHereDoc
+		self.lHereDoc = []
+		self.lText = []
+		self.hereBad = False
+		return None
+
+	# ------------------------------------------------------------------------
+
+	def skip(self, line):
+		# --- Use instead of feed() for a line that's known not to
+		#     start any HEREDOCs (e.g. it doesn't contain hereDocStr)
+		#     when its token isn't needed. Only allowed once leadWS
+		#     is known, and not while reading HEREDOCs
+
+		assert (self.leadWS != None) and not self.numHereDoc
+		self.lineNum += 1
+		self.offset += len(line)
+
+	def skipLines(self, numLines, length):
+		# --- Same as calling skip() for numLines lines,
+		#     length being their total length
+
+		assert (self.leadWS != None) and not self.numHereDoc
+		self.lineNum += numLines
+		self.offset += length
+
+	# ------------------------------------------------------------------------
+
+	def hereDocLine(self, line, start):
+		# --- A blank line ends each HEREDOC
+
+		lText = self.lText
+		if line.strip():
+			if not lText:
+				self.hereStart = start
+				result = reLeadWS.match(line)
+				self.hereWS = result.group(1) if result else ''
+			lText.append(line)
+			if not line.startswith(self.hereWS):
+				self.hereBad = True
+				raise SyntaxError("Bad indentation in HEREDOC string",
+				                  (None, self.lineNum, None, line))
+			return None
+
+		stats = self.stats
+		if stats != None:
+			startHereDoc = perf_counter()
+		if not self.hereBad:
+			self.lHereDoc.append(makeHereDoc(lText,
+			                                 self.lineNum - len(lText),
+			                                 self.source, self.hereStart))
+		if stats != None:
+			stats.hTimes['hereDoc'] += perf_counter() - startHereDoc
+			stats.hCounts['hereDocLines'] += len(lText)
+
+		self.lText = []
+		self.numHereDoc -= 1
+		if self.numHereDoc:
+			return None
+		(token, headerLine) = self.header
+		self.header = None
+		return token + (HereDocList(self.lHereDoc),)
+
+	# ------------------------------------------------------------------------
+
+	def finish(self):
+		# --- Raises a SyntaxError, for the HEREDOC's header line,
+		#     if a HEREDOC hasn't been ended
+
+		if self.numHereDoc:
+			self.numHereDoc = 0
+			((lineNum, level, label, marked), line) = self.header
+			raise SyntaxError("Unexpected EOF in HEREDOC string",
+			                  (None, lineNum, None, line))
+
+# ---------------------------------------------------------------------------
+
+LazyRange = namedtuple('LazyRange', ['startLine', 'endLine'])
+
+# --- A marked subtree nested inside a skipped one, which is
+#     found when node, the placeholder of the skipped one, is built
+
+LazyMark = namedtuple('LazyMark', ['node'])
+
+class LazyNode():
+	# --- The methods of placeholder nodes - see LazySubTrees.
+	#     Reading the node's contents, i.e. its keys, children or
+	#     hData, first builds it. Its parent and siblings are real,
+	#     so it's linked into the tree without being built. Its
+	#     label, including any continuation lines, is kept by
+	#     lazySubTrees, so it can be read without building the node,
+	#     e.g. by the parent's classifyChildren()
+	#
+	#     These are copied into a subclass of the constructor class,
+	#     rather than this being a base class, since a node's class
+	#     can only be changed back to the constructor class if it
+	#     adds nothing to the object layout - no slots, no other bases.
+	#     So anything else a placeholder needs is kept by lazySubTrees,
+	#     which is a class attribute of the subclass
+
+	__slots__ = ()
+
+	def __bool__(self):
+		return True
+
+	def __getitem__(self, key):
+		if key == 'label':
+			return self.lazySubTrees.hLabels[id(self)]
+		self.lazySubTrees.build(self)
+		return self[key]
+
+	def __setitem__(self, key, value):
+		self.lazySubTrees.build(self)
+		self[key] = value
+
+	def __delitem__(self, key):
+		self.lazySubTrees.build(self)
+		del self[key]
+
+	def __contains__(self, key):
+		if key == 'label':
+			return True
+		self.lazySubTrees.build(self)
+		return key in self
+
+	def __len__(self):
+		self.lazySubTrees.build(self)
+		return len(self)
+
+	def __iter__(self):
+		self.lazySubTrees.build(self)
+		return iter(self)
+
+def lazyAttribute(name):
+	# --- An attribute of LazyNode that builds the node when it's read,
+	#     but not when it's set, e.g. by the constructor, which sets
+	#     the constructor class's own attribute, i.e. its slot
+
+	def getAttr(self):
+		self.lazySubTrees.build(self)
+		return getattr(self, name)
+
+	def setAttr(self, value):
+		getattr(type(self).__mro__[1], name).__set__(self, value)
+
+	return property(getAttr, setAttr)
+
+for name in ('hData', 'firstChild', 'lastChild', 'nChildren'):
+	setattr(LazyNode, name, lazyAttribute(name))
+
+# ---------------------------------------------------------------------------
+
+class LazySubTrees(dict):
+	# --- The hSubTrees dict returned when parsing with only=...
+	#     Each marked subtree that was skipped has a placeholder node
+	#     in the tree, of a subclass of the constructor class, which
+	#     only records the source lines. The first time its contents
+	#     are read, the lines are parsed, and the placeholder becomes
+	#     the subtree's root node, in place - its class is set back to
+	#     the constructor class, and it gets the parsed node's data
+	#     and children. So the tree always has the same structure as
+	#     the document, and walking it builds any subtrees reached.
+	#
+	#     Marked subtrees nested inside a skipped one are stored as a
+	#     LazyMark, and are built along with it, when they're read.
+	#     values() and items() only build a subtree when it's reached
+
+	def __init__(self, parser, lineIndex):
+		super().__init__()
+		self.parser = parser
+		self.lineIndex = lineIndex
+		constructor = parser.constructor
+		hMembers = {name: value for (name, value) in vars(LazyNode).items()
+		                        if name not in ('__module__', '__qualname__',
+		                                        '__doc__')}
+		hMembers['lazySubTrees'] = self
+		self.lazyClass = type('Lazy' + constructor.__name__,
+		                      (constructor,), hMembers)
+		self.placeholder = None     # the one being skipped
+
+		# --- id(placeholder) => its label, and its LazyRange
+		self.hLabels = {}
+		self.hRanges = {}
+
+	# ------------------------------------------------------------------------
+
+	def newPlaceholder(self, label):
+
+		node = self.placeholder = self.lazyClass(label)
+		self.hLabels[id(node)] = label
+		return node
+
+	def continueLabel(self, label):
+		# --- Adds a continuation line to the label of the
+		#     placeholder being skipped
+
+		self.hLabels[id(self.placeholder)] += ' ' + label
+
+	# ------------------------------------------------------------------------
+
+	def addLazy(self, lKeys, startLine, endLine):
+		# --- Records the lines of the placeholder being skipped,
+		#     and the keys of the marks nested in it
+
+		node = self.placeholder
+		self.hRanges[id(node)] = LazyRange(startLine, endLine)
+		table = self.parser.internTable
+		if table != None:
+			# --- its label is complete now
+			self.hLabels[id(node)] = table.intern(self.hLabels[id(node)])
+		mark = LazyMark(node)
+		for key in lKeys:
+			dict.__setitem__(self, key, mark)
+		self.placeholder = None
+
+	# ------------------------------------------------------------------------
+
+	def isBuilt(self, key):
+
+		value = dict.__getitem__(self, key)
+		return not (isinstance(value, LazyMark)
+		            or (type(value) is self.lazyClass))
+
+	# ------------------------------------------------------------------------
+
+	def __getitem__(self, key):
+
+		value = dict.__getitem__(self, key)
+		if isinstance(value, LazyMark):
+			self.build(value.node)
+			value = dict.__getitem__(self, key)
+		return value
+
+	def get(self, key, default=None):
+
+		if key in self:
+			return self[key]
+		else:
+			return default
+
+	def values(self):
+
+		return collections.abc.ValuesView(self)
+
+	def items(self):
+
+		return collections.abc.ItemsView(self)
+
+	# ------------------------------------------------------------------------
+
+	def build(self, node):
+		# --- Parses the lines of placeholder node, and makes it the
+		#     root of the result
+
+		parser = self.parser
+		hOptions = {name: getattr(parser, name) for name in parser.hDefOptions}
+		lazy = self.hRanges.pop(id(node))
+		del self.hLabels[id(node)]
+		text = self.lineIndex.text(lazy.startLine, lazy.endLine)
+		(newNode, hSubTrees) = PLLParser(parser.constructor, hOptions,
+		                                 intern=parser.internTable).parse(text)
+
+		# --- Everything but the parent and next sibling, including any
+		#     slots, comes from newNode, whose children become node's
+		(parent, nextSibling) = (node.parent, node.nextSibling)
+		node.__class__ = type(newNode)
+		if hasattr(newNode, '__dict__'):
+			hDict = node.__dict__
+			hDict.clear()
+			hDict.update(newNode.__dict__)
+		for cls in type(newNode).__mro__:
+			lSlots = getattr(cls, '__slots__', ())
+			if isinstance(lSlots, str):
+				lSlots = (lSlots,)
+			for name in lSlots:
+				if hasattr(newNode, name) \
+						and (name not in ('__dict__', '__weakref__')):
+					setattr(node, name, getattr(newNode, name))
+		node.parent = parent
+		node.nextSibling = nextSibling
+		child = node.firstChild
+		while child is not None:
+			child.parent = node
+			child = child.nextSibling
+
+		for key in [key for (key, value) in dict.items(self)
+		                if isinstance(value, LazyMark) and (value.node is node)]:
+			if key in hSubTrees:
+				subTree = hSubTrees[key]
+				dict.__setitem__(self, key,
+				                 node if (subTree is newNode) else subTree)
+			else:
+				dict.__delitem__(self, key)
+
 # ---------------------------------------------------------------------------
 #                   UNIT TESTS
 # ---------------------------------------------------------------------------
@@ -465,6 +1573,615 @@ def test_6():
 
 	assert tree.firstChild['label'] == 'color = #abcdef'
 
+# ---------------------------------------------------------------------------
+#     Test streaming events
+
+def test_9():
+	s = '''
+		menubar
+			file
+				new
+					*handler <<<
+						my $evt = $_[0];
+						return undef;
+
+				open
+						with a long label
+			edit
+				undo
+	'''
+	lEvents = list(iterPLL(s))
+	assert lEvents[0] == ('enter', 0, 'menubar', False, None)
+	assert lEvents[3] == ('enter', 3, 'handler <<<', True,
+	                      ['my $evt = $_[0];\nreturn undef;\n'])
+	assert ('enter', 2, 'open with a long label', False, None) in lEvents
+	assert lEvents[-1] == ('leave', 0)
+
+	# --- one 'enter' and one 'leave' per node, properly nested
+	(tree, hSubTrees) = parsePLL(s)
+	lEnter = [e for e in lEvents if e[0] == 'enter']
+	assert len(lEnter) == ilen(tree.descendents())
+	assert len(lEvents) == 2 * len(lEnter)
+	depth = 0
+	for event in lEvents:
+		if event[0] == 'enter':
+			assert event[1] == depth
+			depth += 1
+		else:
+			depth -= 1
+			assert event[1] == depth
+	assert depth == 0
+
+def test_10():
+	# --- fragments yield multiple top level nodes
+	s = '''
+		menubar
+			file
+		layout
+	'''
+	assert list(iterPLL(s)) == [
+		('enter', 0, 'menubar', False, None),
+		('enter', 1, 'file', False, None),
+		('leave', 1),
+		('leave', 0),
+		('enter', 0, 'layout', False, None),
+		('leave', 0),
+		]
+
+def test_11(tmp_path):
+	from PLLCache import PLLCache
+	cache = PLLCache(tmp_path)
+	s = '''
+		App
+			* menubar
+				file
+	'''
+	(tree1, h1) = parsePLL(s, cache=cache)
+	(tree2, h2) = parsePLL(s, cache=cache)
+	assert cache.hStats['memory'] == 1
+	assert tree2.asString() == tree1.asString()
+	assert h2['menubar']['label'] == 'menubar'
+
+# ---------------------------------------------------------------------------
+#     Test incremental re-parsing
+
+def checkReparse(s, editStartLine, editEndLine, newText):
+	# --- Returns the PLLParser, after checking that reparse()
+	#     gives the same result as parsing the edited text from scratch
+
+	parser = PLLParser(trackLines=True)
+	(tree, hSubTrees) = parser.parse(s)
+	(tree, hSubTrees) = parser.reparse(tree, editStartLine, editEndLine,
+	                                   newText)
+
+	lLines = io.StringIO(s).readlines()
+	lLines[editStartLine-1:editEndLine-1] = io.StringIO(newText).readlines()
+	(tree2, hSubTrees2) = parsePLL(''.join(lLines))
+
+	assert tree.asString() == tree2.asString()
+	assert ilen(tree.followingNodes()) == ilen(tree2.followingNodes())
+	assert sorted(hSubTrees.keys()) == sorted(hSubTrees2.keys())
+	for key in hSubTrees.keys():
+		assert hSubTrees[key].asString() == hSubTrees2[key].asString()
+	return parser
+
+reparse_str = '''
+	at 0, 0
+		repeat 4
+			move 50
+			turn 90
+	at 60, 0
+		*inner
+			move 50
+'''
+
+def test_12():
+	parser = PLLParser(trackLines=True)
+	(tree, hSubTrees) = parser.parse(reparse_str)
+	second = tree.nextSibling
+	repeat = tree.firstChild
+	move = repeat.firstChild
+	turn = move.nextSibling
+
+	# --- replace 'move 50' with 'move 60'
+	(tree, hSubTrees) = parser.reparse(tree, 4, 5, '\t\t\tmove 60\n')
+
+	# --- only the 'move' node was rebuilt
+	assert tree.nextSibling is second
+	assert tree.firstChild is repeat
+	assert repeat.firstChild is not move
+	assert repeat.firstChild['label'] == 'move 60'
+	assert repeat.firstChild.parent is repeat
+	assert repeat.firstChild.nextSibling is turn
+
+	# --- adding a child to 'repeat' rebuilds the 'repeat' subtree
+	(tree, hSubTrees) = parser.reparse(tree, 6, 6, '\t\t\tmove 10\n')
+	assert tree.firstChild is not repeat
+	assert tree.firstChild.numChildren() == 3
+	assert tree.nextSibling is second
+
+def test_13():
+	# --- edits that stay within a subtree
+	checkReparse(reparse_str, 4, 5, '\t\t\tmove 60\n')
+	checkReparse(reparse_str, 4, 4, '\t\t\tmove 10\n\t\t\tturn 45\n')
+	checkReparse(reparse_str, 4, 6, '')
+	checkReparse(reparse_str, 8, 8, '\t\t\tturn 90\n')
+	checkReparse(reparse_str, 7, 8, '\t\t*outer\n')
+
+def test_14():
+	# --- edits that change the structure, so a parent
+	#     or the whole text must be parsed again
+	checkReparse(reparse_str, 4, 5, '\t\tmove 60\n')
+	checkReparse(reparse_str, 4, 5, '\tmove 60\n')
+	checkReparse(reparse_str, 2, 3, '\tnew top\n')
+	checkReparse(reparse_str, 9, 9, '\tat 0, 60\n')
+	checkReparse(reparse_str, 2, 2, '\tat 90, 90\n')
+
+def test_15():
+	# --- repeated edits keep line numbers in sync
+	parser = PLLParser(trackLines=True)
+	(tree, h) = parser.parse(reparse_str)
+	(tree, h) = parser.reparse(tree, 4, 4, '\t\t\tmove 1\n\t\t\tmove 2\n')
+	(tree, h) = parser.reparse(tree, 10, 11, '\t\t\tmove 3\n')
+	assert h['inner'].firstChild['label'] == 'move 3'
+	assert [lineNum for (lineNum, level, node, key) in parser.lNodeLines] \
+	       == [2, 3, 4, 5, 6, 7, 8, 9, 10]
+
+# ---------------------------------------------------------------------------
+#     Test the single pass lexer
+
+def test_16():
+	lStrings = [
+		'''
+		top
+			peach
+				fuzzy
+						navel
+			apple
+		''',
+		'''
+		menubar
+			new
+				*handler <<< <<<
+					my $evt = $_[0];
+					return undef;
+
+					second doc
+
+			open
+		''',
+		'''
+		bg  # a comment
+			*  color = \\#abcdef   # not a comment
+		# a comment line
+
+			back\\\\slash # comment
+		''',
+		'''
+main
+	sub
+		''',
+		reparse_str,
+		]
+	for s in lStrings:
+		lTokens1 = list(PLLParser()._tokens(s))
+		lTokens2 = list(PLLParser(hOptions={'fastLexer': True})._tokens(s))
+		assert lTokens1 == lTokens2
+
+	# --- and the trees match
+	(tree, h) = parsePLL(lStrings[1], hOptions={'fastLexer': True})
+	assert h['handler']['lHereDoc'] == [
+		'my $evt = $_[0];\nreturn undef;\n',
+		'second doc\n',
+		]
+
+def test_17():
+	hOptions = {'fastLexer': True}
+	for s in ["main\n\t  peach\n", "main\n   peach\n", "main\n\t*\n",
+	          "\tmain\npeach\n", "main <<<\n\ttext\n"]:
+		with pytest.raises(SyntaxError):
+			parsePLL(s)
+		with pytest.raises(SyntaxError):
+			parsePLL(s, hOptions=hOptions)
+
+def test_18():
+	# --- other options are respected
+	hOptions = {
+		'markStr': '@',
+		'hereDocStr': None,
+		'reComment': re.compile(r';.*$'),
+		}
+	s = '''
+		top  ; comment
+			@ marked <<<
+			# not a comment
+	'''
+	lTokens1 = list(PLLParser(hOptions=hOptions)._tokens(s))
+	hOptions['fastLexer'] = True
+	lTokens2 = list(PLLParser(hOptions=hOptions)._tokens(s))
+	assert lTokens1 == lTokens2
+	assert lTokens2[1] == (3, 1, 'marked <<<', True, None)
+
+# ---------------------------------------------------------------------------
+#     Test parsing buffers
+
+def test_19():
+	buf = reparse_str.encode('utf-8')
+	(tree1, h1) = parsePLL(reparse_str)
+	for hOptions in [{}, {'fastLexer': True}]:
+		(tree2, h2) = parsePLL(buf, hOptions=hOptions)
+		assert tree2.asString() == tree1.asString()
+		assert h2['inner']['label'] == 'inner'
+		(tree2, h2) = parsePLL(bytearray(buf), hOptions=hOptions)
+		assert tree2.asString() == tree1.asString()
+
+def test_20():
+	# --- errors report the line number, and the line if available
+	s = "main\n\tsub\n\t  peach\n"
+	for hOptions in [{}, {'fastLexer': True}]:
+		parser = PLLParser(hOptions=hOptions)
+		with pytest.raises(SyntaxError) as info:
+			parser.parse(s.encode('utf-8'))
+		assert info.value.lineno == 3
+		assert info.value.text == "\t  peach\n"
+		assert parser.sourceLine(2) == "\tsub\n"
+
+		with pytest.raises(SyntaxError) as info:
+			parsePLL(s, hOptions=hOptions)
+		assert info.value.lineno == 3
+
+# ---------------------------------------------------------------------------
+#     Test lazy subtrees
+
+lazy_str = '''
+	App
+		* menubar
+			file
+				*new
+						* continued
+				open
+		* layout
+			row
+				EditField
+		*footer
+	Other
+		*menubar
+			edit
+	'''
+
+def test_21():
+	(tree, hSubTrees) = parsePLL(lazy_str, only={'layout'})
+	assert isinstance(hSubTrees, LazySubTrees)
+	assert hSubTrees.isBuilt('layout')
+	assert hSubTrees['layout'].parent is tree
+	assert sorted(hSubTrees.keys()) == ['footer', 'layout', 'menubar', 'new']
+	assert not hSubTrees.isBuilt('menubar')
+	assert not hSubTrees.isBuilt('new')
+
+	# --- the last 'menubar' wins, as with parsePLL(), and skipped
+	#     subtrees are in the tree, built in place when they're read
+	menubar = hSubTrees['menubar']
+	other = tree.nextSibling
+	assert menubar.parent is other
+	assert other.firstChild is menubar
+	assert not hSubTrees.isBuilt('menubar')
+	assert menubar.asString() == 'menubar\n\tedit\n'
+	assert hSubTrees.isBuilt('menubar')
+	assert type(menubar) is TreeNode
+	assert menubar.firstChild.parent is menubar
+	assert other.firstChild is menubar
+
+	# --- nested marks are built along with the outer subtree
+	new = hSubTrees['new']
+	assert new['label'] == 'new continued'
+	assert hSubTrees.isBuilt('new')
+	assert new.parent.parent.parent is tree
+	assert hSubTrees.get('footer')['label'] == 'footer'
+
+	# --- values() and items() build each subtree only when reached
+	(tree, hSubTrees) = parsePLL(lazy_str, only=set())
+	values = hSubTrees.values()
+	assert len(values) == 4
+	assert not any(hSubTrees.isBuilt(key) for key in hSubTrees)
+	assert next(iter(values))['label'] == 'menubar'
+	assert not any(hSubTrees.isBuilt(key) for key in hSubTrees)
+	assert next(iter(values)).firstChild['label'] == 'edit'
+	assert sorted(key for key in hSubTrees if hSubTrees.isBuilt(key)) \
+	       == ['menubar']
+	assert [key for (key, node) in hSubTrees.items()] \
+	       == list(hSubTrees.keys())
+
+	# --- walking the tree builds everything, giving the full document
+	(tree2, h2) = parsePLL(lazy_str)
+	assert tree.asString() == tree2.asString()
+	assert all(hSubTrees.isBuilt(key) for key in hSubTrees)
+
+	with pytest.raises(Exception):
+		PLLParser(lambda label: TreeNode(label), only=set())
+
+def labelsOf(node):
+
+	for (level, node) in node.descendents():
+		yield (level, node['label'])
+
+def test_22():
+	# --- lazy subtrees match the ones built by parsePLL()
+	(tree, hSubTrees) = parsePLL(lazy_str)
+	for hOptions in [{}, {'fastLexer': True}]:
+		for source in [lazy_str, lazy_str.encode('utf-8'),
+		               io.StringIO(lazy_str)]:
+			(tree2, hSubTrees2) = parsePLL(source, hOptions=hOptions,
+			                               only=set())
+			assert sorted(hSubTrees2.keys()) == sorted(hSubTrees.keys())
+			for (key, node) in hSubTrees2.items():
+				assert list(labelsOf(node)) == list(labelsOf(hSubTrees[key]))
+			assert tree2.asString() == tree.asString()
+			assert [level for (level, node) in tree2.followingNodes()] \
+			       == [level for (level, node) in tree.followingNodes()]
+
+def test_36():
+	# --- a parent's options and true children don't build its
+	#     lazy children, whose labels include continuation lines
+	s = '''
+		App
+			width = 100
+			*menubar
+					continued
+				file
+			*layout
+				row
+		'''
+	(tree, hSubTrees) = parsePLL(s, only=set())
+	assert tree.getOptions() == {'width': '100'}
+	assert tree.hasTrueChildren()
+	assert [child['label'] for child in tree.trueChildren()] \
+	       == ['menubar continued', 'layout']
+	assert 'label' in hSubTrees['layout']
+	assert not any(hSubTrees.isBuilt(key) for key in hSubTrees)
+
+	menubar = hSubTrees['menubar']
+	assert menubar.firstChild['label'] == 'file'
+	assert hSubTrees.isBuilt('menubar')
+	assert menubar['label'] == 'menubar continued'
+	assert not hSubTrees.isBuilt('layout')
+
+# ---------------------------------------------------------------------------
+#     Test validation
+
+def test_23():
+	for s in [reparse_str, lazy_str, "top <<<\n\ttext\n\t\tmore\n\nnext\n"]:
+		assert validatePLL(s) == []
+		assert validatePLL(s, {'fastLexer': True}) == []
+
+def test_24():
+	s = '''
+		main
+			  peach
+			*
+	 bad lead
+			apple <<<
+				text
+				  more text
+			  text
+
+			*  # comment only
+			script <<<
+				never ended
+	'''.rstrip() + '\n'
+	lErrors = validatePLL(s)
+	assert [(ex.lineno, ex.msg) for ex in lErrors] == [
+		(3, "Indentation '\\t\\s\\s' cannot contain space chars"),
+		(4, "Marked lines cannot be empty"),
+		(5, "Missing leading whitespace"),
+		(9, "Bad indentation in HEREDOC string"),
+		(11, "Marked lines cannot be empty"),
+		(12, "Unexpected EOF in HEREDOC string"),
+		]
+	assert lErrors[0].text == "\t\t\t  peach\n"
+	assert lErrors[-1].text == "\t\t\tscript <<<\n"
+
+	# --- not the text of an earlier parse
+	parser = PLLParser()
+	parser.parse(b"other <<<\n\ttext\n\n")
+	assert parser.validate(s)[-1].text == "\t\t\tscript <<<\n"
+
+	# --- parse() stops at the first one
+	with pytest.raises(SyntaxError) as info:
+		parsePLL(s)
+	assert info.value.lineno == 3
+
+def test_25():
+	assert [ex.msg for ex in validatePLL('')] == ["No text to parse"]
+	assert validatePLL(reparse_str.encode('utf-8')) == []
+
+# ---------------------------------------------------------------------------
+#     Test async parsing
+
+async def aLinesOf(s):
+
+	for line in io.StringIO(s):
+		yield line
+
+def test_26():
+	(tree1, h1) = parsePLL(reparse_str)
+
+	async def main():
+		reader = asyncio.StreamReader()
+		reader.feed_data(reparse_str.encode('utf-8'))
+		reader.feed_eof()
+		(tree2, h2) = await parsePLLAsync(reader)
+		assert tree2.asString() == tree1.asString()
+		assert h2['inner'].firstChild['label'] == h1['inner'].firstChild['label']
+
+		(tree3, h3) = await parsePLLAsync(aLinesOf(lazy_str))
+		assert list(labelsOf(tree3)) == list(labelsOf(parsePLL(lazy_str)[0]))
+		assert h3['new']['label'] == 'new continued'
+
+	asyncio.run(main())
+
+def test_27():
+	# --- other tasks run while parsing
+	s = 'top\n' + '\tline <<<\n\t\ttext\n\n' * 50
+	lTicks = []
+
+	async def ticker():
+		while True:
+			lTicks.append(1)
+			await asyncio.sleep(0)
+
+	async def main():
+		task = asyncio.create_task(ticker())
+		(tree, h) = await parsePLLAsync(aLinesOf(s), batchSize=10)
+		task.cancel()
+		return tree
+
+	tree = asyncio.run(main())
+	assert tree.numChildren() == 50
+	assert tree.firstChild['lHereDoc'] == ['text\n']
+	assert len(lTicks) >= 10
+
+def test_35():
+	# --- every path over the lines finds the same first error
+	for s in ["top\n\tscript <<<\n\t\tnever ended\n",
+	          "top <<<\n\t\ttext\n\tbad\n\nnext\n",
+	          "top <<< <<<\n\tone\n\n\ttwo\n",
+	          "top\n\t  sub\n"]:
+		lErrors = validatePLL(s)
+		with pytest.raises(SyntaxError) as info:
+			parsePLL(s, hOptions={'fastLexer': True})
+		with pytest.raises(SyntaxError) as info2:
+			asyncio.run(parsePLLAsync(aLinesOf(s)))
+		for ex in [info.value, info2.value]:
+			assert (ex.lineno, ex.msg, ex.text) \
+			       == (lErrors[0].lineno, lErrors[0].msg, lErrors[0].text)
+
+def test_28():
+	s = "main\n\tsub\n\t  peach\n"
+	with pytest.raises(SyntaxError) as info:
+		asyncio.run(parsePLLAsync(aLinesOf(s)))
+	assert info.value.lineno == 3
+
+	with pytest.raises(SyntaxError):
+		asyncio.run(parsePLLAsync(aLinesOf("main <<<\n\ttext\n")))
+
+# ---------------------------------------------------------------------------
+#     Test lazy HEREDOCs
+
+def test_29():
+	s = "main\n\tscript <<< <<<\n\t\t\tline1\n\t\t\t\tline2\n\n\t\tx\n\n"
+	for hOptions in [{}, {'fastLexer': True}]:
+		for source in [s, s.encode('utf-8'), io.StringIO(s)]:
+			(tree, h) = parsePLL(source, hOptions=hOptions)
+			script = tree.firstChild
+			assert isinstance(script.hData['lHereDoc'], HereDocList)
+			assert script['lHereDoc'] == ['line1\n\tline2\n', 'x\n']
+			assert type(script.hData['lHereDoc']) == list
+
+def test_30():
+	s = "main\n\tscript <<<\n\t\t\tline1\n\t\tline2\n\n"
+	for hOptions in [{}, {'fastLexer': True}]:
+		with pytest.raises(SyntaxError) as info:
+			parsePLL(s, hOptions=hOptions)
+		assert info.value.lineno == 4
+		assert info.value.msg == "Bad indentation in HEREDOC string"
+
+# ---------------------------------------------------------------------------
+#     Test label interning
+
+def test_31():
+	s = "top\n\trow\n\t\tmove 50\n\trow\n\t\tmove 50\n\t\t\t\tand more\n"
+	(tree, h) = parsePLL(s)
+	(row1, row2) = tree.children()
+	assert row1['label'] is not row2['label']
+
+	parser = PLLParser(intern=True)
+	(tree, h) = parser.parse(s)
+	(row1, row2) = tree.children()
+	assert row1['label'] is row2['label']
+	assert row1.firstChild['label'] == 'move 50'
+	assert row2.firstChild['label'] == 'move 50 and more'
+
+	# --- Only the final labels are interned, so 'move 50' on the
+	#     last line is not a hit, and isn't in the table
+	table = parser.internTable
+	assert table.getStats() == {
+		'lookups':    5,
+		'hits':       1,
+		'savedBytes': sys.getsizeof('row'),
+		}
+	assert set(table.hStrings) == {'top', 'row', 'move 50', 'move 50 and more'}
+
+	# --- intern=False is the same as intern=None
+	for intern in [False, None, 0]:
+		(tree, h) = parsePLL(s, intern=intern)
+		(row1, row2) = tree.children()
+		assert row1['label'] is not row2['label']
+
+def test_32():
+	# --- a shared table, also used for lazy subtrees
+	table = InternTable()
+	(tree1, h1) = parsePLL(lazy_str, intern=table)
+	(tree2, h2) = parsePLL(lazy_str, only=set(), intern=table)
+	assert tree1['label'] is tree2['label']
+	assert h1['menubar']['label'] is h2['menubar']['label']
+
+# ---------------------------------------------------------------------------
+#     Test stats
+
+stats_str = '''
+	main
+		# a comment
+
+		sub <<< <<<
+			text
+				more
+
+			x
+
+		sub2
+			deeper
+					continued
+	'''
+
+def test_33():
+	for hOptions in [{}, {'fastLexer': True}]:
+		stats = PLLStats()
+		(tree, h) = parsePLL(stats_str, hOptions=hOptions, stats=stats)
+		assert tree.asString() == 'main\n\tsub <<< <<<\n\tsub2\n\t\tdeeper continued\n'
+		hCounts = stats.hCounts
+		assert hCounts['parses'] == 1
+		assert hCounts['nodes'] == 4
+		assert hCounts['maxDepth'] == 2
+		assert hCounts['hereDocLines'] == 3
+		assert hCounts['blankLines'] == 4
+		assert hCounts['lines'] == len(stats_str.split('\n'))
+		assert stats.hTimes['splitLine'] > 0.0
+		assert stats.hTimes['total'] >= stats.hTimes['nodes']
+
+def test_34():
+	# --- stats accumulate
+	parser = PLLParser(stats=True)
+	parser.parse(stats_str)
+	parser.parse(reparse_str)
+	assert parser.stats.hCounts['parses'] == 2
+	(tree, h) = parsePLL(reparse_str)
+	lLevels = [level for (level, node) in tree.followingNodes()]
+	assert parser.stats.hCounts['maxDepth'] == max(lLevels)
+	assert parser.stats.asDict()['nodes'] == 4 + len(lLevels)
+
+	# --- the EOF isn't counted as a line by either lexer
+	for hOptions in [{}, {'fastLexer': True}]:
+		for stats in [True, False, None]:
+			parser = PLLParser(hOptions=hOptions, stats=stats)
+			(tree, h) = parser.parse('top\n\tsub\n')
+			assert parser.numLines == 2
+			if stats:
+				assert parser.stats.hCounts['lines'] == 2
+			else:
+				assert parser.stats == None
+		(tree, h) = parsePLL('top\n\tsub\n', hOptions=hOptions, stats=False)
+		assert tree.firstChild['label'] == 'sub'
+
 # ---------------------------------------------------------------------------
 
 cleanup_testcode(globals())   # remove unit tests when not testing
@@ -0,0 +1,228 @@
+# PLLStats.py
+
+"""
+counters and phase timers for PLLParser
+"""
+
+import pytest
+from time import perf_counter
+
+from myutils import cleanup_testcode
+
+# ---------------------------------------------------------------------------
+
+class PLLStats():
+	# --- Pass one to PLLParser(stats=...) to collect statistics,
+	#     or use stats=True to have the parser create one.
+	#     They accumulate over every parse using the same object.
+	#
+	#     hCounts:
+	#        parses       - number of calls to parse()
+	#        lines        - lines read, including blank lines and HEREDOCs
+	#        blankLines   - blank and comment lines skipped
+	#        hereDocLines - HEREDOC lines, not counting the blank
+	#                       line that ends each HEREDOC
+	#        nodes        - nodes created
+	#        maxDepth     - deepest level of any node, the root being 0
+	#
+	#     hTimes (in seconds):
+	#        read         - reading lines, other than HEREDOC lines
+	#        commentStrip - removing comments (not with the fastLexer
+	#                       option, where lexLine() does this)
+	#        splitLine    - splitLine() or lexLine()
+	#        hereDoc      - reading and extracting HEREDOCs
+	#        nodes        - building the tree
+	#        total        - all of parse()
+	#
+	#     Timing adds a few function calls per line, so parsing is
+	#     slower with stats than without - the totals are best used
+	#     to compare phases, not as absolute parse times
+
+	lCounters = ['parses', 'lines', 'blankLines', 'hereDocLines',
+	             'nodes', 'maxDepth']
+	lTimers = ['read', 'commentStrip', 'splitLine', 'hereDoc',
+	           'nodes', 'total']
+
+	# ------------------------------------------------------------------------
+
+	def __init__(self):
+
+		self.hCounts = dict.fromkeys(self.lCounters, 0)
+		self.hTimes = dict.fromkeys(self.lTimers, 0.0)
+
+	# ------------------------------------------------------------------------
+
+	def timedLines(self, lines):
+		# --- Wraps an iterator over lines, timing each read
+
+		hTimes = self.hTimes
+		while True:
+			start = perf_counter()
+			line = next(lines, None)
+			hTimes['read'] += perf_counter() - start
+			if line == None:
+				return
+			yield line
+
+	# ------------------------------------------------------------------------
+
+	def timedNextNonBlankLine(self, nextNonBlankLine, parser):
+		# --- Wraps PLLParser.nextNonBlankLine(), which reads lines
+		#     from fh until one isn't blank after removing comments.
+		#     fh.readline() is timed as 'read', the rest of the time
+		#     as 'commentStrip', and every line read but not returned
+		#     (parser.numLines counts them) was blank
+
+		hTimes = self.hTimes
+		hCounts = self.hCounts
+		reader = None
+		def timed(fh):
+			nonlocal reader
+			if (reader == None) or (reader.fh is not fh):
+				reader = TimedReader(fh, hTimes)
+			numLines = parser.numLines
+			readSecs = hTimes['read']
+			start = perf_counter()
+			line = nextNonBlankLine(reader)
+			hTimes['commentStrip'] += (perf_counter() - start
+			                           - (hTimes['read'] - readSecs))
+			numBlank = parser.numLines - numLines
+			if line != None:
+				numBlank -= 1
+			hCounts['blankLines'] += numBlank
+			return line
+		return timed
+
+	# ------------------------------------------------------------------------
+
+	def timedSplitLine(self, splitLine):
+
+		hTimes = self.hTimes
+		def timed(line):
+			start = perf_counter()
+			try:
+				return splitLine(line)
+			finally:
+				hTimes['splitLine'] += perf_counter() - start
+		return timed
+
+	# ------------------------------------------------------------------------
+
+	def timedLexLine(self, lexLine):
+		# --- lexLine() returns None for blank and comment lines
+
+		hTimes = self.hTimes
+		hCounts = self.hCounts
+		def timed(line, leadWS=''):
+			start = perf_counter()
+			try:
+				token = lexLine(line, leadWS)
+			finally:
+				hTimes['splitLine'] += perf_counter() - start
+			if token == None:
+				hCounts['blankLines'] += 1
+			return token
+		return timed
+
+	# ------------------------------------------------------------------------
+
+	def addParse(self, parser, secs):
+		# --- Called at the end of each parse
+
+		hCounts = self.hCounts
+		hCounts['parses'] += 1
+		hCounts['lines'] += parser.numLines
+		hCounts['nodes'] += parser.numNodes
+		hCounts['maxDepth'] = max(hCounts['maxDepth'], parser.maxDepth)
+		self.hTimes['total'] += secs
+
+	# ------------------------------------------------------------------------
+
+	def asDict(self):
+		# --- A flat dict, e.g. for logging
+		#     Times have 'Secs' appended to their names
+
+		hResult = dict(self.hCounts)
+		for (name, secs) in self.hTimes.items():
+			hResult[name + 'Secs'] = secs
+		return hResult
+
+	# ------------------------------------------------------------------------
+
+	def __str__(self):
+
+		lLines = [f"{name:<18} {count:>12,}"
+		          for (name, count) in self.hCounts.items()]
+		total = self.hTimes['total'] or 1.0
+		for (name, secs) in self.hTimes.items():
+			lLines.append(f"{name + ' time':<18} {secs:>12.4f}"
+			              f"  {100 * secs / total:5.1f}%")
+		return '\n'.join(lLines)
+
+# ---------------------------------------------------------------------------
+
+class TimedReader():
+	# --- A file handle, as far as readline() is concerned, which
+	#     adds the time spent in fh.readline() to hTimes['read']
+
+	__slots__ = ('fh', 'hTimes')
+
+	def __init__(self, fh, hTimes):
+
+		self.fh = fh
+		self.hTimes = hTimes
+
+	def readline(self):
+
+		start = perf_counter()
+		line = self.fh.readline()
+		self.hTimes['read'] += perf_counter() - start
+		return line
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def test_1():
+	stats = PLLStats()
+	lLines = list(stats.timedLines(iter(['a\n', 'b\n'])))
+	assert lLines == ['a\n', 'b\n']
+	assert stats.hTimes['read'] > 0.0
+
+def test_2():
+	stats = PLLStats()
+	lexLine = stats.timedLexLine(lambda line, leadWS: None)
+	assert lexLine('# comment\n') == None
+	assert stats.hCounts['blankLines'] == 1
+	assert stats.asDict()['splitLineSecs'] > 0.0
+	assert 'blankLines' in str(stats)
+
+def test_3():
+	import io
+
+	class Parser():
+		numLines = 0
+		def nextNonBlankLine(self, fh):
+			line = fh.readline()
+			while line == '\n':
+				self.numLines += 1
+				line = fh.readline()
+			if line:
+				self.numLines += 1
+				return line
+			return None
+
+	stats = PLLStats()
+	parser = Parser()
+	nextNonBlankLine = stats.timedNextNonBlankLine(parser.nextNonBlankLine,
+	                                               parser)
+	fh = io.StringIO('a\n\n\nb\n\n')
+	assert nextNonBlankLine(fh) == 'a\n'
+	assert nextNonBlankLine(fh) == 'b\n'
+	assert nextNonBlankLine(fh) == None
+	assert stats.hCounts['blankLines'] == 3
+	assert stats.hTimes['read'] > 0.0
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
@@ -0,0 +1,595 @@
+# SharedTree.py
+
+"""
+immutable trees in which equal subtrees are stored only once
+"""
+
+import pytest
+
+from myutils import cleanup_testcode, rmPrefix
+from TreeNode import TreeNode, reAssign, checkLabel
+
+# ---------------------------------------------------------------------------
+
+class SharedNode():
+	# --- An immutable node, made by a SharedTable. Each table holds
+	#     one SharedNode per distinct subtree, i.e. per combination of
+	#     label, other keys and children, so equal subtrees are the
+	#     same object, wherever they appear. That means a node has no
+	#     parent or siblings - it may be the child of many nodes.
+	#
+	#        label     - the label
+	#        tExtra    - ((key, value), ...) for keys other than
+	#                    'label', sorted by key, e.g. 'lHereDoc'
+	#        tChildren - the children, as a tuple of SharedNodes
+	#
+	#     Nodes from the same table are equal only if they're the same
+	#     object. Nodes from different tables are compared by contents,
+	#     so use 'is' where both are known to be from one table.
+	#     The hash is computed when the node is made.
+	#     Results computed from a subtree can be kept for each node,
+	#     since any equal subtree will give the same one - see memoize()
+	#
+	#     It isn't a collections.abc.Mapping, though it acts like a
+	#     read-only one, since Mapping.__eq__ would then make a
+	#     TreeNode equal to any SharedNode with the same keys
+
+	__slots__ = ('label', 'tExtra', 'tChildren', 'hashValue')
+
+	def __init__(self, label, tExtra, tChildren):
+
+		setattr = object.__setattr__
+		setattr(self, 'label', label)
+		setattr(self, 'tExtra', tExtra)
+		setattr(self, 'tChildren', tChildren)
+		setattr(self, 'hashValue', hash((label, tExtra,
+			tuple([child.hashValue for child in tChildren]))))
+
+	def __setattr__(self, name, value):
+		raise AttributeError(f"SharedNode: cannot set '{name}'")
+
+	def __delattr__(self, name):
+		raise AttributeError(f"SharedNode: cannot delete '{name}'")
+
+	# ------------------------------------------------------------------------
+
+	def __hash__(self):
+		return self.hashValue
+
+	def __eq__(self, other):
+		if self is other:
+			return True
+		if not isinstance(other, SharedNode):
+			return False
+
+		# --- a stack, rather than recursion, so any depth works
+		lStack = [(self, other)]
+		while lStack:
+			(node1, node2) = lStack.pop()
+			if node1 is node2:
+				continue
+			if (node1.hashValue != node2.hashValue) \
+					or (node1.label != node2.label) \
+					or (node1.tExtra != node2.tExtra) \
+					or (len(node1.tChildren) != len(node2.tChildren)):
+				return False
+			lStack.extend(zip(node1.tChildren, node2.tChildren))
+		return True
+
+	def __repr__(self):
+		return f"SharedNode({self.label!r}, {len(self.tChildren)} children)"
+
+	# ------------------------------------------------------------------------
+	# --- These methods allow us to treat a SharedNode as a
+	#     read-only dict, like a TreeNode
+
+	def __getitem__(self, key):
+		if key == 'label':
+			return self.label
+		for (k, value) in self.tExtra:
+			if k == key:
+				return value
+		raise KeyError(key)
+
+	def __contains__(self, key):
+		if key == 'label':
+			return True
+		for (k, value) in self.tExtra:
+			if k == key:
+				return True
+		return False
+
+	def __len__(self):
+		return 1 + len(self.tExtra)
+
+	def __iter__(self):
+		yield 'label'
+		for (key, value) in self.tExtra:
+			yield key
+
+	def keys(self):
+		return list(self)
+
+	def items(self):
+		return [('label', self.label)] + list(self.tExtra)
+
+	def values(self):
+		return [value for (key, value) in self.items()]
+
+	def get(self, key, default=None):
+		try:
+			return self[key]
+		except KeyError:
+			return default
+
+	# ------------------------------------------------------------------------
+
+	def hasChildren(self):
+
+		return len(self.tChildren) > 0
+
+	def numChildren(self):
+
+		return len(self.tChildren)
+
+	def children(self):
+
+		return iter(self.tChildren)
+
+	def descendents(self, level=0):
+		# --- Pre-order, like TreeNode.descendents(). A shared subtree
+		#     is yielded once for each place it appears
+
+		yield (level, self)
+		lStack = [iter(self.tChildren)]
+		while lStack:
+			node = next(lStack[-1], None)
+			if node is None:
+				lStack.pop()
+				continue
+			yield (level + len(lStack), node)
+			lStack.append(iter(node.tChildren))
+
+	# --- A SharedNode has no siblings, so these TreeNode methods,
+	#     which cover a node's following siblings, work as they are
+	followingNodes = descendents
+	iterLines = TreeNode.iterLines
+	writeTo = TreeNode.writeTo
+	asString = TreeNode.asString
+
+	def uniqueNodes(self):
+		# --- Yields each distinct node in this subtree once, children
+		#     before their parents
+
+		hSeen = set()
+		lStack = [(self, iter(self.tChildren))]
+		hSeen.add(id(self))
+		while lStack:
+			(node, children) = lStack[-1]
+			child = next(children, None)
+			if child is None:
+				lStack.pop()
+				yield node
+			elif id(child) not in hSeen:
+				hSeen.add(id(child))
+				lStack.append((child, iter(child.tChildren)))
+
+	def numNodes(self):
+		# --- Number of nodes in the tree this stands for, i.e. counting
+		#     a shared subtree each time it appears
+
+		hCount = {}
+		for node in self.uniqueNodes():
+			n = 1
+			for child in node.tChildren:
+				n += hCount[id(child)]
+			hCount[id(node)] = n
+		return hCount[id(self)]
+
+	def numUnique(self):
+		# --- Number of distinct nodes actually stored
+
+		n = 0
+		for node in self.uniqueNodes():
+			n += 1
+		return n
+
+	def getOptions(self, *, re=reAssign):
+
+		hOptions = {}
+		for child in self.tChildren:
+			r = re.search(child.label)
+			if r:
+				hOptions[r.group(1)] = r.group(2)
+		return hOptions
+
+	def trueChildren(self, re=reAssign):
+
+		for child in self.tChildren:
+			if not re.search(child.label):
+				yield child
+
+	# ------------------------------------------------------------------------
+
+	def thaw(self, constructor=TreeNode):
+		# --- Returns a new mutable tree, equal to this one, built with
+		#     constructor. Tuple values (e.g. 'lHereDoc') become lists
+
+		lParents = []     # lParents[level] is the last node at level
+		for (level, node) in self.descendents():
+			newNode = constructor(node.label)
+			for (key, value) in node.tExtra:
+				if isinstance(value, tuple):
+					value = list(value)
+				newNode[key] = value
+			del lParents[level:]
+			if lParents:
+				lParents[-1].appendChildNode(newNode)
+			lParents.append(newNode)
+		return lParents[0]
+
+# ---------------------------------------------------------------------------
+
+def extraOf(node):
+	# --- Returns SharedNode.tExtra for the keys of a node other
+	#     than 'label'. It's read as a mapping, so any kind of node
+	#     works, and lazy values are computed. Lists become tuples,
+	#     at any depth, so they can be hashed. Any other value that
+	#     can't be hashed, e.g. a dict, raises TypeError
+
+	if len(node) == 1:
+		return ()
+	label = node['label']
+	lExtra = []
+	for (key, value) in node.items():
+		if key == 'label':
+			continue
+		lExtra.append((key, hashableOf(value, key, label)))
+	lExtra.sort()
+	return tuple(lExtra)
+
+def hashableOf(value, key, label):
+
+	if isinstance(value, (list, tuple)):
+		return tuple([hashableOf(item, key, label) for item in value])
+	try:
+		hash(value)
+	except TypeError:
+		raise TypeError(f"SharedTree: key '{key}' of node '{label}'"
+		                f" has a {type(value).__name__} value,"
+		                " which can't be hashed")
+	return value
+
+# ---------------------------------------------------------------------------
+
+class SharedTable():
+	# --- Makes SharedNodes, returning the existing node if there's
+	#     already one with the same label, other keys and children.
+	#
+	#        hNodes - (label, tExtra, ids of children) => SharedNode
+	#
+	#     Children are compared by id(), which only works because
+	#     they must all have been made by this table, and the table
+	#     keeps every node it makes alive until clear() is called.
+	#     Use one table for trees that should share subtrees.
+	#
+	#     Pass newNode as the constructor to build a tree with the
+	#     parser. Each subtree is made shared as soon as it's complete,
+	#     so the whole tree never exists as TreeNodes, e.g.
+	#
+	#        table = SharedTable()
+	#        (root, hSubTrees) = parsePLL(text, table.newNode)
+	#        tree = root.freeze()
+
+	def __init__(self):
+
+		self.hNodes = {}
+		self.numLookups = 0
+
+	# ------------------------------------------------------------------------
+
+	def make(self, label, tChildren=(), tExtra=()):
+		# --- Returns the SharedNode with label, tExtra and tChildren,
+		#     which must all have been made by this table
+
+		self.numLookups += 1
+		key = (label, tExtra, tuple([id(child) for child in tChildren]))
+		node = self.hNodes.get(key)
+		if node is None:
+			checkLabel(label)
+			node = self.hNodes[key] = SharedNode(label, tExtra,
+			                                     tuple(tChildren))
+		return node
+
+	# ------------------------------------------------------------------------
+
+	def freeze(self, rootNode):
+		# --- Returns the SharedNode for rootNode and its descendents,
+		#     but not its following siblings
+
+		if isinstance(rootNode, SharedBuilder) and (rootNode.table is self):
+			return rootNode.freeze()
+
+		from TreeQuery import keyFuncFor
+
+		nodeKey = keyFuncFor(rootNode)
+		hShared = {}      # nodeKey(node) => SharedNode, until its parent's made
+		for (level, node) in rootNode.walkPostOrder():
+			tChildren = tuple([hShared.pop(nodeKey(child))
+			                   for child in node.children()])
+			hShared[nodeKey(node)] = self.make(node['label'], tChildren,
+			                                   extraOf(node))
+		return hShared[nodeKey(rootNode)]
+
+	# ------------------------------------------------------------------------
+
+	def newNode(self, label):
+
+		return SharedBuilder(label, self)
+
+	# ------------------------------------------------------------------------
+
+	def __len__(self):
+		# --- number of distinct nodes
+
+		return len(self.hNodes)
+
+	def getStats(self):
+		# --- Returns a dict with keys:
+		#        lookups - number of nodes made or looked up
+		#        hits    - lookups that found an existing node
+
+		return {
+			'lookups': self.numLookups,
+			'hits':    self.numLookups - len(self.hNodes),
+			}
+
+	def clear(self):
+
+		self.hNodes.clear()
+		self.numLookups = 0
+
+# ---------------------------------------------------------------------------
+
+class SharedBuilder(TreeNode):
+	# --- A TreeNode that's replaced by a SharedNode once it's complete,
+	#     made by SharedTable.newNode(). When a node gets a new last
+	#     child, the previous last child can't change any more, so it's
+	#     frozen, and its own children are unlinked and can be freed.
+	#     Only the nodes on the path to the last node added, and their
+	#     children, are TreeNodes at any time.
+	#
+	#     After freeze(), a node has no children - they're only
+	#     available as self.frozen.tChildren. That includes marked
+	#     nodes in hSubTrees from the parser: use hSubTrees[key].freeze()
+
+	__slots__ = ('table', 'frozen')
+
+	def __init__(self, label, table):
+		super().__init__(label)
+
+		self.table = table
+		self.frozen = None
+
+	# ------------------------------------------------------------------------
+
+	def addChildren(self, newNode):
+
+		if self.frozen is not None:
+			raise Exception("SharedBuilder: node is already frozen")
+		if self.lastChild is not None:
+			self.lastChild.freeze()
+		super().addChildren(newNode)
+
+	# ------------------------------------------------------------------------
+
+	def freeze(self, table=None):
+		# --- Returns the SharedNode for this node, freezing it and any
+		#     descendents that aren't yet. Only the last child of each
+		#     node can still be unfrozen, so those are done bottom up
+
+		assert (table == None) or (table is self.table)
+		if self.frozen is not None:
+			return self.frozen
+
+		lPath = []
+		node = self
+		while (node is not None) and (node.frozen is None):
+			lPath.append(node)
+			node = node.lastChild
+
+		make = self.table.make
+		for node in reversed(lPath):
+			tChildren = tuple([child.frozen for child in node.children()])
+			node.frozen = make(node['label'], tChildren, extraOf(node))
+			node.firstChild = node.lastChild = None
+			node.nChildren = 0
+		return self.frozen
+
+# ---------------------------------------------------------------------------
+
+def memoize(func):
+	# --- Returns a function like func(node), for SharedNodes, that
+	#     calls func only once for each node. Since equal subtrees are
+	#     the same node, e.g. a turtle program's compiled code or a
+	#     subtree's size is computed once for every copy of it.
+	#     The results are in the function's hCache
+
+	hCache = {}
+
+	def memoized(node):
+		try:
+			return hCache[node]
+		except KeyError:
+			result = hCache[node] = func(node)
+			return result
+
+	memoized.hCache = hCache
+	return memoized
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+test_str = '''
+	main
+		repeat 4
+			move 50
+			turn 90
+		left 30
+		repeat 4
+			move 50
+			turn 90
+		shape
+			code <<<
+				print(1)
+
+			repeat 4
+				move 50
+				turn 90
+	'''
+
+def test_1():
+	from PLLParser import parsePLL
+
+	table = SharedTable()
+	(root, hSubTrees) = parsePLL(test_str, table.newNode)
+	tree = root.freeze()
+	assert isinstance(tree, SharedNode)
+	assert root.freeze() is tree
+
+	(tree1, h1) = parsePLL(test_str)
+	assert tree.asString() == tree1.asString()
+	assert tree.asString(pll=True) == tree1.asString(pll=True)
+
+	# --- the 3 copies of 'repeat 4' are one node
+	(rep1, left, rep2, shape) = tree.children()
+	assert rep1 is rep2
+	assert shape.tChildren[1] is rep1
+	assert shape.tChildren[0]['lHereDoc'] == ('print(1)\n',)
+	assert tree.numNodes() == tree1.numNodes() == 13
+	assert tree.numUnique() == 7
+
+	# --- freezing the same text as TreeNodes gives the same nodes
+	assert table.freeze(tree1) is tree
+	assert table.freeze(tree1.firstChild) is rep1
+	assert table.getStats()['hits'] > 0
+
+def test_2():
+	table1 = SharedTable()
+	table2 = SharedTable()
+	tree1 = TreeNode('a').appendChild('b').appendChild('c')
+	tree1.firstChild.appendChild('x')
+	s1 = table1.freeze(tree1)
+	s2 = table2.freeze(tree1)
+	assert s1 is not s2
+	assert s1 == s2
+	assert hash(s1) == hash(s2)
+	assert s1 != table2.make('a', (table2.make('b'),))
+	assert {s1: 1}[s2] == 1
+
+	# --- thaw() gives an equal, mutable tree
+	tree2 = s1.thaw()
+	assert isinstance(tree2, TreeNode)
+	assert tree2.asString() == tree1.asString()
+	tree2.firstChild.appendChild('y')
+	assert table1.freeze(tree2) != s1
+
+	with pytest.raises(AttributeError):
+		s1.label = 'z'
+	with pytest.raises(TypeError):
+		s1['label'] = 'z'
+
+def test_3():
+	from PLLParser import parsePLL
+
+	table = SharedTable()
+	(root, hSubTrees) = parsePLL(rmPrefix('''
+		top
+			*menu
+				width = 100
+				File
+			menu2
+				width = 100
+				File
+		'''), table.newNode)
+	tree = root.freeze()
+	menu = hSubTrees['menu'].freeze()
+	assert menu is tree.tChildren[0]
+	assert menu.getOptions() == {'width': '100'}
+	assert [n.label for n in menu.trueChildren()] == ['File']
+	assert tree.tChildren[1].tChildren[0] is menu.tChildren[0]
+
+	calls = []
+	@memoize
+	def size(node):
+		calls.append(node.label)
+		return 1 + sum(size(child) for child in node.tChildren)
+
+	assert size(tree) == 7
+	assert calls == ['top', 'menu', 'width = 100', 'File', 'menu2']
+
+def test_4():
+	from genPLL import genPLL
+	from PLLParser import parsePLL
+
+	# --- no recursion, so deep trees work
+	n = 3000
+	text = ''.join(('\t' * i) + 'node\n' for i in range(n))
+	table = SharedTable()
+	(root, hSubTrees) = parsePLL(text, table.newNode)
+	tree = root.freeze()
+	assert tree.numNodes() == n
+	assert tree == SharedTable().freeze(tree.thaw())
+
+	(tree1, h1) = parsePLL(genPLL(2000))
+	tree = table.freeze(tree1)
+	assert tree.thaw().asString(pll=True) == tree1.asString(pll=True)
+
+def test_5():
+	# --- a SharedNode is never equal to a TreeNode
+	node = TreeNode('main')
+	shared = SharedTable().freeze(node)
+	assert shared != node
+	assert node != shared
+	assert not (node == shared)
+	assert dict(shared) == {'label': 'main'}
+	assert shared.get('lHereDoc') == None
+
+def test_6():
+	table = SharedTable()
+	node = TreeNode('a')
+	node['lItems'] = [1, [2, [3]], (4, [5])]
+	shared = table.freeze(node)
+	assert shared['lItems'] == (1, (2, (3,)), (4, (5,)))
+	assert table.freeze(node) is shared
+
+	node['hMap'] = {'x': 1}
+	with pytest.raises(TypeError, match="'hMap' of node 'a'.*dict"):
+		table.freeze(node)
+	node['hMap'] = [{'x'}]
+	with pytest.raises(TypeError, match="set"):
+		table.freeze(node)
+
+def test_7():
+	# --- other kinds of node freeze to the same nodes
+	from PLLParser import parsePLL
+	from SlotTreeNode import SlotTreeNode
+	from CompactTree import CompactTree
+
+	table = SharedTable()
+	(root, hSubTrees) = parsePLL(test_str)
+	tree = table.freeze(root)
+
+	(root1, h1) = parsePLL(test_str, SlotTreeNode)
+	assert root1.freeze(table) is tree
+	assert root1.freeze().asString(pll=True) == root.asString(pll=True)
+
+	(root2, h2) = parsePLL(test_str, CompactTree().newNode)
+	assert root2.freeze(table) is tree
+	assert root2.firstChild.freeze(table) is tree.tChildren[0]
+	assert root2.freeze()['label'] == 'main'
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
@@ -0,0 +1,180 @@
+# SlotTreeNode.py
+
+"""
+a TreeNode that uses about half the memory
+"""
+
+import tracemalloc, pytest
+
+from myutils import cleanup_testcode
+from TreeNode import TreeNode, LazyValue, checkLabel
+
+# ---------------------------------------------------------------------------
+
+class SlotTreeNode(TreeNode):
+	# --- The label is kept in a slot instead of in an hData dict.
+	#     Any other keys, e.g. 'lHereDoc', go in hExtra, which is only
+	#     created when one is set. Since most nodes have only a label,
+	#     this saves the dict, which is most of a TreeNode's memory.
+	#
+	#     Works anywhere a TreeNode does, e.g. parsePLL(text, SlotTreeNode),
+	#     except that there is no hData, and the label can't be deleted
+
+	__slots__ = ('label', 'hExtra')
+
+	def __init__(self, label):
+
+		checkLabel(label)
+		self.label = label
+		self.hExtra = None
+		self.parent = None
+		self.nextSibling = None
+		self.firstChild = None
+		self.lastChild = None
+		self.nChildren = 0
+		self.classified = None
+		self.generation = 0
+
+	# ------------------------------------------------------------------------
+
+	def append(self, label):
+		self.appendNode(SlotTreeNode(label))
+		return self    # allow chaining
+
+	def appendChild(self, label):
+		self.appendChildNode(SlotTreeNode(label))
+		return self    # allow chaining
+
+	# ------------------------------------------------------------------------
+	# --- These methods allow us to treat a SlotTreeNode object as a dict
+
+	def __getitem__(self, key):
+		if key == 'label':
+			return self.label
+		if self.hExtra == None:
+			raise KeyError(key)
+		value = self.hExtra[key]
+		if isinstance(value, LazyValue):
+			value = self.hExtra[key] = value.get()
+		return value
+
+	def __setitem__(self, key, value):
+		if key == 'label':
+			self.labelChanged()
+			self.label = value
+		elif self.hExtra == None:
+			self.hExtra = {key: value}
+		else:
+			self.hExtra[key] = value
+
+	def __delitem__(self, key):
+		if key == 'label':
+			raise KeyError("SlotTreeNode: the label cannot be deleted")
+		if self.hExtra == None:
+			raise KeyError(key)
+		del self.hExtra[key]
+
+	def __contains__(self, key):
+		if key == 'label':
+			return True
+		return (self.hExtra != None) and (key in self.hExtra)
+
+	def __len__(self):
+		if self.hExtra == None:
+			return 1
+		return 1 + len(self.hExtra)
+
+	def __iter__(self):
+		yield 'label'
+		if self.hExtra != None:
+			yield from self.hExtra
+
+# ---------------------------------------------------------------------------
+
+def bytesPerNode(text, constructor):
+	# --- Memory used by the tree parsed from text, divided by
+	#     the number of nodes. Parsing under tracemalloc is slow
+
+	from PLLParser import parsePLL
+
+	tracemalloc.start()
+	try:
+		(tree, hSubTrees) = parsePLL(text, constructor)
+		numBytes = tracemalloc.get_traced_memory()[0]
+	finally:
+		tracemalloc.stop()
+	return numBytes / tree.numNodes()
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def test_1():
+	node = SlotTreeNode('move 50')
+	assert isinstance(node, TreeNode)
+	assert node['label'] == 'move 50'
+	assert 'label' in node
+	assert 'lHereDoc' not in node
+	assert dict(node.items()) == {'label': 'move 50'}
+	assert node.hExtra == None
+
+	node['width'] = 100
+	assert node.getOptions() == {}
+	assert dict(node.items()) == {'label': 'move 50', 'width': 100}
+	del node['width']
+	assert len(node) == 1
+	with pytest.raises(KeyError):
+		node['width']
+	with pytest.raises(KeyError):
+		del node['label']
+
+def test_2():
+	from PLLParser import parsePLL
+
+	s = '''
+		App
+			* menubar
+				align = left
+				file <<<
+					some text
+
+			row
+				EditField
+		'''
+	(tree1, h1) = parsePLL(s)
+	(tree2, h2) = parsePLL(s, SlotTreeNode)
+	assert isinstance(tree2.firstChild, SlotTreeNode)
+	assert tree2.asString() == tree1.asString()
+	assert h2['menubar'].getOptions() == {'align': 'left'}
+	assert h2['menubar'].lastChild['lHereDoc'] == ['some text\n']
+
+	tree2.appendChild('new')
+	assert isinstance(tree2.lastChild, SlotTreeNode)
+
+def test_3():
+	from genPLL import genPLL
+
+	text = genPLL(2000, hereDocDensity=0.0)
+	assert bytesPerNode(text, SlotTreeNode) < 0.6 * bytesPerNode(text, TreeNode)
+
+def test_4():
+	from PLLParser import parsePLL
+
+	# --- every class in the chain has slots, so there's no __dict__
+	node = SlotTreeNode('move 50')
+	assert not hasattr(node, '__dict__')
+	with pytest.raises(AttributeError):
+		node.color = 'red'
+
+	# --- lazy subtrees still work, without a __dict__
+	s = 'App\n\t*menubar\n\t\tfile\n\trow\n'
+	(tree, hSubTrees) = parsePLL(s, SlotTreeNode, only=set())
+	assert not hSubTrees.isBuilt('menubar')
+	assert hSubTrees['menubar'].firstChild['label'] == 'file'
+	assert type(hSubTrees['menubar']) is SlotTreeNode
+	assert not hasattr(hSubTrees['menubar'], '__dict__')
+	assert tree.asString() == parsePLL(s)[0].asString()
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
@@ -0,0 +1,656 @@
+# TreeDiff.py
+
+"""
+find the edits that turn one tree into another, and apply them
+"""
+
+import pytest
+from bisect import bisect_left
+from collections import deque
+
+from myutils import cleanup_testcode
+from TreeNode import TreeNode, reAssign
+from TreeQuery import keyFuncFor
+
+# --- An edit script is a list of tuples, applied in order:
+#
+#        ('relabel',   path, label)
+#        ('setOption', path, name, label)  - label is the whole label
+#                                            of the option child,
+#                                            e.g. 'width = 100'
+#        ('delOption', path, name)
+#        ('setData',   path, key, value)   - keys other than 'label',
+#        ('delData',   path, key)          -    e.g. 'lHereDoc'
+#        ('delete',    path)
+#        ('insert',    path, node)         - a copy of node, with its
+#                                            descendents, is inserted
+#        ('move',      path, index)        - index is the new position
+#                                            among the node's siblings
+#
+#     path is a tuple of indexes, each into the true children (see
+#     TreeNode.trueChildren()) of the node before it, starting from
+#     the root, so () is the root. Option children are only changed
+#     by setOption and delOption.
+#
+#     Nodes are only moved among their siblings - a subtree that moves
+#     to a new parent is deleted and inserted. Nodes given to insert
+#     belong to the other tree, so it must not be changed until the
+#     script has been applied
+
+# ---------------------------------------------------------------------------
+
+def subtreeHashes(rootNode, nodeKey):
+	# --- Returns {key: hash} of rootNode and all of its descendents,
+	#     where equal subtrees (labels, other keys and all descendents,
+	#     in order) have equal hashes. Children are hashed before
+	#     their parents, without recursion
+
+	hHashes = {}
+	for (level, node) in rootNode.walkPostOrder():
+		lChildHashes = tuple(hHashes[nodeKey(child)]
+		                     for child in node.children())
+		hHashes[nodeKey(node)] = hash((node['label'], dataOf(node),
+		                               lChildHashes))
+	return hHashes
+
+# ---------------------------------------------------------------------------
+
+def dataOf(node):
+	# --- The keys other than 'label', in a hashable form
+
+	if len(node) == 1:
+		return ()
+	return tuple(sorted((key, repr(value)) for (key, value) in node.items()
+	                                       if key != 'label'))
+
+# ---------------------------------------------------------------------------
+
+def optionLabels(node):
+	# --- {name: label} of the option children, the last one winning,
+	#     as in getOptions()
+
+	hLabels = {}
+	for child in node.children():
+		label = child['label']
+		r = reAssign.search(label)
+		if r:
+			hLabels[r.group(1)] = label
+	return hLabels
+
+# ---------------------------------------------------------------------------
+
+def diffTrees(tree1, tree2):
+	# --- Returns an edit script that changes tree1 into tree2,
+	#     ignoring the roots' following siblings. Identical subtrees
+	#     are skipped as soon as they're found, using subtreeHashes()
+
+	nodeKey1 = keyFuncFor(tree1)
+	nodeKey2 = keyFuncFor(tree2)
+	hHashes1 = subtreeHashes(tree1, nodeKey1)
+	hHashes2 = subtreeHashes(tree2, nodeKey2)
+
+	lScript = []
+	lStack = [(tree1, tree2, ())]
+	while lStack:
+		(node1, node2, path) = lStack.pop()
+		if hHashes1[nodeKey1(node1)] == hHashes2[nodeKey2(node2)]:
+			continue
+
+		if node1['label'] != node2['label']:
+			lScript.append(('relabel', path, node2['label']))
+
+		hData1 = dict(dataOf(node1))
+		for (key, value) in node2.items():
+			if (key != 'label') and (hData1.pop(key, None) != repr(value)):
+				lScript.append(('setData', path, key, value))
+		for key in hData1:
+			lScript.append(('delData', path, key))
+
+		hOptions1 = optionLabels(node1)
+		for (name, label) in optionLabels(node2).items():
+			if hOptions1.pop(name, None) != label:
+				lScript.append(('setOption', path, name, label))
+		for name in hOptions1:
+			lScript.append(('delOption', path, name))
+
+		lPairs = diffChildren(list(node1.trueChildren()),
+		                      list(node2.trueChildren()),
+		                      path, lScript, hHashes1, hHashes2,
+		                      nodeKey1, nodeKey2)
+		for (index, child1, child2) in reversed(lPairs):
+			lStack.append((child1, child2, path + (index,)))
+
+	return lScript
+
+# ---------------------------------------------------------------------------
+
+def diffChildren(lChildren1, lChildren2, path, lScript,
+                 hHashes1, hHashes2, nodeKey1, nodeKey2):
+	# --- Appends edits to lScript that turn the node at path's true
+	#     children, lChildren1, into a list matching lChildren2.
+	#     Returns [(index, child1, child2)] for each pair of children
+	#     that were matched, with index being their final position
+
+	if not (lChildren1 or lChildren2):
+		return []
+
+	# --- Match children with identical subtrees, then with the same
+	#     label, then whatever is left, in order
+	lMatch = [None] * len(lChildren2)     # index into lChildren1
+	lUsed = [False] * len(lChildren1)
+	for getKey1, getKey2 in [
+			(lambda node: hHashes1[nodeKey1(node)],
+			 lambda node: hHashes2[nodeKey2(node)]),
+			(lambda node: node['label'], lambda node: node['label'])]:
+		hWaiting = {}
+		for (i, child) in enumerate(lChildren1):
+			if not lUsed[i]:
+				hWaiting.setdefault(getKey1(child), deque()).append(i)
+		for (j, child) in enumerate(lChildren2):
+			if lMatch[j] == None:
+				lIndexes = hWaiting.get(getKey2(child))
+				if lIndexes:
+					i = lIndexes.popleft()
+					lMatch[j] = i
+					lUsed[i] = True
+	lLeft1 = [i for i in range(len(lChildren1)) if not lUsed[i]]
+	lLeft2 = [j for j in range(len(lChildren2)) if lMatch[j] == None]
+	for (i, j) in zip(lLeft1, lLeft2):
+		lMatch[j] = i
+		lUsed[i] = True
+
+	# --- Unmatched children are deleted. The rest each have a slot,
+	#     numbered from 1 in order, slot 0 being the start of the list
+	hSlot = {}        # index into lChildren1 => slot
+	for i in range(len(lChildren1)):
+		if lUsed[i]:
+			hSlot[i] = len(hSlot) + 1
+		else:
+			lScript.append(('delete', path + (len(hSlot),)))
+	numSlots = len(hSlot) + 1
+
+	# --- Children in the longest run that's already in order stay
+	#     where they are. Each other one is moved, or inserted, just
+	#     after the child that should precede it, into a new slot.
+	#     Slots are never removed, so they can be put in their final
+	#     order with a linked list (lNext) first. Then each edit's
+	#     positions are counts of the slots in use before a slot,
+	#     from a Fenwick tree, so each edit is O(log n), rather than
+	#     searching a list of the children
+	hStay = longestIncreasing([i for i in lMatch if i != None])
+	lNext = list(range(1, numSlots)) + [None]
+	lEdits = []       # (j, old slot or None, slot before, new slot)
+	prevSlot = 0
+	for (j, i) in enumerate(lMatch):
+		if (i != None) and (i in hStay):
+			prevSlot = hSlot[i]
+			continue
+		slot = len(lNext)
+		lNext.append(lNext[prevSlot])
+		lNext[prevSlot] = slot
+		lEdits.append((j, None if (i == None) else hSlot[i], prevSlot, slot))
+		prevSlot = slot
+
+	lRank = [0] * len(lNext)      # position of each slot in the final order
+	slot = lNext[0]
+	rank = 1
+	while slot != None:
+		lRank[slot] = rank
+		rank += 1
+		slot = lNext[slot]
+
+	fenwick = Fenwick(len(lNext))
+	for slot in range(1, numSlots):
+		fenwick.add(lRank[slot], 1)
+	for (j, oldSlot, prevSlot, slot) in lEdits:
+		if oldSlot == None:
+			pos = fenwick.count(lRank[prevSlot])
+			lScript.append(('insert', path + (pos,), lChildren2[j]))
+		else:
+			cur = fenwick.count(lRank[oldSlot]) - 1
+			fenwick.add(lRank[oldSlot], -1)
+			pos = fenwick.count(lRank[prevSlot])
+			lScript.append(('move', path + (cur,), pos))
+		fenwick.add(lRank[slot], 1)
+
+	return [(j, lChildren1[i], lChildren2[j]) for (j, i) in enumerate(lMatch)
+	                                          if i != None]
+
+# ---------------------------------------------------------------------------
+
+class Fenwick():
+	# --- Counts at positions 1 to n, with the total of positions
+	#     1 to k in O(log n)
+
+	def __init__(self, n):
+
+		self.lTree = [0] * (n + 1)
+
+	def add(self, k, delta):
+
+		lTree = self.lTree
+		n = len(lTree)
+		while k < n:
+			lTree[k] += delta
+			k += k & -k
+
+	def count(self, k):
+		# --- total of positions 1 to k, i.e. 0 for k == 0
+
+		lTree = self.lTree
+		total = 0
+		while k > 0:
+			total += lTree[k]
+			k -= k & -k
+		return total
+
+# ---------------------------------------------------------------------------
+
+def longestIncreasing(lValues):
+	# --- Returns the set of values in a longest increasing subsequence
+
+	lTails = []       # lTails[k] is the index of the smallest tail
+	lTailValues = []  # of an increasing run of length k+1
+	lPrev = [None] * len(lValues)
+	for (n, value) in enumerate(lValues):
+		k = bisect_left(lTailValues, value)
+		if k > 0:
+			lPrev[n] = lTails[k-1]
+		if k == len(lTails):
+			lTails.append(n)
+			lTailValues.append(value)
+		else:
+			lTails[k] = n
+			lTailValues[k] = value
+
+	hResult = set()
+	n = lTails[-1] if lTails else None
+	while n != None:
+		hResult.add(lValues[n])
+		n = lPrev[n]
+	return hResult
+
+# ---------------------------------------------------------------------------
+
+def copyTree(node, constructor):
+	# --- Returns a copy of node and its descendents, without recursion
+
+	lLast = []       # lLast[level] is the last node copied at that level
+	for (level, src) in node.descendents():
+		new = constructor(src['label'])
+		for (key, value) in src.items():
+			if key != 'label':
+				new[key] = value
+		del lLast[level:]
+		if level > 0:
+			new.makeChildOf(lLast[-1])
+		lLast.append(new)
+	return lLast[0]
+
+# ---------------------------------------------------------------------------
+
+def patchTree(tree, lScript):
+	# --- Applies an edit script from diffTrees() to tree, in place,
+	#     and returns tree.
+	#     Each node's true children are listed once, when a path first
+	#     goes through it, and delete, insert and move just edit that
+	#     list, so there's no re-classifying the children or walking
+	#     the siblings for each edit. The child links of each parent
+	#     changed that way are rebuilt once, at the end - see
+	#     relinkChildren(). A node's option edits come before the
+	#     edits to its true children in the script, so they never
+	#     see out of date links
+
+	constructor = tree.newNode
+	patcher = Patcher(tree)
+	for edit in lScript:
+		(op, path) = edit[:2]
+		if (op in ('delete', 'insert', 'move')):
+			parent = patcher.nodeAt(path[:-1])
+			lChildren = patcher.editChildren(parent)
+			index = path[-1]
+		else:
+			node = patcher.nodeAt(path)
+
+		if op == 'relabel':
+			node['label'] = edit[2]
+		elif op == 'setData':
+			node[edit[2]] = edit[3]
+		elif op == 'delData':
+			del node[edit[2]]
+		elif op == 'setOption':
+			setOption(node, edit[2], edit[3], constructor)
+		elif op == 'delOption':
+			for child in list(node.children()):
+				r = reAssign.search(child['label'])
+				if r and (r.group(1) == edit[2]):
+					child.detach()
+		elif op == 'delete':
+			del lChildren[index]
+		elif op == 'insert':
+			lChildren.insert(index, copyTree(edit[2], constructor))
+		elif op == 'move':
+			lChildren.insert(edit[2], lChildren.pop(index))
+		else:
+			raise ValueError(f"patchTree(): Unknown edit '{op}'")
+	patcher.finish()
+	return tree
+
+# ---------------------------------------------------------------------------
+
+class Patcher():
+	# --- The lists of true children used by patchTree()
+
+	def __init__(self, tree):
+
+		self.tree = tree
+		self.nodeKey = keyFuncFor(tree)
+		self.hTrue = {}       # node key => [true children], as edited
+		self.hEdited = {}     # node key => (node, [children], before edits)
+
+	def trueChildrenOf(self, node):
+
+		key = self.nodeKey(node)
+		lChildren = self.hTrue.get(key)
+		if lChildren == None:
+			lChildren = self.hTrue[key] = list(node.trueChildren())
+		return lChildren
+
+	def nodeAt(self, path):
+
+		node = self.tree
+		for index in path:
+			node = self.trueChildrenOf(node)[index]
+		return node
+
+	def editChildren(self, parent):
+		# --- Returns parent's list of true children, to be changed
+
+		key = self.nodeKey(parent)
+		if key not in self.hEdited:
+			self.hEdited[key] = (parent, list(parent.children()),
+			                     list(self.trueChildrenOf(parent)))
+		return self.trueChildrenOf(parent)
+
+	def finish(self):
+
+		nodeKey = self.nodeKey
+		for (key, (parent, lOld, lOldTrue)) in self.hEdited.items():
+			relinkChildren(parent, lOld, lOldTrue, self.hTrue[key], nodeKey)
+
+# ---------------------------------------------------------------------------
+
+def relinkChildren(parent, lOld, lOldTrue, lTrue, nodeKey):
+	# --- Makes parent's children lTrue, its new true children, plus
+	#     its option children, which are the ones in lOld, its old
+	#     children, that aren't in lOldTrue. Each option child stays
+	#     just before the true child that followed it, or the next
+	#     one still there, else goes at the end. Old true children
+	#     that are no longer there are left detached
+
+	hOldTrue = {nodeKey(child) for child in lOldTrue}
+	hTrue = {nodeKey(child) for child in lTrue}
+	hBefore = {}      # key of true child => [option children before it]
+	lOptions = []
+	for child in lOld:
+		key = nodeKey(child)
+		if key not in hOldTrue:
+			lOptions.append(child)
+		elif key in hTrue:
+			if lOptions:
+				hBefore[key] = lOptions
+				lOptions = []
+		else:
+			child.parent = None
+			child.nextSibling = None
+
+	lChildren = []
+	for child in lTrue:
+		lBefore = hBefore.get(nodeKey(child))
+		if lBefore:
+			lChildren.extend(lBefore)
+		lChildren.append(child)
+	lChildren.extend(lOptions)
+
+	# --- Same as the links made by TreeNode.addChildren()
+	prev = None
+	for child in lChildren:
+		child.parent = parent
+		if prev == None:
+			parent.firstChild = child
+		else:
+			prev.nextSibling = child
+		prev = child
+	if prev == None:
+		parent.firstChild = None
+	else:
+		prev.nextSibling = None
+	parent.lastChild = prev
+	parent.nChildren = len(lChildren)
+	parent.markChanged()
+	parent.classified = None
+
+# ---------------------------------------------------------------------------
+
+def setOption(node, name, label, constructor):
+	# --- Changes the last option child named name, or if there's
+	#     none, adds one after the last option child, or first
+
+	lastOption = None
+	found = None
+	for child in node.children():
+		r = reAssign.search(child['label'])
+		if r:
+			lastOption = child
+			if r.group(1) == name:
+				found = child
+	if found:
+		found['label'] = label
+	elif lastOption and lastOption.nextSibling:
+		lastOption.nextSibling.insertBefore(constructor(label))
+	elif lastOption or not node.firstChild:
+		constructor(label).makeChildOf(node)
+	else:
+		node.firstChild.insertBefore(constructor(label))
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def canonical(node):
+	# --- What a patched tree must match: option children can be
+	#     in a different order
+
+	return (node['label'], dataOf(node), sorted(optionLabels(node).items()),
+	        [canonical(child) for child in node.trueChildren()])
+
+def check(s1, s2, constructor=TreeNode):
+	from PLLParser import parsePLL
+
+	(tree1, h1) = parsePLL(s1, constructor)
+	(tree2, h2) = parsePLL(s2)
+	lScript = tree1.diff(tree2)
+	assert patchTree(tree1, lScript) is tree1
+	assert canonical(tree1) == canonical(tree2)
+	return lScript
+
+def test_1():
+	s = '''
+		App
+			menubar
+				File
+					New
+					Open
+			layout
+				row
+					width = 100
+					button OK
+		'''
+	assert check(s, s) == []
+	assert check(s, s.replace('Open', 'Close')) \
+	       == [('relabel', (0, 0, 1), 'Close')]
+	assert check(s, s.replace('width = 100', 'width = 200')) \
+	       == [('setOption', (1, 0), 'width', 'width = 200')]
+	assert check(s, s.replace('\t\t\t\t\twidth = 100\n', '')) \
+	       == [('delOption', (1, 0), 'width')]
+	assert check(s, s.replace('button OK', 'align = left')) == [
+		('setOption', (1, 0), 'align', 'align = left'),
+		('delete', (1, 0, 0)),
+		]
+	assert check(s, s.replace('App', 'Main')) == [('relabel', (), 'Main')]
+
+def test_2():
+	s = '''
+		App
+			a
+				x
+			b
+			c
+			d
+		'''
+	# --- one move, not 3
+	assert check(s, '''
+		App
+			b
+			c
+			d
+			a
+				x
+		''') == [('move', (0,), 3)]
+
+	lScript = check(s, s.replace('\t\t\tb\n', '\t\t\tnew\n\t\t\t\tchild\n'))
+	assert [edit[0] for edit in lScript] == ['relabel', 'insert']
+
+	assert check(s, s.replace('\t\t\tc\n', '')) == [('delete', (2,))]
+
+	check(s, '''
+		App
+			d
+			new
+			c
+			a
+				y
+		''')
+
+def test_3():
+	import random
+	from PLLParser import parsePLL
+	from genPLL import genPLL
+
+	rng = random.Random(1)
+	text = genPLL(400, hereDocDensity=0.05)
+	for trial in range(40):
+		lLines = text.splitlines(keepends=True)
+		for n in range(rng.randint(1, 8)):
+			i = rng.randrange(1, len(lLines))
+			line = lLines[i]
+			if (line.strip() == '') or line.rstrip().endswith('<<<'):
+				continue
+			choice = rng.random()
+			if choice < 0.3:
+				lLines[i] = line.rstrip('\n') + ' changed\n'
+			elif choice < 0.6:
+				del lLines[i]
+			else:
+				j = rng.randrange(1, len(lLines))
+				lLines.insert(j, lLines.pop(i))
+		try:
+			(tree2, h) = parsePLL(''.join(lLines))
+		except Exception:
+			continue      # the edits made bad PLL
+		(tree1, h) = parsePLL(text)
+		patchTree(tree1, tree1.diff(tree2))
+		assert canonical(tree1) == canonical(tree2)
+
+def test_4():
+	import random
+	from PLLParser import parsePLL
+
+	# --- a wide node, shuffled, with some children replaced
+	rng = random.Random(2)
+	lLabels = [f"item{i}" for i in range(2000)]
+	s1 = 'top\n\twidth = 1\n' + ''.join(f"\t{label}\n" for label in lLabels)
+	rng.shuffle(lLabels)
+	lLabels[::50] = [f"new{i}" for i in range(len(lLabels[::50]))]
+	s2 = 'top\n\twidth = 1\n' + ''.join(f"\t{label}\n" for label in lLabels)
+	(tree1, h1) = parsePLL(s1)
+	(tree2, h2) = parsePLL(s2)
+	lScript = tree1.diff(tree2)
+	assert len(lScript) < 2000
+	oldFirst = tree1.children()
+	next(oldFirst)
+	deleted = [node for node in oldFirst if node['label'] == 'item0']
+	patchTree(tree1, lScript)
+	assert canonical(tree1) == canonical(tree2)
+
+	# --- the links are all consistent
+	lChildren = list(tree1.children())
+	assert tree1.numChildren() == len(lChildren) == 2001
+	assert tree1.lastChild is lChildren[-1]
+	assert all(child.parent is tree1 for child in lChildren)
+	assert tree1.getOptions() == {'width': '1'}
+	if 'item0' not in lLabels:
+		assert deleted[0].parent == None
+
+def test_7():
+	from PLLParser import parsePLL
+
+	# --- many children with the same label are matched in order
+	s1 = 'top\n' + '\tmove 50\n' * 20000 + '\tturn 90\n'
+	s2 = 'top\n\tturn 90\n' + '\tmove 50\n' * 20000
+	(tree1, h1) = parsePLL(s1)
+	(tree2, h2) = parsePLL(s2)
+	lScript = tree1.diff(tree2)
+	assert lScript == [('move', (20000,), 0)]
+	patchTree(tree1, lScript)
+	assert canonical(tree1) == canonical(tree2)
+
+def test_5():
+	lScript = []
+	lPairs = diffChildren([], [], (), lScript, {}, {}, id, id)
+	assert (lPairs, lScript) == ([], [])
+
+	fenwick = Fenwick(5)
+	for k in [1, 3, 5]:
+		fenwick.add(k, 1)
+	assert [fenwick.count(k) for k in range(6)] == [0, 1, 1, 2, 2, 3]
+
+def test_6():
+	from CompactTree import CompactTree
+
+	# --- a CompactTree is patched through its own detach(),
+	#     insertBefore() and newNode(), since its nodes are views
+	s = '''
+		App
+			a
+				width = 1
+				x
+			b
+			c
+				y
+		'''
+	for s2 in [
+			s.replace('\t\t\t\twidth = 1\n', ''),
+			s.replace('\t\t\t\tx\n', '\t\t\t\tx\n\t\t\t\tnew\n'),
+			s.replace('\t\t\t\ty\n', '\t\t\t\theight = 2\n\t\t\t\ty\n'),
+			s.replace('\t\t\tb\n', '').replace('\t\t\t\ty\n',
+			          '\t\t\t\ty\n\t\t\tb\n\t\t\t\tz\n'),
+			]:
+		tree = CompactTree()
+		lScript = check(s, s2, tree.newNode)
+		assert lScript != []
+
+	tree = CompactTree()
+	root = tree.newNode('root').appendChild('a').appendChild('b')
+	(a, b) = root.children()
+	b.insertBefore(tree.newNode('c'))
+	assert [child['label'] for child in root.children()] == ['a', 'c', 'b']
+	assert root.firstChild.nextSibling.parent == root
+	assert b.detach().parent == None
+	assert root.lastChild['label'] == 'c'
+	a.detach()
+	assert (root.numChildren(), root.firstChild['label']) == (1, 'c')
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
@@ -0,0 +1,428 @@
+# TreeFile.py
+
+"""
+a compact binary file format for trees, readable in place,
+e.g. from an mmap, so one subtree can be loaded without the rest
+"""
+
+import sys, io, mmap, struct, json, pytest
+from array import array
+from bisect import bisect_left
+
+from myutils import cleanup_testcode
+from TreeNode import TreeNode
+from LineIndex import isBuffer
+
+# --- File layout, all numbers little endian:
+#
+#        header       - magic, then the 6 counts/sizes in hdrFormat
+#        lStrOffsets  - q[numStrings+1], offsets into the string blob
+#        lExtOffsets  - q[numExtras+1], offsets into the extras blob
+#        lLabels      - I[numNodes], string index of each node's label
+#        lNumChildren - I[numNodes]
+#        lSizes       - I[numNodes], nodes in each node's subtree,
+#                       including itself
+#        lExtNodes    - I[numExtras], sorted indexes of nodes with keys
+#                       other than 'label', e.g. 'lHereDoc'
+#        lMarkKeys    - I[numMarks], string index of each mark's key
+#        lMarkNodes   - I[numMarks], index of each marked node
+#        string blob  - the distinct labels and keys, UTF-8 encoded
+#        extras blob  - a dict of the other keys of each node in
+#                       lExtNodes, as UTF-8 encoded JSON
+#
+#     Nodes are in pre-order, so node i's subtree is nodes
+#     i to i + lSizes[i] - 1, and top level nodes are siblings.
+#     The 'q' columns come first so that every column is aligned.
+#
+#     The extras are JSON, not pickles, so that loading a file can't
+#     run code. So their values must be ones JSON can hold - str,
+#     int, float, bool, None, and lists and dicts (with str keys)
+#     of those - and tuples are loaded as lists
+
+magic = b'PLLTREE2'
+hdrFormat = '<8s6Q'
+hdrSize = struct.calcsize(hdrFormat)
+
+# ---------------------------------------------------------------------------
+
+def writeTreeFile(rootNode, fh, hSubTrees=None):
+	# --- Writes rootNode, its following siblings and all of their
+	#     descendents to the binary file fh, plus the nodes in
+	#     hSubTrees (which must all be in the tree), by key
+
+	hStrings = {}
+	lLabels = array('I')
+	lNumChildren = array('I')
+	lSizes = array('I')
+	lExtNodes = array('I')
+	lExtras = []
+	hIndex = {}      # id(node) => index, only needed for marks
+	lOpen = []       # (level, index) of nodes whose subtree is open
+
+	for (level, node) in rootNode.followingNodes():
+		i = len(lLabels)
+		while lOpen and (lOpen[-1][0] >= level):
+			j = lOpen.pop()[1]
+			lSizes[j] = i - j
+		if lOpen:
+			lNumChildren[lOpen[-1][1]] += 1
+		lOpen.append((level, i))
+
+		label = node['label']
+		lLabels.append(hStrings.setdefault(label, len(hStrings)))
+		lNumChildren.append(0)
+		lSizes.append(0)
+		if len(node) > 1:
+			lExtNodes.append(i)
+			hExtra = {key: value for (key, value) in node.items()
+			                     if key != 'label'}
+			try:
+				lExtras.append(json.dumps(hExtra, ensure_ascii=False)
+				                   .encode('utf-8'))
+			except (TypeError, ValueError) as ex:
+				raise TypeError(f"writeTreeFile(): node '{label}' has"
+				                f" a value that can't be saved: {ex}")
+		if hSubTrees:
+			hIndex[id(node)] = i
+
+	numNodes = len(lLabels)
+	for (level, j) in lOpen:
+		lSizes[j] = numNodes - j
+
+	lMarkKeys = array('I')
+	lMarkNodes = array('I')
+	for (key, node) in (hSubTrees or {}).items():
+		lMarkKeys.append(hStrings.setdefault(key, len(hStrings)))
+		lMarkNodes.append(hIndex[id(node)])
+
+	lEncoded = [s.encode('utf-8') for s in hStrings]
+	lStrOffsets = offsetsOf(lEncoded)
+	lExtOffsets = offsetsOf(lExtras)
+
+	fh.write(struct.pack(hdrFormat, magic, len(lEncoded), numNodes,
+	                     len(lExtras), len(lMarkKeys),
+	                     lStrOffsets[-1], lExtOffsets[-1]))
+	for column in (lStrOffsets, lExtOffsets, lLabels, lNumChildren,
+	               lSizes, lExtNodes, lMarkKeys, lMarkNodes):
+		if sys.byteorder != 'little':
+			column.byteswap()
+		fh.write(column.tobytes())
+	fh.write(b''.join(lEncoded))
+	fh.write(b''.join(lExtras))
+
+# ---------------------------------------------------------------------------
+
+def offsetsOf(lBlobs):
+
+	lOffsets = array('q', [0])
+	pos = 0
+	for blob in lBlobs:
+		pos += len(blob)
+		lOffsets.append(pos)
+	return lOffsets
+
+# ---------------------------------------------------------------------------
+
+class TreeFile():
+	# --- Reads the output of writeTreeFile() in place from buf,
+	#     starting at offset start. buf may be a bytes, bytearray or
+	#     mmap buffer. Strings and extras are only decoded when the
+	#     nodes using them are loaded, so loading a subtree from an
+	#     mmap only reads the pages holding that subtree's nodes,
+	#     plus the header.
+	#
+	#     Call release(), or use a with statement, before closing an
+	#     mmap, since the columns are views into it
+
+	def __init__(self, buf, start=0):
+
+		self.view = memoryview(buf)[start:]
+		(fileMagic, numStrings, numNodes, numExtras, numMarks,
+		 strBlobSize, extBlobSize) = struct.unpack_from(hdrFormat, self.view)
+		if fileMagic != magic:
+			raise ValueError("TreeFile: not a tree file")
+
+		self.numNodes = numNodes
+		self.pos = hdrSize
+		self.lStrOffsets = self.column('q', numStrings + 1)
+		self.lExtOffsets = self.column('q', numExtras + 1)
+		self.lLabels = self.column('I', numNodes)
+		self.lNumChildren = self.column('I', numNodes)
+		self.lSizes = self.column('I', numNodes)
+		self.lExtNodes = self.column('I', numExtras)
+		self.lMarkKeys = self.column('I', numMarks)
+		self.lMarkNodes = self.column('I', numMarks)
+		self.strBlob = self.view[self.pos: self.pos + strBlobSize]
+		self.pos += strBlobSize
+		self.extBlob = self.view[self.pos: self.pos + extBlobSize]
+
+		self.lStrings = [None] * numStrings
+
+	# ------------------------------------------------------------------------
+
+	def column(self, typecode, n):
+
+		size = n * struct.calcsize(typecode)
+		view = self.view[self.pos: self.pos + size]
+		self.pos += size
+		if sys.byteorder == 'little':
+			return view.cast(typecode)
+		column = array(typecode, view)
+		column.byteswap()
+		return column
+
+	# ------------------------------------------------------------------------
+
+	def string(self, i):
+
+		s = self.lStrings[i]
+		if s == None:
+			lStrOffsets = self.lStrOffsets
+			s = self.lStrings[i] = str(
+				self.strBlob[lStrOffsets[i]: lStrOffsets[i+1]], 'utf-8')
+		return s
+
+	# ------------------------------------------------------------------------
+
+	def getMarks(self):
+		# --- Returns {key: node index}
+
+		return {self.string(k): i
+		        for (k, i) in zip(self.lMarkKeys, self.lMarkNodes)}
+
+	# ------------------------------------------------------------------------
+
+	def build(self, start=0, end=None, constructor=TreeNode):
+		# --- Builds nodes start to end-1, which must be a whole number
+		#     of subtrees, e.g. (i, i + lSizes[i]) for the subtree of
+		#     node i. Returns a list of the nodes built, the first one
+		#     being the root. Uses a stack of [node, children left]
+		#     rather than recursion
+
+		if end == None:
+			end = self.numNodes
+		string = self.string
+		lLabels = self.lLabels
+		lNumChildren = self.lNumChildren
+		lExtNodes = self.lExtNodes
+		lExtOffsets = self.lExtOffsets
+		e = bisect_left(lExtNodes, start)
+		nextExt = lExtNodes[e] if (e < len(lExtNodes)) else -1
+
+		lNodes = []
+		lStack = []
+		prevTop = None
+		for i in range(start, end):
+			node = constructor(string(lLabels[i]))
+			if i == nextExt:
+				hExtra = json.loads(
+					bytes(self.extBlob[lExtOffsets[e]: lExtOffsets[e+1]]))
+				if not isinstance(hExtra, dict):
+					raise ValueError(f"TreeFile: bad extras for node {i}")
+				for (key, value) in hExtra.items():
+					node[key] = value
+				e += 1
+				nextExt = lExtNodes[e] if (e < len(lExtNodes)) else -1
+
+			if lStack:
+				entry = lStack[-1]
+				node.makeChildOf(entry[0])
+				entry[1] -= 1
+				while lStack and (lStack[-1][1] == 0):
+					lStack.pop()
+			else:
+				if prevTop != None:
+					node.makeSiblingOf(prevTop)
+				prevTop = node
+			if lNumChildren[i] > 0:
+				lStack.append([node, lNumChildren[i]])
+			lNodes.append(node)
+
+		if lStack:
+			raise ValueError("TreeFile: incomplete subtree")
+		return lNodes
+
+	# ------------------------------------------------------------------------
+
+	def load(self, constructor=TreeNode, key=None):
+		# --- Returns (rootNode, hSubTrees), like parsePLL()
+		#     If key is given, rootNode is that marked subtree's root,
+		#     and hSubTrees only holds marks inside it
+
+		hMarks = self.getMarks()
+		if key == None:
+			(start, end) = (0, self.numNodes)
+		else:
+			start = hMarks[key]
+			end = start + self.lSizes[start]
+
+		lNodes = self.build(start, end, constructor)
+		hSubTrees = {k: lNodes[i - start] for (k, i) in hMarks.items()
+		                                  if start <= i < end}
+		return (lNodes[0], hSubTrees)
+
+	# ------------------------------------------------------------------------
+
+	def release(self):
+
+		for name in ('lStrOffsets', 'lExtOffsets', 'lLabels',
+		             'lNumChildren', 'lSizes', 'lExtNodes',
+		             'lMarkKeys', 'lMarkNodes', 'strBlob', 'extBlob'):
+			column = getattr(self, name)
+			if isinstance(column, memoryview):
+				column.release()
+		self.view.release()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *args):
+		self.release()
+
+# ---------------------------------------------------------------------------
+
+def readTreeFile(fh, constructor=TreeNode, key=None):
+	# --- Returns (rootNode, hSubTrees) from the output of
+	#     writeTreeFile(). fh may be a buffer, or a binary file
+	#     positioned at the start of the tree. A real file is mapped
+	#     with mmap, so loading one marked subtree (by key) only
+	#     reads that part of the file
+
+	if isBuffer(fh):
+		with TreeFile(fh) as treeFile:
+			return treeFile.load(constructor, key)
+
+	try:
+		fileno = fh.fileno()
+	except (AttributeError, io.UnsupportedOperation):
+		fileno = None
+	if fileno == None:
+		with TreeFile(fh.read()) as treeFile:
+			return treeFile.load(constructor, key)
+
+	with mmap.mmap(fileno, 0, access=mmap.ACCESS_READ) as buf:
+		with TreeFile(buf, fh.tell()) as treeFile:
+			return treeFile.load(constructor, key)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def contentsOf(node):
+
+	return [(level, dict(node)) for (level, node) in node.descendents()]
+
+test_str = '''
+	App
+		* menubar
+			file
+				new
+					*handler <<<
+						my $evt = $_[0];
+						return undef;
+
+				open
+			edit
+				undo
+		* layout
+			row
+				EditField
+					héllo = wörld
+	Footer
+		text = bye
+	'''
+
+def test_1():
+	from PLLParser import parsePLL
+
+	(tree, hSubTrees) = parsePLL(test_str)
+	fh = io.BytesIO()
+	tree.dump(fh, hSubTrees)
+	data = fh.getvalue()
+
+	(tree2, h2) = TreeNode.load(io.BytesIO(data))
+	assert tree2.asString(pll=True) == tree.asString(pll=True)
+	assert sorted(h2.keys()) == ['handler', 'layout', 'menubar']
+	assert h2['handler']['lHereDoc'] \
+	       == ['my $evt = $_[0];\nreturn undef;\n']
+	assert h2['layout'].parent is tree2
+	assert tree2.nextSibling['label'] == 'Footer'
+
+	# --- one subtree, from a buffer
+	(menubar, h3) = readTreeFile(data, key='menubar')
+	assert contentsOf(menubar) == contentsOf(hSubTrees['menubar'])
+	assert menubar.parent == None
+	assert sorted(h3.keys()) == ['handler', 'menubar']
+
+def test_2(tmp_path):
+	from PLLParser import parsePLL
+	from genPLL import genPLL
+	from SlotTreeNode import SlotTreeNode
+
+	(tree, hSubTrees) = parsePLL(genPLL(3000, numMarked=5))
+	path = tmp_path / 'tree.bin'
+	with open(path, 'wb') as fh:
+		fh.write(b'some other data')
+		tree.dump(fh, hSubTrees)
+
+	# --- uses mmap, starting at the file position
+	with open(path, 'rb') as fh:
+		fh.seek(len(b'some other data'))
+		(tree2, h2) = SlotTreeNode.load(fh)
+	assert isinstance(tree2, SlotTreeNode)
+	assert tree2.asString(pll=True) == tree.asString(pll=True)
+
+	with open(path, 'rb') as fh:
+		fh.seek(len(b'some other data'))
+		(sub, h3) = TreeNode.load(fh, key='mark3')
+	assert contentsOf(sub) == contentsOf(hSubTrees['mark3'])
+	assert sub.nextSibling == None
+
+def test_3():
+	# --- much deeper than the recursion limit
+	depth = 3 * sys.getrecursionlimit()
+	root = node = TreeNode('level 0')
+	for i in range(1, depth+1):
+		node = TreeNode(f"level {i}").makeChildOf(node)
+	node.append('last')
+
+	fh = io.BytesIO()
+	root.dump(fh, {'deep': node})
+	(root2, h2) = TreeNode.load(io.BytesIO(fh.getvalue()))
+	assert root2.numNodes() == depth + 2
+	assert h2['deep']['label'] == f"level {depth}"
+	assert h2['deep'].nextSibling['label'] == 'last'
+
+	with pytest.raises(ValueError):
+		TreeFile(b'not a tree file' + bytes(100))
+
+def test_4():
+	import pickle
+
+	tree = TreeNode('top').appendChild('a')
+	tree.firstChild['hData'] = {'n': [1, 2.5, None, True], 's': 'x'}
+	fh = io.BytesIO()
+	tree.dump(fh)
+	data = fh.getvalue()
+	(tree2, h2) = TreeNode.load(io.BytesIO(data))
+	assert dict(tree2.firstChild) == dict(tree.firstChild)
+
+	# --- the extras blob is JSON, so a pickle in it isn't loaded
+	assert b'{"hData": {"n": [1, 2.5, null, true], "s": "x"}}' in data
+	class Evil():
+		def __reduce__(self):
+			return (exec, ("raise Exception('pickle was loaded')",))
+	blob = pickle.dumps(Evil())
+	with TreeFile(data) as treeFile:
+		extBlobSize = len(treeFile.extBlob)
+	evil = data[:-extBlobSize] + blob.ljust(extBlobSize, b'.')
+	with pytest.raises(ValueError):
+		TreeNode.load(io.BytesIO(evil))
+
+	tree.firstChild['bad'] = {1, 2}
+	with pytest.raises(TypeError):
+		tree.dump(io.BytesIO())
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
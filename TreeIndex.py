@@ -0,0 +1,218 @@
+# TreeIndex.py
+
+"""
+find nodes in a tree by path or first word, without walking it
+"""
+
+import pytest
+
+from myutils import cleanup_testcode, firstWordOf
+from TreeNode import TreeNode, lGeneration
+
+# ---------------------------------------------------------------------------
+
+class TreeIndex():
+	# --- Built by rootNode.buildIndex(). Maps, for every descendent
+	#     of rootNode (not its following siblings):
+	#        hPaths      - path => [nodes], where a path is the labels
+	#                      from a child of rootNode down to the node,
+	#                      joined with '/', e.g. 'menubar/File/Open...'
+	#        hFirstWords - first word of label => [nodes]
+	#     with the nodes in tree order, since labels may repeat.
+	#
+	#     Every tree change made through TreeNode methods marks the
+	#     changed node and its ancestors with the current generation
+	#     (see TreeNode.lGeneration). Lookups compare rootNode's
+	#     generation to the one saved when the index was built, and
+	#     rebuild the index if rootNode's is newer, i.e. only after
+	#     a change to this tree.
+	#     Changes made by assigning to parent, firstChild, etc.
+	#     directly aren't seen - call rebuild() after making them
+
+	def __init__(self, rootNode):
+
+		self.rootNode = rootNode
+		self.rebuild()
+
+	# ------------------------------------------------------------------------
+
+	def rebuild(self):
+
+		hPaths = {}
+		hFirstWords = {}
+		lPrefixes = ['']     # lPrefixes[level] is the path at level, + '/'
+		for (level, node) in self.rootNode.descendents():
+			if level == 0:
+				continue
+			label = node['label']
+			del lPrefixes[level:]
+			path = lPrefixes[-1] + label
+			lPrefixes.append(path + '/')
+
+			lNodes = hPaths.get(path)
+			if lNodes == None:
+				hPaths[path] = [node]
+			else:
+				lNodes.append(node)
+
+			word = firstWordOf(label)
+			lNodes = hFirstWords.get(word)
+			if lNodes == None:
+				hFirstWords[word] = [node]
+			else:
+				lNodes.append(node)
+
+		self.hPaths = hPaths
+		self.hFirstWords = hFirstWords
+
+		# --- later changes are marked with a newer generation
+		self.generation = lGeneration[0]
+		lGeneration[0] += 1
+
+	# ------------------------------------------------------------------------
+
+	def isCurrent(self):
+
+		return self.rootNode.generation <= self.generation
+
+	# ------------------------------------------------------------------------
+
+	def findAll(self, path):
+		# --- Returns a list of all nodes with path, maybe empty
+
+		if self.rootNode.generation > self.generation:
+			self.rebuild()
+		return self.hPaths.get(path, [])
+
+	# ------------------------------------------------------------------------
+
+	def find(self, path):
+		# --- Returns the first node with path, or None
+
+		lNodes = self.findAll(path)
+		return lNodes[0] if lNodes else None
+
+	# ------------------------------------------------------------------------
+
+	def withFirstWord(self, word):
+		# --- Returns a list of all nodes whose label starts with word
+
+		if self.rootNode.generation > self.generation:
+			self.rebuild()
+		return self.hFirstWords.get(word, [])
+
+	# ------------------------------------------------------------------------
+
+	def __contains__(self, path):
+
+		return len(self.findAll(path)) > 0
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+test_str = '''
+	App
+		*menubar
+			File
+				New
+				Open...
+			Edit
+				Open...
+		*layout
+			row
+				button OK
+				button Cancel
+	'''
+
+def test_1():
+	from PLLParser import parsePLL
+
+	(tree, hSubTrees) = parsePLL(test_str)
+	index = tree.buildIndex()
+	assert index.find('menubar/File/Open...')['label'] == 'Open...'
+	assert index.find('menubar/File/Open...').parent['label'] == 'File'
+	assert index.find('menubar/Edit/Open...').parent['label'] == 'Edit'
+	assert index.find('layout') is hSubTrees['layout']
+	assert index.find('App') == None
+	assert 'menubar/File' in index
+	assert 'menubar/Help' not in index
+	assert [node['label'] for node in index.withFirstWord('button')] \
+	       == ['button OK', 'button Cancel']
+	assert index.withFirstWord('slider') == []
+
+	# --- an index of a subtree
+	index2 = hSubTrees['menubar'].buildIndex()
+	assert index2.find('Edit/Open...') \
+	       is index.find('menubar/Edit/Open...')
+
+def test_2():
+	from PLLParser import parsePLL
+
+	(tree, hSubTrees) = parsePLL(test_str)
+	index = tree.buildIndex()
+	assert index.isCurrent()
+
+	index.find('menubar/File').appendChild('Save')
+	assert not index.isCurrent()
+	assert index.find('menubar/File/Save')['label'] == 'Save'
+	assert index.isCurrent()
+
+	TreeNode('Help').makeSiblingOf(index.find('menubar/Edit'))
+	assert 'menubar/Help' in index
+
+	index.find('menubar/Help')['label'] = 'About'
+	assert 'menubar/Help' not in index
+	assert 'menubar/About' in index
+
+	old = index.find('layout/row')
+	old.replaceWith(TreeNode('col'))
+	assert index.find('layout/row/button OK') == None
+	assert index.withFirstWord('button') == []
+	assert index.find('layout/col').parent is hSubTrees['layout']
+
+def test_3():
+	from PLLParser import parsePLL
+	from CompactTree import CompactTree
+
+	(tree, hSubTrees) = parsePLL(test_str)
+	index = tree.buildIndex()
+	menuIndex = hSubTrees['menubar'].buildIndex()
+
+	# --- changes to other trees, or outside the indexed subtree,
+	#     don't make an index out of date
+	(other, h2) = parsePLL(test_str)
+	other.firstChild.appendChild('new')
+	other.firstChild['label'] = 'changed'
+	other.lastChild.detach()
+	assert index.isCurrent()
+	assert menuIndex.isCurrent()
+
+	hSubTrees['layout'].appendChild('col')
+	assert not index.isCurrent()
+	assert menuIndex.isCurrent()
+	assert 'layout/col' in index
+	assert index.isCurrent()
+
+	# --- a change deep in the tree reaches the root, even when
+	#     its parent was already marked
+	hSubTrees['layout'].appendChild('col2')
+	index.find('menubar/File/New').appendChild('Window')
+	assert not index.isCurrent()
+	assert not menuIndex.isCurrent()
+	assert 'File/New/Window' in menuIndex
+	assert 'menubar/File/New/Window' in index
+	assert 'layout/col2' in index
+
+	# --- a CompactTree has one generation for the whole tree
+	ctree = CompactTree()
+	(croot, h3) = parsePLL(test_str, ctree.newNode)
+	cindex = croot.buildIndex()
+	croot.firstChild.appendChild('Help')
+	assert index.isCurrent()
+	assert not cindex.isCurrent()
+	assert 'menubar/Help' in cindex
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
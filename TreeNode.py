@@ -1,12 +1,42 @@
 # TreeNode.py
 
-import sys, re, pytest, collections
+import sys, io, re, pytest, collections
 from more_itertools import ilen
 
-from myutils import rmPrefix, isAllWhiteSpace
+from myutils import rmPrefix, isAllWhiteSpace, traceStr
 
 reAssign = re.compile(r'^(\S+)\s*\=\s*(.*)$')
 
+# --- So that a TreeIndex can tell that its tree has changed, every
+#     TreeNode method that changes a node's children or label sets
+#     the generation of that node, and of its ancestors, to
+#     lGeneration[0] - see markChanged(). Building an index saves
+#     lGeneration[0], then increments it, so the index is out of date
+#     if its root's generation is newer than the saved value. Changes
+#     to other trees don't affect it.
+#     Marking stops at the first node that already has the current
+#     generation, since its ancestors must have it too, so it costs
+#     O(1) per change, amortized, and nothing at all while no index
+#     has been built since the tree was last changed.
+#     It's not a class variable, since assigning to one of those
+#     slows down attribute lookups on every instance
+
+lGeneration = [0]
+
+# ---------------------------------------------------------------------------
+
+class LazyValue():
+	# --- Base class for values that are stored in a TreeNode, but only
+	#     computed the first time they're read, e.g. HEREDOC strings.
+	#     node[key] returns, and stores, the result of get() instead,
+	#     which every subclass must define. It's only a marker class -
+	#     an abc.ABC would make the isinstance() check in every
+	#     node[key] much slower
+
+	__slots__ = ()
+
+# ---------------------------------------------------------------------------
+
 class TreeNode(collections.abc.MutableMapping):
 	# --- These are a Class variables -------------------
 
@@ -19,17 +49,24 @@ class TreeNode(collections.abc.MutableMapping):
 
 	reSimpleLabel = re.compile(r'^[A-Za-z0-9_]+$')
 
+	# --- Each node's attributes are kept in slots, not a __dict__,
+	#     which saves memory, and lets subclasses like SlotTreeNode
+	#     have no __dict__ at all
+	#
+	#        classified - classifyChildren()'s result, set when it's
+	#                     first asked for, and cleared when the node's
+	#                     children, or their labels, change
+	#        generation - see lGeneration
+
+	__slots__ = ('hData', 'parent', 'nextSibling', 'firstChild',
+	             'lastChild', 'nChildren', 'classified', 'generation')
+
 	# ------------------------------------------------------------------------
 
 	def __init__(self, label):
 		super().__init__()
 
-		# --- label cannot be all whitespace nor start with whitespace
-		if isAllWhiteSpace(label):
-			raise Exception(f"Label '{traceStr(label)}' is all whitespace")
-		if (label.lstrip() != label):
-			raise Exception(f"Label '{traceStr(label)}' has leading whitespace")
-
+		checkLabel(label)
 		self.hData = {
 			'label': label,
 			}
@@ -37,6 +74,13 @@ class TreeNode(collections.abc.MutableMapping):
 		self.nextSibling = None
 		self.firstChild = None
 
+		# --- These make appending a child, and numChildren(), O(1)
+		self.lastChild = None
+		self.nChildren = 0
+
+		self.classified = None
+		self.generation = 0
+
 	# ------------------------------------------------------------------------
 	#    Multiple ways to build up a tree structure
 	# ------------------------------------------------------------------------
@@ -44,17 +88,7 @@ class TreeNode(collections.abc.MutableMapping):
 	def makeChildOf(self, node):
 		assert isinstance(node, TreeNode)
 
-		self.parent = node
-
-		lastChild = node.firstChild
-		if lastChild != None:
-			while lastChild.nextSibling:
-				lastChild = lastChild.nextSibling
-
-			# --- Now, lastChild has no nextSibling
-			lastChild.nextSibling = self
-		else:
-			node.firstChild = self
+		node.addChildren(self)
 		return self    # allow chaining
 
 	def makeSiblingOf(self, node):
@@ -62,29 +96,135 @@ class TreeNode(collections.abc.MutableMapping):
 		assert not self.parent
 		# assert node.parent
 
-		parent = node.parent
-		cur = node
-		while cur.nextSibling:
-			cur = cur.nextSibling
-			assert cur.parent == parent
-		cur.nextSibling = self
-		self.parent = parent
+		node.appendNode(self)
 		return self    # allow chaining
 
 	def appendNode(self, newNode):
-		node = self
-		while node.nextSibling:
-			node = node.nextSibling
-		node.nextSibling = newNode
+		# --- Top level nodes have no parent to keep track of
+		#     the last sibling, so we have to find it
+
+		if self.parent:
+			self.parent.addChildren(newNode)
+		else:
+			node = self
+			while node.nextSibling:
+				node = node.nextSibling
+			node.nextSibling = newNode
 		return self    # allow chaining
 
 	def appendChildNode(self, newNode):
-		if self.firstChild:
-			self.firstChild.appendNode(newNode)
+		self.addChildren(newNode)
+		return self    # allow chaining
+
+	def addChildren(self, newNode):
+		# --- Add newNode, plus any following siblings it has,
+		#     after this node's last child
+
+		if self.generation != lGeneration[0]:
+			self.markChanged()
+		if self.classified != None:
+			self.classified = None
+		n = 1
+		last = newNode
+		last.parent = self
+		while last.nextSibling:
+			last = last.nextSibling
+			last.parent = self
+			n += 1
+
+		if self.lastChild:
+			self.lastChild.nextSibling = newNode
 		else:
 			self.firstChild = newNode
+		self.lastChild = last
+		self.nChildren += n
+
+	def replaceWith(self, newNode, prevSibling=None):
+		# --- newNode (with its children) takes this node's place
+		#     in the tree. This node is left detached.
+		#     Top level nodes have no parent, so if this node has a
+		#     previous sibling, it must be passed in for them
+		assert isinstance(newNode, TreeNode)
+
+		parent = self.parent
+		if parent:
+			parent.markChanged()
+			if parent.classified != None:
+				parent.classified = None
+		if (prevSibling is None) and parent and (parent.firstChild is not self):
+			prevSibling = parent.firstChild
+			while prevSibling.nextSibling is not self:
+				prevSibling = prevSibling.nextSibling
+
+		newNode.parent = parent
+		newNode.nextSibling = self.nextSibling
+		if prevSibling:
+			assert prevSibling.nextSibling is self
+			prevSibling.nextSibling = newNode
+		elif parent:
+			parent.firstChild = newNode
+		if parent and (parent.lastChild is self):
+			parent.lastChild = newNode
+
+		self.parent = None
+		self.nextSibling = None
+		return newNode    # allow chaining
+
+	def detach(self):
+		# --- This node (with its children) is removed from its parent
+		#     Top level nodes have no parent, and are left as they are
+
+		parent = self.parent
+		if not parent:
+			return self
+		parent.markChanged()
+		if parent.classified != None:
+			parent.classified = None
+		if parent.firstChild is self:
+			prev = None
+			parent.firstChild = self.nextSibling
+		else:
+			prev = parent.firstChild
+			while prev.nextSibling is not self:
+				prev = prev.nextSibling
+			prev.nextSibling = self.nextSibling
+		if parent.lastChild is self:
+			parent.lastChild = prev
+		parent.nChildren -= 1
+
+		self.parent = None
+		self.nextSibling = None
 		return self    # allow chaining
 
+	def insertBefore(self, newNode):
+		# --- newNode (with its children, but no siblings) becomes
+		#     this node's previous sibling. This node must have a parent
+		assert isinstance(newNode, TreeNode)
+		assert not newNode.parent and not newNode.nextSibling
+
+		parent = self.parent
+		assert parent
+		parent.markChanged()
+		if parent.classified != None:
+			parent.classified = None
+		if parent.firstChild is self:
+			parent.firstChild = newNode
+		else:
+			prev = parent.firstChild
+			while prev.nextSibling is not self:
+				prev = prev.nextSibling
+			prev.nextSibling = newNode
+		newNode.nextSibling = self
+		newNode.parent = parent
+		parent.nChildren += 1
+		return newNode    # allow chaining
+
+	def newNode(self, label):
+		# --- Returns a new node, with no parent, of the same kind
+		#     as this one, e.g. for nodes added by patchTree()
+
+		return type(self)(label)
+
 	def append(self, label):
 		self.appendNode(TreeNode(label))
 		return self    # allow chaining
@@ -97,14 +237,39 @@ class TreeNode(collections.abc.MutableMapping):
 	# --- These methods allow us to treat a TreeNode object as a dict
 
 	def __getitem__(self, key):
-		return self.hData[key]
+		value = self.hData[key]
+		if isinstance(value, LazyValue):
+			value = self.hData[key] = value.get()
+		return value
 
 	def __setitem__(self, key, value):
+		if key == 'label':
+			self.labelChanged()
 		self.hData[key] = value
 
 	def __delitem__(self, key):
+		if key == 'label':
+			self.labelChanged()
 		del self.hData[key]
 
+	def markChanged(self):
+		# --- Sets the generation of this node and its ancestors
+		#     to the current one - see lGeneration
+
+		gen = lGeneration[0]
+		node = self
+		while node and (node.generation != gen):
+			node.generation = gen
+			node = node.parent
+
+	def labelChanged(self):
+		# --- Called before this node's label is changed
+
+		self.markChanged()
+		parent = self.parent
+		if parent and (parent.classified != None):
+			parent.classified = None
+
 	def __len__(self):
 		return len(self.hData)
 
@@ -121,12 +286,7 @@ class TreeNode(collections.abc.MutableMapping):
 
 	def numChildren(self):
 
-		n = 0
-		node = self.firstChild
-		while node:
-			n += 1
-			node = node.nextSibling
-		return n
+		return self.nChildren
 
 	def children(self):
 
@@ -136,58 +296,234 @@ class TreeNode(collections.abc.MutableMapping):
 			child = child.nextSibling
 
 	def descendents(self, level=0):
+		# --- Pre-order, i.e. each node before its children
+		#     An explicit stack is used instead of recursion, so there's
+		#     no limit on the depth, and each node is yielded directly
+		#     rather than through a generator per level.
+		#     lStack[-1] is the next node at the deepest level
 
-		# --- First, visit the node itself
 		yield (level, self)
-
-		# --- Next, visit all of the node's descendents
-		child = self.firstChild
-		while (child):
-			yield from child.descendents(level+1)
-			child = child.nextSibling
+		lStack = [self.firstChild]
+		while lStack:
+			node = lStack[-1]
+			if node is None:
+				lStack.pop()
+				if lStack:
+					lStack[-1] = lStack[-1].nextSibling
+				continue
+			yield (level + len(lStack), node)
+			lStack.append(node.firstChild)
 
 	def followingNodes(self, level=0):
+		# --- This node and its descendents, then each following
+		#     sibling and its descendents
 
-		# --- First, visit the node itself
-		yield (level, self)
+		node = self
+		while node is not None:
+			yield from node.descendents(level)
+			node = node.nextSibling
 
-		# --- Next, visit all of the node's descendents
-		child = self.firstChild
-		while (child):
-			yield from child.descendents(level+1)
-			child = child.nextSibling
+	def walkPreOrder(self, level=0):
+
+		return self.descendents(level)
+
+	def walkPostOrder(self, level=0):
+		# --- Each node after its children
+		#     lStack holds [node, next child to visit] for each level
+
+		lStack = [[self, self.firstChild]]
+		while lStack:
+			entry = lStack[-1]
+			child = entry[1]
+			if child is None:
+				lStack.pop()
+				yield (level + len(lStack), entry[0])
+			else:
+				entry[1] = child.nextSibling
+				lStack.append([child, child.firstChild])
 
-		# --- Next, visit siblings and their descendents
-		node = self.nextSibling
-		while node:
+	def walkBreadthFirst(self, level=0):
+		# --- All nodes at one level before any at the next level
+
+		queue = collections.deque([(level, self)])
+		while queue:
+			(level, node) = queue.popleft()
 			yield (level, node)
 			child = node.firstChild
-			while (child):
-				yield from child.descendents(level+1)
+			while child is not None:
+				queue.append((level+1, child))
 				child = child.nextSibling
-			node = node.nextSibling
+
+	def walkPruned(self, prune, level=0):
+		# --- Like descendents(), but when prune(level, node) returns
+		#     True, that node is yielded, but its descendents are not
+
+		yield (level, self)
+		if prune(level, self):
+			return
+		lStack = [self.firstChild]
+		while lStack:
+			node = lStack[-1]
+			if node is None:
+				lStack.pop()
+				if lStack:
+					lStack[-1] = lStack[-1].nextSibling
+				continue
+			yield (level + len(lStack), node)
+			if prune(level + len(lStack), node):
+				lStack[-1] = node.nextSibling
+			else:
+				lStack.append(node.firstChild)
 
 	def numNodes(self):
 
 		return ilen(self.descendents())
 
-	def asString(self, level=0, indent='\t'):
-
-		s = ''
-		cur = self
-		while cur:
-			for (level,node) in cur.descendents():
-				s += (indent * level) + node.hData['label'] + '\n'
-			cur = cur.nextSibling
-		return s
+	def iterLines(self, indent='\t', *, pll=False):
+		# --- Yields the lines of asString(), i.e. of this node, its
+		#     following siblings and all of their descendents
+		#
+		#     With pll=True, parsePLL() (with the default options)
+		#     gives back an equal tree: '#' in labels is escaped and
+		#     each node's HEREDOC strings follow it, each ended by a
+		#     blank line. ValueError is raised for a label or HEREDOC
+		#     string that would be read back differently - see
+		#     checkPLLLabel() and pllHereDocLines(). Marks aren't written
+
+		for (level, node) in self.followingNodes():
+			label = node['label']
+			if not pll:
+				yield (indent * level) + label + '\n'
+				continue
+
+			# --- len() is 1 for a node with only a label, which
+			#     is quicker to check than 'lHereDoc' in node
+			lHereDoc = None
+			if (len(node) > 1) and ('lHereDoc' in node):
+				lHereDoc = node['lHereDoc']
+			checkPLLLabel(label, len(lHereDoc) if lHereDoc else 0)
+
+			if '#' in label:
+				label = label.replace('#', '\\#')
+			yield (indent * level) + label + '\n'
+
+			if lHereDoc:
+				hereIndent = indent * (level + 1)
+				for text in lHereDoc:
+					yield from pllHereDocLines(text, hereIndent)
+					yield '\n'
+
+	def writeTo(self, fh, indent='\t', *, pll=True, chunkLines=1000):
+		# --- Writes iterLines() to fh, chunkLines lines at a time,
+		#     so a large tree never has to be held as one string
+
+		lChunk = []
+		for line in self.iterLines(indent, pll=pll):
+			lChunk.append(line)
+			if len(lChunk) >= chunkLines:
+				fh.write(''.join(lChunk))
+				lChunk.clear()
+		if lChunk:
+			fh.write(''.join(lChunk))
+
+	def buildIndex(self):
+		# --- Returns a TreeIndex of this node's descendents, for
+		#     finding nodes by path or first word - see TreeIndex.py
+
+		from TreeIndex import TreeIndex
+		return TreeIndex(self)
+
+	def diff(self, other):
+		# --- Returns an edit script that changes this tree into other,
+		#     for patchTree() - see TreeDiff.py
+
+		from TreeDiff import diffTrees
+		return diffTrees(self, other)
+
+	def freeze(self, table=None):
+		# --- Returns an immutable copy of this node and its descendents,
+		#     in which equal subtrees are one object - see SharedTree.py
+		#     Trees frozen with the same table share subtrees
+
+		from SharedTree import SharedTable
+		if table == None:
+			table = SharedTable()
+		return table.freeze(self)
+
+	def select(self, query, *, index=None, where=None):
+		# --- Returns a list of the nodes under this one that match
+		#     query, e.g. 'layout//button[name=ok]' - see TreeQuery.py
+		#     index, if given, must be this node's buildIndex()
+
+		from TreeQuery import select
+		return select(self, query, index=index, where=where)
+
+	def dump(self, fh, hSubTrees=None):
+		# --- Writes this node, its following siblings and all of their
+		#     descendents to binary file fh - see TreeFile.py
+
+		from TreeFile import writeTreeFile
+		writeTreeFile(self, fh, hSubTrees)
+
+	@classmethod
+	def load(cls, fh, key=None):
+		# --- Returns (rootNode, hSubTrees) from the output of dump(),
+		#     building nodes of this class. With key, only that
+		#     marked subtree is loaded. Subclasses whose nodes can't
+		#     be created from just a label override this - see
+		#     CompactNode.load()
+
+		from TreeFile import readTreeFile
+		return readTreeFile(fh, cls, key)
+
+	def asString(self, level=0, indent='\t', *, pll=False):
+
+		return ''.join(self.iterLines(indent, pll=pll))
 
 	# ------------------------------------------------------------------------
 	#      Utility Methods
 	# ------------------------------------------------------------------------
 
+	def classifyChildren(self):
+		# --- Returns (hOptions, lTrueChildren), where hOptions is built
+		#     from the children whose labels match reAssign, and
+		#     lTrueChildren is a list of the others. Each child's label
+		#     is matched once, and the result is kept in self.classified
+		#     until this node's children, or their labels, are changed
+		#     by TreeNode methods, so getOptions(), hasTrueChildren()
+		#     and trueChildren() together, with the default regexp,
+		#     cost one pass over the children.
+		#     The result must not be modified
+
+		cached = self.classified
+		if cached != None:
+			return cached
+
+		hOptions = {}
+		lTrueChildren = []
+		search = reAssign.search
+		child = self.firstChild
+		while (child):
+			r = search(child['label'])
+			if r:
+				hOptions[r.group(1)] = r.group(2)
+			else:
+				lTrueChildren.append(child)
+			child = child.nextSibling
+		cached = self.classified = (hOptions, lTrueChildren)
+		return cached
+
+	# ------------------------------------------------------------------------
+
 	def getOptions(self, *, re=reAssign):
 		# --- re must include 2 groups - name of option and value of option
-		#     only direct children are checked
+		#     only direct children are checked. Returns a new dict,
+		#     which the caller may change. With the default re, it's
+		#     a copy of classifyChildren()'s, so the labels aren't
+		#     matched again
+
+		if re is reAssign:
+			return dict(self.classifyChildren()[0])
 
 		hOptions = {}
 		for child in self.children():
@@ -204,6 +540,9 @@ class TreeNode(collections.abc.MutableMapping):
 
 	def hasTrueChildren(self, re=reAssign):
 
+		if re is reAssign:
+			return len(self.classifyChildren()[1]) > 0
+
 		child = self.firstChild
 		while (child):
 			label = child['label']
@@ -216,6 +555,10 @@ class TreeNode(collections.abc.MutableMapping):
 
 	def trueChildren(self, re=reAssign):
 
+		if re is reAssign:
+			yield from self.classifyChildren()[1]
+			return
+
 		child = self.firstChild
 		while (child):
 			label = child['label']
@@ -243,11 +586,8 @@ class TreeNode(collections.abc.MutableMapping):
 		if desc:
 			print('-'*6 + ' Tree \'' + desc + '\'')
 			print('-'*50)
-		cur = self
-		while cur:
-			for (level,node) in cur.descendents():
-				node.printNode(level, debug, indent)
-			cur = cur.nextSibling
+		for (level,node) in self.followingNodes():
+			node.printNode(level, debug, indent)
 		print('='*50)
 
 	def printNode(self, level=0, debug=True, indent=None):
@@ -272,6 +612,60 @@ class TreeNode(collections.abc.MutableMapping):
 
 # ---------------------------------------------------------------------------
 
+def checkLabel(label):
+	# --- label cannot be all whitespace nor start with whitespace
+
+	if isAllWhiteSpace(label):
+		raise Exception(f"Label '{traceStr(label)}' is all whitespace")
+	if (label.lstrip() != label):
+		raise Exception(f"Label '{traceStr(label)}' has leading whitespace")
+
+# ---------------------------------------------------------------------------
+
+def checkPLLLabel(label, numHereDoc=0):
+	# --- Raises ValueError unless parsePLL() would read back label,
+	#     written by iterLines(pll=True), unchanged and unmarked,
+	#     for a node with numHereDoc HEREDOC strings
+
+	if not label or label[0].isspace() or label[-1].isspace():
+		raise ValueError(f"Label '{traceStr(label)}' is empty, or starts"
+		                 " or ends with whitespace")
+	if label[0] == '*':
+		raise ValueError(f"Label '{traceStr(label)}' would be read"
+		                 " as a marked line")
+	if '\n' in label:
+		raise ValueError(f"Label '{traceStr(label)}' contains a newline")
+	n = label.count('<<<')
+	if n != numHereDoc:
+		raise ValueError(f"Label '{traceStr(label)}' has {n} HEREDOC"
+		                 f" markers, but the node has {numHereDoc}"
+		                 " HEREDOC strings")
+
+# ---------------------------------------------------------------------------
+
+def pllHereDocLines(text, indent):
+	# --- Yields the lines of HEREDOC string text, each one indented.
+	#     Only '\n' ends a line, as when parsing. Raises ValueError
+	#     unless parsePLL() would read them back as text, i.e. text
+	#     must be empty or end with '\n', have no blank lines, and
+	#     not start with whitespace (which would be taken as the
+	#     HEREDOC's indentation)
+
+	if text == '':
+		return
+	if (text[-1] != '\n') or text[0].isspace():
+		raise ValueError(f"HEREDOC string '{traceStr(text)}' must end"
+		                 " with a newline and not start with whitespace")
+	lLines = text[:-1].split('\n')
+	for line in lLines:
+		if isAllWhiteSpace(line):
+			raise ValueError(f"HEREDOC string '{traceStr(text)}'"
+			                 " contains a blank line")
+	for line in lLines:
+		yield indent + line + '\n'
+
+# ---------------------------------------------------------------------------
+
 def nodeStr(node):
 	# --- Cannot be a method because node can be None
 	#     e.g. nodeStr(somenode.nextSibling)
@@ -411,3 +805,194 @@ def test_8():
 			}
 
 
+
+def test_9():
+	# --- lastChild and nChildren are kept up to date
+	root = TreeNode('root')
+	for i in range(20_000):
+		TreeNode(f"stmt {i}").makeChildOf(root)
+	assert root.numChildren() == 20_000
+	assert root.lastChild['label'] == 'stmt 19999'
+
+	TreeNode('sibling').makeSiblingOf(root.firstChild)
+	root.appendChild('child')
+	root.firstChild.append('appended')
+	assert root.numChildren() == 20_003
+	assert [node['label'] for node in root.children()][-3:] \
+	       == ['sibling', 'child', 'appended']
+	assert root.lastChild['label'] == 'appended'
+	assert root.lastChild.parent is root
+
+def test_10():
+	root = TreeNode('root').appendChild('a').appendChild('b')
+	new = root.lastChild.replaceWith(TreeNode('c'))
+	assert root.lastChild is new
+	assert root.numChildren() == 2
+
+	# --- appending a chain of siblings
+	chain = TreeNode('x').append('y')
+	root.appendChildNode(chain)
+	assert root.numChildren() == 4
+	assert root.lastChild['label'] == 'y'
+	assert root.lastChild.parent is root
+
+def test_11():
+	def labels(walker):
+		return [(level, node['label']) for (level, node) in walker]
+
+	assert labels(test_tree.walkPreOrder()) == [
+		(0, 'top'), (1, 'peach'), (2, 'fuzzy navel'), (2, 'pink'),
+		(1, 'apple'), (2, 'red'),
+		]
+	assert labels(test_tree.walkPostOrder()) == [
+		(2, 'fuzzy navel'), (2, 'pink'), (1, 'peach'),
+		(2, 'red'), (1, 'apple'), (0, 'top'),
+		]
+	assert labels(test_tree.walkBreadthFirst()) == [
+		(0, 'top'), (1, 'peach'), (1, 'apple'),
+		(2, 'fuzzy navel'), (2, 'pink'), (2, 'red'),
+		]
+	assert labels(test_tree.walkPruned(
+			lambda level, node: node['label'] == 'peach')) == [
+		(0, 'top'), (1, 'peach'), (1, 'apple'), (2, 'red'),
+		]
+	assert labels(test_tree.walkPruned(lambda level, node: True)) \
+	       == [(0, 'top')]
+	assert labels(test_tree.firstChild.followingNodes(1)) == [
+		(1, 'peach'), (2, 'fuzzy navel'), (2, 'pink'),
+		(1, 'apple'), (2, 'red'),
+		]
+
+def test_12():
+	# --- much deeper than the recursion limit
+	depth = 3 * sys.getrecursionlimit()
+	root = node = TreeNode('level 0')
+	for i in range(1, depth+1):
+		node = TreeNode(f"level {i}").makeChildOf(node)
+	node.append('last')
+
+	assert root.numNodes() == depth + 2
+	assert max(level for (level, node) in root.descendents()) == depth
+	assert next(root.walkPostOrder()) == (depth, node)
+	assert ilen(root.walkBreadthFirst()) == depth + 2
+	assert root.asString(indent='').count('\n') == depth + 2
+
+def test_13():
+	from PLLParser import parsePLL
+
+	# --- rmPrefix() would remove the blank lines ending the HEREDOCs
+	s = ('main\n'
+	     '\tcolor = \\#abcdef   # a comment\n'
+	     '\tscript <<< <<<\n'
+	     '\t\tline one\n'
+	     '\t\t\tindented\n'
+	     '\n'
+	     '\t\tsecond\n'
+	     '\n'
+	     '\tnext\n')
+	(tree, h) = parsePLL(s)
+	assert tree.asString() == 'main\n\tcolor = #abcdef\n' \
+	                          '\tscript <<< <<<\n\tnext\n'
+	assert tree.asString(pll=True) \
+	       == s.replace('   # a comment', '')
+
+	fh = io.StringIO()
+	tree.writeTo(fh, chunkLines=2)
+	(tree2, h2) = parsePLL(fh.getvalue())
+	assert tree2.asString(pll=True) == tree.asString(pll=True)
+	assert tree2.firstChild['label'] == 'color = #abcdef'
+	assert tree2.firstChild.nextSibling['lHereDoc'] \
+	       == ['line one\n\tindented\n', 'second\n']
+
+def test_14():
+	from PLLParser import parsePLL
+	from genPLL import genPLL
+
+	(tree, h) = parsePLL(genPLL(2000, hereDocDensity=0.1))
+	fh = io.StringIO()
+	tree.writeTo(fh)
+	(tree2, h2) = parsePLL(fh.getvalue())
+	assert [(level, dict(node)) for (level, node) in tree2.descendents()] \
+	       == [(level, dict(node)) for (level, node) in tree.descendents()]
+
+def test_15():
+	from PLLParser import parsePLL
+
+	(tree, h) = parsePLL('''
+		menu
+			File
+				emit = file
+				New
+					emit = new
+				Open...
+			align = left
+		''')
+	assert tree.getOptions() == {'align': 'left'}
+	assert tree.hasTrueChildren()
+	assert [node['label'] for node in tree.trueChildren()] == ['File']
+	fileNode = tree.firstChild
+	assert fileNode.getOptions() == {'emit': 'file'}
+	assert [node['label'] for node in fileNode.trueChildren()] \
+	       == ['New', 'Open...']
+	assert not fileNode.firstChild.nextSibling.nextSibling.hasTrueChildren()
+
+	# --- the options are only found once, and each caller gets
+	#     a copy, which it can change
+	hOptions = tree.getOptions()
+	hOptions['align'] = 'right'
+	assert tree.getOptions() == {'align': 'left'}
+	assert tree.getOptions() is not tree.getOptions()
+	assert tree.classifyChildren() is tree.classifyChildren()
+
+	# --- changing another tree doesn't affect it
+	(other, h) = parsePLL('main\n\tsub\n')
+	other.firstChild['label'] = 'changed'
+	other.firstChild.detach()
+	assert tree.classified != None
+
+	# --- changes to the tree are seen
+	tree.appendChild('width = 100')
+	assert tree.getOptions() == {'align': 'left', 'width': '100'}
+	tree.lastChild['label'] = 'Help'
+	assert tree.getOptions() == {'align': 'left'}
+	assert [node['label'] for node in tree.trueChildren()] \
+	       == ['File', 'Help']
+
+	# --- other regexps aren't cached
+	reColon = re.compile(r'^(\S+):\s+(.*)$')
+	tree.appendChild('height: 20')
+	assert tree.getOptions(re=reColon) == {'height': '20'}
+	assert 'height: 20' in [n['label'] for n in tree.trueChildren()]
+	assert [n['label'] for n in tree.trueChildren(reColon)] \
+	       == ['File', 'align = left', 'Help']
+
+def test_16():
+	from PLLParser import parsePLL
+
+	# --- labels and HEREDOCs that do round-trip, including
+	#     characters that str.splitlines() would split on
+	tree = TreeNode('main')
+	for label in ['a\\#b # c', 'x\ry\x0bz\x0c.\x1c\x85\u2028\u2029!', 'p*q']:
+		tree.appendChild(label)
+	node = TreeNode('code <<< <<<')
+	node['lHereDoc'] = ['one\rtwo\x1d\n\tthree # x\n', '']
+	tree.appendChildNode(node)
+	(tree2, h2) = parsePLL(tree.asString(pll=True))
+	assert [dict(node) for (level, node) in tree2.descendents()] \
+	       == [dict(node) for (level, node) in tree.descendents()]
+
+	# --- ones that don't
+	for label in ['*marked', 'a <<< b', 'trailing ', 'two\nlines']:
+		tree = TreeNode('main').appendChild('ok')
+		tree.firstChild.hData['label'] = label
+		with pytest.raises(ValueError):
+			tree.asString(pll=True)
+	for text in ['no newline', ' indented\n', 'blank\n\nline\n']:
+		tree = TreeNode('main').appendChild('code <<<')
+		tree.firstChild['lHereDoc'] = [text]
+		with pytest.raises(ValueError):
+			tree.asString(pll=True)
+	tree = TreeNode('main').appendChild('code')
+	tree.firstChild['lHereDoc'] = ['text\n']
+	with pytest.raises(ValueError):
+		tree.asString(pll=True)
@@ -0,0 +1,379 @@
+# TreeQuery.py
+
+"""
+select nodes from a tree with path-like queries, e.g.
+
+   layout//Turtle[name=turtle]
+   menubar/*/Save*
+   //button[width>=100]
+"""
+
+import re, fnmatch, pytest
+
+from myutils import cleanup_testcode, firstWordOf, traceStr
+
+reStep = re.compile(r'\s*([^/\[\]]+?)\s*((?:\[[^\]]*\]\s*)*)(?=/|$)')
+rePred = re.compile(r'\[\s*([^\s=!<>\]]+)\s*'
+                    r'(?:(=|!=|<=|>=|<|>)\s*([^\]]*?))?\s*\]')
+
+# ---------------------------------------------------------------------------
+
+class Step():
+	# --- One step of a query, i.e. the part between slashes
+	#        axis     - 'child' or 'descendent'
+	#        pattern  - '*' for any node, else a glob pattern, matched
+	#                   against both the label and its first word,
+	#                   or, if it's in double quotes, just the label
+	#        lPreds   - (name, op, value) tuples, tested against the
+	#                   node's getOptions(), where op is None to just
+	#                   check that there's an option name
+
+	def __init__(self, axis, pattern, lPreds):
+
+		self.axis = axis
+		self.pattern = pattern
+		self.lPreds = lPreds
+
+		# --- A pattern with no wildcards is compared directly, and can
+		#     use a TreeIndex, since any label it matches has the same
+		#     first word as the pattern does
+		self.literal = None
+		self.regex = None
+		self.labelOnly = (len(pattern) > 1) \
+			and pattern.startswith('"') and pattern.endswith('"')
+		if self.labelOnly:
+			pattern = pattern[1:-1]
+		if pattern == '*':
+			pass
+		elif not any(ch in pattern for ch in '*?['):
+			self.literal = pattern
+		else:
+			self.regex = re.compile(fnmatch.translate(pattern))
+
+	# ------------------------------------------------------------------------
+
+	def matches(self, node, getOptions):
+
+		label = node['label']
+		if self.literal != None:
+			if (label != self.literal) and (self.labelOnly
+					or (firstWordOf(label) != self.literal)):
+				return False
+		elif self.regex != None:
+			if not (self.regex.match(label) or (not self.labelOnly
+					and self.regex.match(firstWordOf(label)))):
+				return False
+
+		if self.lPreds:
+			hOptions = getOptions(node)
+			for (name, op, value) in self.lPreds:
+				if not optionMatches(hOptions, name, op, value):
+					return False
+		return True
+
+# ---------------------------------------------------------------------------
+
+def optionMatches(hOptions, name, op, value):
+
+	if name not in hOptions:
+		return False
+	if op == None:
+		return True
+	option = hOptions[name]
+	if op == '=':
+		return option == value
+	if op == '!=':
+		return option != value
+	try:
+		(option, value) = (float(option), float(value))
+	except ValueError:
+		return False
+	if op == '<':
+		return option < value
+	if op == '<=':
+		return option <= value
+	if op == '>':
+		return option > value
+	return option >= value
+
+# ---------------------------------------------------------------------------
+
+def keyFuncFor(node):
+	# --- Returns a function giving a set key for nodes like node
+	#     TreeNodes aren't hashable, since they're mappings, and are
+	#     the same node only if they're the same object. CompactNode
+	#     views are hashable, and equal if they're the same node
+
+	return id if (node.__hash__ == None) else (lambda node: node)
+
+# ---------------------------------------------------------------------------
+
+class Query():
+	# --- A compiled query - see compileQuery()
+
+	def __init__(self, text, lSteps):
+
+		self.text = text
+		self.lSteps = lSteps
+
+	# ------------------------------------------------------------------------
+
+	def run(self, rootNode, *, index=None, where=None):
+		# --- Returns the matching nodes under rootNode, in tree order
+		#     index, if given, must be a TreeIndex of rootNode, and is
+		#     used instead of walking the tree where possible.
+		#     where, if given, is called with each matching node, and
+		#     the node is dropped if it returns False
+
+		if (index != None) and (index.rootNode is not rootNode):
+			raise ValueError("Query.run(): index is not for rootNode")
+
+		nodeKey = keyFuncFor(rootNode)
+		hOptions = {}     # getOptions() of each node tested
+		def getOptions(node):
+			key = nodeKey(node)
+			options = hOptions.get(key)
+			if options == None:
+				options = hOptions[key] = node.getOptions()
+			return options
+
+		lNodes = [rootNode]
+		for step in self.lSteps:
+			if (index != None) and (step.literal != None):
+				lNodes = self.indexedStep(step, lNodes, index, getOptions,
+				                          nodeKey)
+			elif step.axis == 'child':
+				lNodes = [child for node in lNodes
+				                for child in node.children()
+				                if step.matches(child, getOptions)]
+			else:
+				lNodes = self.descendentStep(step, lNodes, getOptions,
+				                             nodeKey)
+			if not lNodes:
+				return []
+
+		if where != None:
+			lNodes = [node for node in lNodes if where(node)]
+		return lNodes
+
+	# ------------------------------------------------------------------------
+
+	def descendentStep(self, step, lNodes, getOptions, nodeKey):
+
+		lResult = []
+		hSeen = set()
+		for node in lNodes:
+			lDesc = node.descendents()
+			next(lDesc)      # skip the node itself
+			for (level, desc) in lDesc:
+				if step.matches(desc, getOptions):
+					key = nodeKey(desc)
+					if key not in hSeen:
+						hSeen.add(key)
+						lResult.append(desc)
+		return lResult
+
+	# ------------------------------------------------------------------------
+
+	def indexedStep(self, step, lNodes, index, getOptions, nodeKey):
+		# --- Every node whose label matches step.literal has the same
+		#     first word, so the candidates are found with one lookup
+
+		lCandidates = index.withFirstWord(firstWordOf(step.literal))
+		if (step.axis == 'descendent') and (len(lNodes) == 1) \
+				and (lNodes[0] is index.rootNode):
+			# --- every node in the index is a descendent of its root
+			return [node for node in lCandidates
+			             if step.matches(node, getOptions)]
+		if (step.axis == 'child') and (len(lCandidates)
+				> sum(node.numChildren() for node in lNodes)):
+			return [child for node in lNodes
+			              for child in node.children()
+			              if step.matches(child, getOptions)]
+
+		hContext = {nodeKey(node) for node in lNodes}
+		lResult = []
+		for node in lCandidates:
+			if not step.matches(node, getOptions):
+				continue
+			parent = node.parent
+			if step.axis == 'child':
+				if (parent is not None) and (nodeKey(parent) in hContext):
+					lResult.append(node)
+				continue
+			while parent is not None:
+				if nodeKey(parent) in hContext:
+					lResult.append(node)
+					break
+				parent = parent.parent
+		return lResult
+
+	# ------------------------------------------------------------------------
+
+	def __repr__(self):
+
+		return f"Query({self.text!r})"
+
+# ---------------------------------------------------------------------------
+
+def compileQuery(text):
+	# --- Returns a Query. Steps are separated by '/', for children of
+	#     the previous step's nodes, or '//', for any descendents.
+	#     The first step is relative to the node the query is run on,
+	#     i.e. 'menubar' is a child, '//menubar' any descendent.
+	#     A step is a glob pattern, matched against each node's label
+	#     or its first word - or, in double quotes, just the label, so
+	#     "Save" doesn't match 'Save As...' - followed by any number
+	#     of option tests:
+	#        [name]          - there's an option name
+	#        [name=value]    - there's one, with the value value
+	#        [name!=value]   - there's one, with a different value
+	#        [name<value]    - numeric comparisons, also <=, > and >=
+	#     Labels containing '/', '[' or ']' can't be matched exactly
+
+	lSteps = []
+	pos = 0
+	while pos < len(text):
+		if text.startswith('//', pos):
+			axis = 'descendent'
+			pos += 2
+		else:
+			axis = 'child'
+			if text.startswith('/', pos):
+				pos += 1
+
+		result = reStep.match(text, pos)
+		if not result:
+			raise SyntaxError(f"Bad query '{traceStr(text)}'"
+			                  f" at position {pos}")
+		(pattern, preds) = result.groups()
+		lPreds = []
+		if preds:
+			if rePred.sub('', preds).strip():
+				raise SyntaxError(f"Bad option test '{preds}'"
+				                  f" in query '{traceStr(text)}'")
+			lPreds = [(name, op or None, value)
+			          for (name, op, value) in rePred.findall(preds)]
+		lSteps.append(Step(axis, pattern, lPreds))
+		pos = result.end()
+
+	if not lSteps:
+		raise SyntaxError("Empty query")
+	return Query(text, lSteps)
+
+# ---------------------------------------------------------------------------
+
+hCompiled = {}       # compiled queries, by text
+
+def select(rootNode, text, *, index=None, where=None):
+	# --- Like compileQuery(text).run(...), but each query is
+	#     compiled only once
+
+	query = hCompiled.get(text)
+	if query == None:
+		if len(hCompiled) >= 512:
+			hCompiled.clear()
+		query = hCompiled[text] = compileQuery(text)
+	return query.run(rootNode, index=index, where=where)
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+test_str = '''
+	Turtle Graphics
+		*menubar
+			File
+				New
+				Save
+				Save As...
+				Exit
+			Edit
+				Save Selection
+		*layout
+			row
+				label Turtle Program
+				label Python Program
+			row
+				EditField
+					name = turtleCode
+					width = 100
+				Turtle
+					name = turtle
+					width = 250
+				Turtle
+					name = other
+	'''
+
+def labelsOf(lNodes):
+
+	return [node['label'] for node in lNodes]
+
+def test_1():
+	query = compileQuery('layout//Turtle[name=turtle]')
+	assert [(s.axis, s.pattern, s.lPreds) for s in query.lSteps] == [
+		('child', 'layout', []),
+		('descendent', 'Turtle', [('name', '=', 'turtle')]),
+		]
+	query = compileQuery('//label [ width ] [x >= 3]')
+	assert query.lSteps[0].lPreds == [('width', None, ''), ('x', '>=', '3')]
+
+	for text in ['', 'a[b', 'a]', 'a/[x]', 'a[=3]']:
+		with pytest.raises(SyntaxError):
+			compileQuery(text)
+
+def test_2():
+	from PLLParser import parsePLL
+
+	(tree, hSubTrees) = parsePLL(test_str)
+	index = tree.buildIndex()
+	for idx in [None, index]:
+		def run(text, **kwargs):
+			return select(tree, text, index=idx, **kwargs)
+
+		lNodes = run('layout//Turtle[name=turtle]')
+		assert len(lNodes) == 1
+		assert lNodes[0].getOptions()['width'] == '250'
+
+		assert labelsOf(run('menubar/*/Save*')) \
+		       == ['Save', 'Save As...', 'Save Selection']
+		assert labelsOf(run('menubar/File/Save')) == ['Save', 'Save As...']
+		assert labelsOf(run('menubar/File/"Save"')) == ['Save']
+		assert labelsOf(run('//"Save*"')) \
+		       == ['Save', 'Save As...', 'Save Selection']
+		assert labelsOf(run('//"Turtle"[name=other]')) == ['Turtle']
+		assert run('//"label"') == []
+		assert labelsOf(run('//label')) \
+		       == ['label Turtle Program', 'label Python Program']
+		assert labelsOf(run('//row/label Python Program')) \
+		       == ['label Python Program']
+		assert labelsOf(run('//*[width>=100]')) == ['EditField', 'Turtle']
+		assert labelsOf(run('//*[width>100]')) == ['Turtle']
+		assert labelsOf(run('//Turtle[name!=turtle]')) == ['Turtle']
+		assert labelsOf(run('//Turtle[name]')) == ['Turtle', 'Turtle']
+		assert run('//Turtle', where=lambda node: 'width' in
+		           node.getOptions())[0] is lNodes[0]
+		assert run('menubar//Turtle') == []
+		assert run('Turtle') == []
+		assert labelsOf(run('//layout//EditField')) == ['EditField']
+
+	with pytest.raises(ValueError):
+		select(hSubTrees['layout'], '//row', index=index)
+
+def test_3():
+	from PLLParser import parsePLL
+	from genPLL import genPLL
+
+	# --- using the index gives the same results, in the same order
+	(tree, hSubTrees) = parsePLL(genPLL(3000))
+	index = tree.buildIndex()
+	for text in ['//row', '//row/col', '//row//button OK', '*/turn 90',
+	             '//move[width=100]', '//col//*[align]', '*/*/EditField']:
+		lNodes = select(tree, text)
+		assert lNodes
+		assert list(map(id, select(tree, text, index=index))) \
+		       == list(map(id, lNodes))
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing
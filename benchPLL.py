@@ -0,0 +1,289 @@
+# benchPLL.py
+
+"""
+benchmark the PLL parser - reports lines/sec
+
+usage: python benchPLL.py [lexer|validate|intern|stats|parallel] [numLines ...]
+       python benchPLL.py suite [numLines ...] [results.json]
+       python benchPLL.py compare old.json new.json
+"""
+
+import sys, os, gc, time, json, platform, subprocess
+from more_itertools import ilen
+
+from TreeNode import TreeNode
+from PLLParser import PLLParser, parsePLL
+from InternTable import InternTable
+from CompactTree import CompactTree
+from genPLL import genPLL
+
+lDefSizes = [10_000, 100_000, 1_000_000]
+lSuiteSizes = [1_000, 10_000, 100_000, 1_000_000]
+defResultsFile = 'benchPLL.json'
+
+# ---------------------------------------------------------------------------
+
+def genDoc(numLines):
+	# --- A repetitive turtle-like program, with comments,
+	#     marked lines, continuation lines and HEREDOCs
+
+	lBlock = [
+		'at 0, 0    # start here\n',
+		'\trepeat 4\n',
+		'\t\tmove 50\n',
+		'\t\tturn 90\n',
+		'\t*shape\n',
+		'\t\tcolor = \\#abcdef\n',
+		'\t\tfill\n',
+		'\t\t\t\tcontinued\n',
+		'\n',
+		'\tscript <<<\n',
+		'\t\tprint("hello")\n',
+		'\n',
+		]
+	n = len(lBlock)
+	return ''.join(lBlock * (numLines // n))
+
+# ---------------------------------------------------------------------------
+
+def timeIt(func):
+
+	start = time.perf_counter()
+	func()
+	return time.perf_counter() - start
+
+# ---------------------------------------------------------------------------
+
+def benchLexer(lSizes=lDefSizes):
+
+	for numLines in lSizes:
+		text = genDoc(numLines)
+		numLines = text.count('\n')
+		print(f"{numLines:>10,} lines:")
+		for (desc, hOptions) in [('splitLine', {}),
+		                         ('lexLine',   {'fastLexer': True})]:
+			secs = timeIt(lambda: ilen(PLLParser(hOptions=hOptions)
+			                           ._tokens(text)))
+			print(f"   {desc:<10} lex   {numLines/secs:>12,.0f} lines/sec")
+			secs = timeIt(lambda: PLLParser(hOptions=hOptions).parse(text))
+			print(f"   {desc:<10} parse {numLines/secs:>12,.0f} lines/sec")
+
+		# --- parsing directly from a bytes buffer
+		buf = text.encode('utf-8')
+		secs = timeIt(lambda: PLLParser(hOptions={'fastLexer': True})
+		                      .parse(buf))
+		print(f"   {'buffer':<10} parse {numLines/secs:>12,.0f} lines/sec")
+
+# ---------------------------------------------------------------------------
+
+def benchValidate(lSizes=lDefSizes):
+
+	for numLines in lSizes:
+		text = genDoc(numLines)
+		numLines = text.count('\n')
+		print(f"{numLines:>10,} lines:")
+		parseSecs = timeIt(lambda: PLLParser().parse(text))
+		print(f"   parse      {numLines/parseSecs:>12,.0f} lines/sec")
+		secs = timeIt(lambda: PLLParser().validate(text))
+		print(f"   validate   {numLines/secs:>12,.0f} lines/sec"
+		      f"   ({parseSecs/secs:.1f}x faster)")
+
+# ---------------------------------------------------------------------------
+
+def benchIntern(lSizes=lDefSizes):
+
+	for numLines in lSizes:
+		text = genDoc(numLines)
+		numLines = text.count('\n')
+		print(f"{numLines:>10,} lines:")
+		secs = timeIt(lambda: PLLParser().parse(text))
+		print(f"   plain      {numLines/secs:>12,.0f} lines/sec")
+
+		table = InternTable()
+		lResult = []
+		secs = timeIt(lambda: lResult.append(PLLParser(intern=table)
+		                                     .parse(text)))
+		numNodes = ilen(lResult[0][0].followingNodes())
+		hStats = table.getStats()
+		print(f"   intern     {numLines/secs:>12,.0f} lines/sec")
+		print(f"   {numNodes:,} nodes, {len(table):,} distinct labels,"
+		      f" {hStats['savedBytes']:,} bytes saved")
+
+# ---------------------------------------------------------------------------
+
+def benchStats(lSizes=lDefSizes):
+	# --- Where does the parse time go?
+
+	for numLines in lSizes:
+		text = genDoc(numLines)
+		for hOptions in [{}, {'fastLexer': True}]:
+			parser = PLLParser(hOptions=hOptions, stats=True)
+			parser.parse(text)
+			print(f"--- {numLines:,} lines, options {hOptions}:")
+			print(parser.stats)
+
+# ---------------------------------------------------------------------------
+
+def benchParallel(lSizes=lDefSizes, jobs=None):
+	# --- parsePLLParallel() against parsePLL(), building TreeNodes,
+	#     then a CompactTree, which needs much less work in this
+	#     process once the workers are done. The CPU time used in
+	#     this process is shown too, since that part isn't spread
+	#     across the workers, and limits the speedup
+
+	from PLLBatch import parsePLLParallel
+
+	jobs = jobs or os.cpu_count() or 1
+	print(f"{jobs} jobs")
+	for numLines in lSizes:
+		text = genDoc(numLines)
+		numLines = text.count('\n')
+		print(f"{numLines:>10,} lines:")
+		for (desc, getConstructor) in [
+				('TreeNode',    lambda: TreeNode),
+				('CompactTree', lambda: CompactTree().newNode)]:
+			serialSecs = bestOf(lambda: parsePLL(text, getConstructor()),
+			                    numLines)
+			print(f"   {desc:<12} serial   {numLines/serialSecs:>12,.0f}"
+			      f" lines/sec")
+			lCPU = []
+			def parse():
+				start = time.process_time()
+				parsePLLParallel(text, jobs=jobs, constructor=getConstructor())
+				lCPU.append(time.process_time() - start)
+			secs = bestOf(parse, numLines)
+			print(f"   {desc:<12} parallel {numLines/secs:>12,.0f}"
+			      f" lines/sec   ({serialSecs/secs:.1f}x faster,"
+			      f" {min(lCPU)/serialSecs:.0%} of the serial time"
+			      f" is in this process)")
+
+# ---------------------------------------------------------------------------
+
+def bestOf(func, numLines):
+	# --- Returns the best time of several runs, fewer for big documents
+
+	numRuns = max(1, min(5, 1_000_000 // (numLines * 10)))
+	lTimes = []
+	for i in range(numRuns):
+		gc.collect()
+		lTimes.append(timeIt(func))
+	return min(lTimes)
+
+# ---------------------------------------------------------------------------
+
+def benchSuite(lSizes=lSuiteSizes, outPath=defResultsFile):
+	# --- Benchmarks the parser and the TreeNode hot paths on documents
+	#     from genPLL(), and writes the results to outPath as JSON,
+	#     for comparing runs with 'python benchPLL.py compare'
+
+	lResults = []
+	def addResult(name, numLines, numNodes, secs):
+		lResults.append({
+			'name':     name,
+			'numLines': numLines,
+			'numNodes': numNodes,
+			'secs':     secs,
+			})
+		print(f"   {name:<18} {secs:>10.4f} secs"
+		      f" {numLines/secs:>12,.0f} lines/sec")
+
+	for numLines in lSizes:
+		text = genPLL(numLines)
+		numLines = text.count('\n')
+		print(f"{numLines:>10,} lines:")
+
+		(tree, hSubTrees) = parsePLL(text)
+		numNodes = tree.numNodes()
+		for (name, hOptions) in [('parsePLL', {}),
+		                         ('parsePLL fastLexer', {'fastLexer': True})]:
+			secs = bestOf(lambda: parsePLL(text, hOptions=hOptions), numLines)
+			addResult(name, numLines, numNodes, secs)
+
+		secs = bestOf(lambda: tree.asString(), numLines)
+		addResult('asString', numLines, numNodes, secs)
+
+		secs = bestOf(lambda: ilen(tree.descendents()), numLines)
+		addResult('descendents', numLines, numNodes, secs)
+
+		secs = bestOf(lambda: [node.getOptions()
+		                       for (level, node) in tree.descendents()],
+		              numLines)
+		addResult('getOptions', numLines, numNodes, secs)
+
+	hOutput = {
+		'commit':   getCommit(),
+		'date':     time.strftime('%Y-%m-%d %H:%M:%S'),
+		'python':   platform.python_version(),
+		'platform': platform.platform(),
+		'results':  lResults,
+		}
+	with open(outPath, 'w') as fh:
+		json.dump(hOutput, fh, indent='\t')
+	print(f"Results written to {outPath}")
+
+# ---------------------------------------------------------------------------
+
+def getCommit():
+	# --- Returns the current git commit, or None
+
+	try:
+		return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+		                      cwd=os.path.dirname(os.path.abspath(__file__)),
+		                      capture_output=True, text=True,
+		                      check=True).stdout.strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+# ---------------------------------------------------------------------------
+
+def compareResults(oldPath, newPath):
+	# --- Prints the ratio of new to old times - above 1.0 is slower
+
+	lOutputs = []
+	for path in [oldPath, newPath]:
+		with open(path) as fh:
+			lOutputs.append(json.load(fh))
+	(hOld, hNew) = lOutputs
+	print(f"old: {hOld['commit']} {hOld['date']}")
+	print(f"new: {hNew['commit']} {hNew['date']}")
+
+	hOldSecs = {(h['name'], h['numLines']): h['secs']
+	            for h in hOld['results']}
+	for h in hNew['results']:
+		key = (h['name'], h['numLines'])
+		if key in hOldSecs:
+			ratio = h['secs'] / hOldSecs[key]
+			flag = '  <-- slower' if (ratio > 1.1) else ''
+			print(f"   {h['name']:<18} {h['numLines']:>10,}"
+			      f" {ratio:>8.2f}{flag}")
+
+# ---------------------------------------------------------------------------
+
+if __name__ == '__main__':
+	lArgs = sys.argv[1:]
+	which = 'lexer'
+	if lArgs and not lArgs[0].isdigit():
+		which = lArgs.pop(0)
+	if which == 'compare':
+		compareResults(*lArgs)
+		sys.exit(0)
+	outPath = defResultsFile
+	if lArgs and lArgs[-1].endswith('.json'):
+		outPath = lArgs.pop()
+	lSizes = [int(arg) for arg in lArgs]
+	if which == 'suite':
+		benchSuite(lSizes or lSuiteSizes, outPath)
+		sys.exit(0)
+	lSizes = lSizes or lDefSizes
+	if which == 'lexer':
+		benchLexer(lSizes)
+	elif which == 'validate':
+		benchValidate(lSizes)
+	elif which == 'intern':
+		benchIntern(lSizes)
+	elif which == 'stats':
+		benchStats(lSizes)
+	elif which == 'parallel':
+		benchParallel(lSizes)
+	else:
+		raise Exception(f"Unknown benchmark: '{which}'")
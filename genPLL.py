@@ -0,0 +1,135 @@
+# genPLL.py
+
+"""
+generate synthetic PLL documents, e.g. for benchmarking
+
+usage: python genPLL.py numLines [seed] > file.pll
+"""
+
+import sys, random, pytest
+
+from myutils import cleanup_testcode
+
+lDefLabels = [
+	'move 50', 'turn 90', 'repeat 4', 'row', 'col', 'label Hello',
+	'button OK', 'EditField', 'menu File', 'item Open',
+	]
+lDefOptions = [
+	'align = left', 'width = 100', 'color = \\#abcdef', 'flow=down',
+	]
+lDefComments = [
+	'# what this does', '# TODO: simplify',
+	]
+lDefText = [
+	'my $evt = $_[0];', 'return undef;', 'print("hello")',
+	'\tif (x > 0) { x -= 1; }',
+	]
+
+# ---------------------------------------------------------------------------
+
+def genPLL(numLines, *, maxDepth=6,
+                        fanOut=4,
+                        numOptions=1,
+                        hereDocDensity=0.02,
+                        hereDocLines=5,
+                        commentDensity=0.05,
+                        numMarked=10,
+                        seed=0):
+	# --- Returns a string holding a single tree of about numLines lines
+	#     (a HEREDOC is never cut short, so there may be a few more)
+	#
+	#        maxDepth       - deepest level of any node, the root being 0
+	#        fanOut         - average number of children of a node
+	#                         above maxDepth, not counting options
+	#        numOptions     - average number of 'name = value' children
+	#        hereDocDensity - fraction of nodes with a HEREDOC
+	#        hereDocLines   - average number of lines in a HEREDOC
+	#        commentDensity - fraction of nodes preceded by a comment line
+	#        numMarked      - number of marked subtrees, each with a
+	#                         distinct key, i.e. 'mark1', 'mark2', ...
+	#
+	#     The same arguments always produce the same document
+
+	rng = random.Random(seed)
+	lLines = ['document\n']
+	lNodes = []      # indexes of lines that may be marked
+
+	# --- (level, number of children still to generate)
+	lStack = [(0, sys.maxsize)]
+	while lStack and (len(lLines) < numLines):
+		(level, numLeft) = lStack.pop()
+		if numLeft == 0:
+			continue
+		lStack.append((level, numLeft - 1))
+		level += 1
+		indent = '\t' * level
+
+		if rng.random() < commentDensity:
+			lLines.append(indent + rng.choice(lDefComments) + '\n')
+
+		lNodes.append(len(lLines))
+		label = rng.choice(lDefLabels)
+		if rng.random() < hereDocDensity:
+			lLines.append(f"{indent}{label} <<<\n")
+			for i in range(rng.randint(1, 2 * hereDocLines - 1)):
+				text = rng.choice(lDefText)
+				if i == 0:
+					text = text.lstrip()   # sets the HEREDOC's indentation
+				lLines.append(f"{indent}\t{text}\n")
+			lLines.append('\n')
+			continue
+
+		lLines.append(f"{indent}{label}\n")
+		if level < maxDepth:
+			for i in range(rng.randint(0, 2 * numOptions)):
+				lLines.append(f"{indent}\t{rng.choice(lDefOptions)}\n")
+			lStack.append((level, rng.randint(0, 2 * fanOut)))
+
+	for (i, pos) in enumerate(rng.sample(lNodes, min(numMarked, len(lNodes)))):
+		line = lLines[pos]
+		level = len(line) - len(line.lstrip('\t'))
+		lLines[pos] = f"{line[:level]}*mark{i+1} {line[level:]}"
+
+	return ''.join(lLines)
+
+# ---------------------------------------------------------------------------
+
+if __name__ == '__main__':
+	numLines = int(sys.argv[1])
+	seed = int(sys.argv[2]) if (len(sys.argv) > 2) else 0
+	sys.stdout.write(genPLL(numLines, seed=seed))
+
+# ---------------------------------------------------------------------------
+#                   UNIT TESTS
+# ---------------------------------------------------------------------------
+
+def test_1():
+	from PLLParser import parsePLL
+
+	text = genPLL(2000, numMarked=25)
+	assert 2000 <= text.count('\n') < 2000 + 20
+	assert text == genPLL(2000, numMarked=25)
+	assert text != genPLL(2000, numMarked=25, seed=1)
+
+	(tree, hSubTrees) = parsePLL(text)
+	assert tree.nextSibling == None
+	assert sorted(hSubTrees.keys()) \
+	       == sorted(f"mark{i}" for i in range(1, 26))
+
+def test_2():
+	from PLLParser import parsePLL
+
+	text = genPLL(500, maxDepth=2, hereDocDensity=0.0, commentDensity=0.0)
+	assert '<<<' not in text
+	assert '#' not in text.replace('\\#', '')
+	(tree, hSubTrees) = parsePLL(text)
+	assert max(level for (level, node) in tree.descendents()) <= 2
+
+def test_3():
+	text = genPLL(1000, hereDocDensity=1.0, commentDensity=1.0)
+	assert text.count('<<<') > 50
+	assert text.count('# ') > 50
+
+# ---------------------------------------------------------------------------
+
+cleanup_testcode(globals())   # remove unit tests when not testing